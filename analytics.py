@@ -0,0 +1,222 @@
+"""
+Running sales and stock-valuation rollups.
+
+Analytics listens to the InventoryStore: every reload rebuilds the rollups
+from all rows at once (vectorized with numpy when it is installed), and
+every change after that - a sale, a restock, an edited row, a new item -
+adjusts only the groups it touches. Reading a group is a dict lookup.
+
+Stock value is `price * remaining_qty` per item. Sold prices are per unit,
+so revenue is `quantity * sold_price` and a sale's cost is `quantity *`
+the item's inventory `price`; margin is revenue minus cost.
+"""
+import functools
+import threading
+
+from inventory_store import (
+    COL_ITEM, COL_STORAGE_LOCATION, COL_BOX_LABEL, COL_PRICE, COL_REMAINING_QTY, COL_PLACE_BOUGHT,
+)
+
+try:
+    import numpy
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+# Stock can be valued by any of these inventory columns
+STOCK_DIMENSIONS = {
+    "storage_location": COL_STORAGE_LOCATION,
+    "box_label": COL_BOX_LABEL,
+    "place_bought": COL_PLACE_BOUGHT,
+}
+# Sales are rolled up by these keys; "supplier" is the item's place_bought
+SALES_DIMENSIONS = ("day", "month", "item", "supplier")
+
+STOCK_FIELDS = ("items", "units", "value")
+SALES_FIELDS = ("sales", "units", "revenue", "cost")
+
+UNKNOWN = "(none)"
+
+
+def _number(value, cast=float):
+    try:
+        return cast(str(value).replace("£", "").strip())
+    except (TypeError, ValueError):
+        return cast(0)
+
+
+@functools.lru_cache(maxsize=4096)
+def _sale_date(value):
+    """(day 'YYYY-MM-DD', month 'YYYY-MM') of a dd/mm/yyyy date, or UNKNOWN for both."""
+    parts = str(value).strip().split("/")
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return UNKNOWN, UNKNOWN
+    day, month, year = (int(part) for part in parts)
+    return f"{year:04d}-{month:02d}-{day:02d}", f"{year:04d}-{month:02d}"
+
+
+def _cell(row, col):
+    return row[col - 1] if row is not None and len(row) >= col else ""
+
+
+def _group_sums(keys, columns):
+    """{key: [sum of each column]} for parallel lists of keys and numeric columns."""
+    if not keys:
+        return {}
+    if HAVE_NUMPY:
+        unique, inverse = numpy.unique(numpy.array(keys, dtype=object).astype(str), return_inverse=True)
+        sums = [numpy.bincount(inverse, weights=numpy.asarray(column, dtype=float), minlength=len(unique))
+                for column in columns]
+        return dict(zip(unique.tolist(), numpy.column_stack(sums).tolist()))
+    groups = {}
+    for i, key in enumerate(keys):
+        totals = groups.setdefault(key, [0.0] * len(columns))
+        for j, column in enumerate(columns):
+            totals[j] += column[i]
+    return groups
+
+
+def _as_dict(totals, fields):
+    return dict(zip(fields, totals))
+
+
+class Analytics:
+    """Stock value per location/box/supplier and sales per day/month/item/supplier, kept up to date."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._stock = {dim: {} for dim in STOCK_DIMENSIONS}
+        self._stock_total = [0.0] * len(STOCK_FIELDS)
+        self._sales = {dim: {} for dim in SALES_DIMENSIONS}
+        self._supplier_month = {}    # month -> supplier -> totals
+        self._sales_total = [0.0] * len(SALES_FIELDS)
+
+    # --- Store listener ---
+
+    def reset(self, inventory, sales):
+        """Rebuild every rollup from all rows."""
+        prices = [_number(_cell(row, COL_PRICE)) for row in inventory]
+        remaining = [_number(_cell(row, COL_REMAINING_QTY), int) for row in inventory]
+        values = [p * r for p, r in zip(prices, remaining)]
+        ones = [1.0] * len(inventory)
+
+        stock = {dim: _group_sums([_cell(row, col) or UNKNOWN for row in inventory], [ones, remaining, values])
+                 for dim, col in STOCK_DIMENSIONS.items()}
+
+        # Cost price and supplier of each item name (first row wins, as in the store)
+        items = {}
+        for row, price in zip(inventory, prices):
+            items.setdefault(_cell(row, COL_ITEM), (price, _cell(row, COL_PLACE_BOUGHT) or UNKNOWN))
+
+        keys = {dim: [] for dim in SALES_DIMENSIONS}
+        supplier_month = []
+        counts, units, revenue, cost = [], [], [], []
+        for sale in sales:
+            item = sale[1] if len(sale) > 1 else ""
+            quantity = _number(sale[2] if len(sale) > 2 else 0, int)
+            unit_cost, supplier = items.get(item, (0.0, UNKNOWN))
+            day, month = _sale_date(sale[4] if len(sale) > 4 else "")
+            for dim, key in zip(SALES_DIMENSIONS, (day, month, item or UNKNOWN, supplier)):
+                keys[dim].append(key)
+            supplier_month.append(f"{month}\x1f{supplier}")
+            counts.append(1.0)
+            units.append(quantity)
+            revenue.append(quantity * _number(sale[3] if len(sale) > 3 else 0))
+            cost.append(quantity * unit_cost)
+        columns = [counts, units, revenue, cost]
+
+        by_dim = {dim: _group_sums(keys[dim], columns) for dim in SALES_DIMENSIONS}
+        nested = {}
+        for key, totals in _group_sums(supplier_month, columns).items():
+            month, supplier = key.split("\x1f", 1)
+            nested.setdefault(month, {})[supplier] = totals
+
+        with self._lock:
+            self._stock = stock
+            self._stock_total = [float(len(inventory)), float(sum(remaining)), float(sum(values))]
+            self._sales = by_dim
+            self._supplier_month = nested
+            self._sales_total = [float(len(sales)), float(sum(units)), float(sum(revenue)), float(sum(cost))]
+
+    def row_changed(self, old, new):
+        with self._lock:
+            if old is not None:
+                self._add_stock(old, -1)
+            if new is not None:
+                self._add_stock(new, 1)
+
+    def sale_added(self, sale, item_row):
+        quantity = _number(sale[2], int)
+        unit_cost = _number(_cell(item_row, COL_PRICE))
+        supplier = _cell(item_row, COL_PLACE_BOUGHT) or UNKNOWN
+        day, month = _sale_date(sale[4])
+        delta = [1.0, quantity, quantity * _number(sale[3]), quantity * unit_cost]
+        with self._lock:
+            for dim, key in zip(SALES_DIMENSIONS, (day, month, sale[1] or UNKNOWN, supplier)):
+                self._add(self._sales[dim], key, delta)
+            self._add(self._supplier_month.setdefault(month, {}), supplier, delta)
+            self._sales_total = [a + b for a, b in zip(self._sales_total, delta)]
+
+    def _add_stock(self, row, sign):
+        remaining = _number(_cell(row, COL_REMAINING_QTY), int)
+        delta = [sign, sign * remaining, sign * _number(_cell(row, COL_PRICE)) * remaining]
+        for dim, col in STOCK_DIMENSIONS.items():
+            self._add(self._stock[dim], _cell(row, col) or UNKNOWN, delta)
+        self._stock_total = [a + b for a, b in zip(self._stock_total, delta)]
+
+    @staticmethod
+    def _add(groups, key, delta):
+        totals = groups.setdefault(key, [0.0] * len(delta))
+        for i, value in enumerate(delta):
+            totals[i] += value
+        if not totals[0]:    # no items/sales left in the group
+            del groups[key]
+
+    # --- Reads ---
+
+    def stock(self, by, key=None):
+        """Stock value rollup by a STOCK_DIMENSIONS column: one group (or None), or all of them."""
+        with self._lock:
+            if key is not None:
+                totals = self._stock[by].get(key)
+                return _stock_result(totals) if totals else None
+            return {name: _stock_result(totals) for name, totals in self._stock[by].items()}
+
+    def stock_total(self):
+        with self._lock:
+            return _stock_result(self._stock_total)
+
+    def sales(self, by, key=None, month=None):
+        """
+        Sales rollup by a SALES_DIMENSIONS key: one group (or None), or all
+        of them. For by="supplier", `month` ('YYYY-MM') limits it to that month.
+        """
+        with self._lock:
+            groups = self._supplier_month.get(month, {}) if by == "supplier" and month else self._sales[by]
+            if key is not None:
+                totals = groups.get(key)
+                return _sales_result(totals) if totals else None
+            return {name: _sales_result(totals) for name, totals in groups.items()}
+
+    def sales_total(self):
+        with self._lock:
+            return _sales_result(self._sales_total)
+
+
+def _stock_result(totals):
+    result = _as_dict(totals, STOCK_FIELDS)
+    result["items"], result["units"] = int(result["items"]), int(result["units"])
+    result["value"] = round(result["value"], 2)
+    return result
+
+
+def _sales_result(totals):
+    result = _as_dict(totals, SALES_FIELDS)
+    result["sales"], result["units"] = int(result["sales"]), int(result["units"])
+    result["revenue"], result["cost"] = round(result["revenue"], 2), round(result["cost"], 2)
+    result["margin"] = round(result["revenue"] - result["cost"], 2)
+    result["margin_pct"] = round(100 * result["margin"] / result["revenue"], 1) if result["revenue"] else None
+    return result
@@ -1,191 +1,278 @@
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, Response, url_for, stream_with_context, g, jsonify
+from werkzeug.serving import WSGIRequestHandler
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from openai import OpenAI
 from datetime import datetime
-from rapidfuzz import process
+import hmac
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from pathlib import Path
 import json
-import speech_recognition as sr
-from werkzeug.utils import secure_filename
+from inventory_store import InventoryStore
+from storage import SheetsStorage, storage_from_env, HEADERS, SHEET_TITLES
+from inventory_query import SnapshotCache, QueryError, FILTER_FIELDS, paginate, page_limit
+from analytics import Analytics, STOCK_DIMENSIONS, SALES_DIMENSIONS
+from jobs import JobQueue, QueueFull
+from extraction_cache import ExtractionCache
+from fuzzy_index import FuzzyMatcher
+from prompt_builder import build_voice_prompt, VOICE_FIELDS_PROMPT, VOICE_OPERATIONS_PROMPT, VOCAB_COLUMNS
+from extraction import (ADD_SCHEMA, UPDATE_SCHEMA, SALE_SCHEMA, VOICE_SCHEMAS, ItemEntry,
+                        JSON_MODE, RESPONSE_FORMAT, extract_json, as_records)
+from bulk_import import BulkImporter, detect_format as bulk_import_format
+from speech_stream import StreamingTranscriber, spool
+from operations import resolve_operations, apply_operations, OperationError, make_sale_id
+from commands import CommandRunner
+from services import SheetsConnection
+from llm_client import ResilientLLMClient, LLMUnavailable, endpoints_from_env
+from metrics import (registry, record_request, timed_function,
+                     InstrumentedWorksheet, InstrumentedSpeechBackend)
+from log_setup import configure_logging
 
 # Load environment variables
 env_path = Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
-# Initialize DeepSeek client
-deepseek_client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://api.deepseek.com"
-)
+# Leveled, rate-limited logging; LOG_LEVEL=WARNING (or OFF) silences the chatter in production
+log = configure_logging()
 
-# Google Sheets setup
-scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
-gsheet_client = gspread.authorize(creds)
+# DeepSeek client (connects on first use): per-call deadlines, retries, a circuit breaker and
+# optional hedging / fallback endpoint, over one pooled HTTP connection (see llm_client)
+DEEPSEEK_MODEL = "deepseek-chat"
+deepseek_client = ResilientLLMClient(endpoints_from_env(
+    os.getenv("OPENAI_API_KEY"), "https://api.deepseek.com", DEEPSEEK_MODEL))
 
-# Open Google Sheet and worksheets
-inventory_sheet = gsheet_client.open("DS ELLIOTONLINE").worksheet("Inventory")
-sales_sheet = gsheet_client.open("DS ELLIOTONLINE").worksheet("Sales")
-maintenance_sheet = gsheet_client.open("DS ELLIOTONLINE").worksheet("Maintenance")  # ✅ Define the maintenance sheet
+# Persistent cache of DeepSeek answers, so retries and repeated inputs skip the API call
+extraction_cache = ExtractionCache()
 
-# Fetch column data for validation
-locations_list = maintenance_sheet.col_values(1)[1:]  # Skip header
-box_labels_list = maintenance_sheet.col_values(2)[1:]  # Skip header
-place_bought_list = maintenance_sheet.col_values(4)[1:]  # Skip header
+# Google Sheets setup: the spreadsheet is opened once, on first use, and shared by all worksheets
+sheets = SheetsConnection("DS ELLIOTONLINE", "credentials.json")
+# Every gspread call is timed and counted (see /metrics)
+inventory_sheet = InstrumentedWorksheet(sheets.lazy_worksheet(SHEET_TITLES["inventory"]))
+sales_sheet = InstrumentedWorksheet(sheets.lazy_worksheet(SHEET_TITLES["sales"]))
+maintenance_sheet = InstrumentedWorksheet(sheets.lazy_worksheet(SHEET_TITLES["maintenance"]))
+# One row per restock (created on first use); the Inventory sheet only keeps a summary
+restocks_sheet = InstrumentedWorksheet(sheets.lazy_worksheet(SHEET_TITLES["restocks"], header=HEADERS["restocks"]))
+sheets_storage = SheetsStorage(inventory_sheet, sales_sheet, maintenance_sheet, restocks_sheet)
+
+# STORAGE_BACKEND=sqlite keeps the data in a local SQLite file instead, mirrored to the
+# spreadsheet in the background (see storage.py); by default the spreadsheet is read and written directly
+storage, sheets_mirror = storage_from_env(sheets_storage)
+if sheets_mirror is not None:
+    sheets_mirror.start()
+
+# In-memory copy of the three tables; lookups are served locally, writes go through to the storage
+store = InventoryStore(storage)
+
+# Indexed read-only snapshots of the store for the JSON read API
+snapshots = SnapshotCache(store)
+
+# Stock value and sales/margin rollups, updated by the store as rows change
+analytics = Analytics()
+store.add_listener(analytics)
+
+# Background workers for slow LLM calls (used when a client asks for async mode)
+job_queue = JobQueue()
+
+# Windowed speech recognition; SPEECH_BACKEND=sphinx switches to the offline engine
+transcriber = StreamingTranscriber()
+transcriber.backend = InstrumentedSpeechBackend(transcriber.backend)
+
+
+def use_backends(spreadsheet=None, llm_client=None, speech_backend=None):
+    """
+    Swap in other Sheets/DeepSeek/speech implementations (used by the offline benchmarks).
+    Call before the worksheets are first used; to change data later, update the spreadsheet in place.
+    """
+    if spreadsheet is not None:
+        sheets.use_spreadsheet(spreadsheet)
+        store.invalidate()
+    if llm_client is not None:
+        deepseek_client.use_client(llm_client)
+    if speech_backend is not None:
+        transcriber.backend = InstrumentedSpeechBackend(speech_backend)
+
+
+# Warm-up state reported by /ready
+startup = {"state": "pending", "error": None}
+
+
+def warm_up():
+    """Load the store from its storage (including the Maintenance vocabularies)."""
+    startup["state"] = "loading"
+    try:
+        store.refresh()
+        startup.update(state="ready", error=None)
+        log.info("Inventory store loaded")
+    except Exception as e:
+        startup.update(state="failed", error=str(e))
+        log.error("Warm-up failed, will retry on first use: %s", e)
+
+
+# Load in the background so the server can start (and answer /ready) straight away
+if os.getenv("WARM_UP_ON_START", "1") == "1":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
 
 
 app = Flask(__name__)
 
-def convert_speech_to_text(audio_path):
-    """Convert audio file to text using Google's speech recognition"""
-    r = sr.Recognizer()
-    with sr.AudioFile(audio_path) as source:
-        audio = r.record(source)
-        try:
-            return r.recognize_google(audio)
-        except sr.UnknownValueError:
-            return "Could not understand audio"
-        except sr.RequestError as e:
-            return f"Speech recognition error: {e}"
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_timing(response):
+    if "request_started" in g:
+        record_request(request.endpoint, time.perf_counter() - g.request_started, response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus-style counters and latency histograms."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@timed_function("speech")
+def convert_speech_to_text(audio_file):
+    """Convert an audio file (path or file object) to text, one window at a time"""
+    errors = []
+    parts = []
+    for result in transcriber.transcribe(audio_file):
+        if result.get("error"):
+            errors.append(result["error"])
+        if result["text"]:
+            parts.append(result["text"])
+
+    if parts:
+        return " ".join(parts)
+    if errors:
+        return errors[0]
+    return "Could not understand audio"
+
+
+def uploaded_audio():
+    """Seekable buffer with the uploaded audio: a multipart 'audio' file or a raw audio/* body."""
+    audio_file = request.files.get('audio')
+    if audio_file:
+        return audio_file.stream  # werkzeug already spooled it to a temp buffer
+    if request.mimetype.startswith("audio/"):
+        return spool(request.stream)
+    return None
+
 
 @app.route('/upload', methods=['POST'])
 def upload_audio():
+    """
+    Transcribe uploaded audio. With ?stream=1 the response is newline-delimited JSON:
+    one line per window as soon as it is recognized, then a final line with the full text.
+    """
     try:
-        audio_file = request.files.get('audio')
+        audio = uploaded_audio()
 
-        if not audio_file:
-            print("ERROR - No audio file received")
+        if not audio:
+            log.warning("No audio file received")
             return {"error": "No audio file received"}, 400  # Send error response
 
-        filename = secure_filename(audio_file.filename)
-        audio_file.save(filename)
-        print(f"DEBUG - Saved file: {filename}")
+        if is_truthy(request.args.get("stream")):
+            def results():
+                parts = []
+                try:
+                    for result in transcriber.transcribe(audio):
+                        parts.append(result["text"])
+                        yield json.dumps(result) + "\n"
+                    yield json.dumps({"done": True, "recognized_text": " ".join(p for p in parts if p)}) + "\n"
+                except Exception as e:
+                    log.exception("Exception in /upload stream: %s", e)
+                    yield json.dumps({"done": True, "error": str(e)}) + "\n"
+
+            return Response(stream_with_context(results()), mimetype="application/x-ndjson")
 
-        text = convert_speech_to_text(filename)
-        print(f"DEBUG - Recognized Text: {text}")
+        text = convert_speech_to_text(audio)
+        log.debug("Recognized text: %s", text)
 
         return {"recognized_text": text}  # Return JSON
     except Exception as e:
-        print(f"ERROR - Exception in /upload: {str(e)}")
+        log.exception("Exception in /upload: %s", e)
         return {"error": str(e)}, 500  # Return error response
-    finally:
-        if os.path.exists(filename):
-            os.remove(filename)
 
 
 
+ADD_SYSTEM_PROMPT = f"""Extract inventory details as a JSON object {{"items": [...]}} with one object per item, using these keys:
+{ADD_SCHEMA.describe(exclude=("remaining_qty",))}
+Ensure the price is extracted accurately and does not get inflated."""
+
+
 def parse_input_with_deepseek(text):
-    """Parse inventory input using DeepSeek API with flexible fields."""
-    content = ""
+    """
+    Parse free text into validated ItemEntry records; a failed call gives one entry holding the error.
+    LLMUnavailable is raised instead, as the same text may well succeed if sent again.
+    """
     try:
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": """Extract inventory details as valid JSON array with these keys:
-                item (required), price (required, float in GBP, correctly extracted from text without misinterpretation), 
-                date (DD/MM/YYYY), storage_location, box_label, total_qty (integer), place_bought.
-                Ensure the price is extracted accurately and does not get inflated."""},
-                {"role": "user", "content": text}
-            ],
-            temperature=0.3
-        )
-        
-        content = response.choices[0].message.content
-        if '```json' in content:
-            content = content.split('```json')[1].split('```')[0]
-
-        try:
-            raw_entries = json.loads(content)
-        except json.JSONDecodeError:
-            return [{'error': "Invalid JSON format", 'raw_entry': content}]
+        raw_entries = cached_deepseek_json(text, "add", ADD_SYSTEM_PROMPT)
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        log.exception("Parsing error: %s", e)
+        return [ItemEntry(item=None, errors=[f"System error: {str(e)}"])]
 
-        if not isinstance(raw_entries, list):
-            raw_entries = [raw_entries]
+    if raw_entries is None:
+        return [ItemEntry(item=None, errors=["Invalid JSON format"])]
+    return ADD_SCHEMA.validate_many(raw_entries, "items")
 
-        parsed_entries = []
-        for entry in raw_entries:
-            errors = []
 
-            # Required: item
-            item = entry.get('item')
-            if not item:
-                errors.append("Missing required field: item")
+def find_best_match(user_input, choices, threshold=80):
+    """
+    Find the closest matching choice using RapidFuzz.
 
-            # Price
-            try:
-                price = float(entry['price'])
-            except (ValueError, TypeError, KeyError):
-                errors.append("Invalid price format")
-                price = 0.0
+    `choices` is a FuzzyMatcher (preferred, see InventoryStore.item_matcher) or a plain list.
+    Returns (best_match, candidates): best_match is None when nothing meets the threshold
+    or when several candidates score too closely to pick one; candidates holds the
+    ranked names in either case.
+    """
+    log.debug("Searching for: %s", user_input)
 
-            # Total Qty
-            try:
-                total_qty = int(entry['total_qty'])
-                if total_qty <= 0:
-                    raise ValueError
-            except (ValueError, TypeError, KeyError):
-                errors.append("Invalid quantity format, defaulting to 1")
-                total_qty = 1
-
-            if total_qty == 1 and "Invalid quantity format, defaulting to 1" in errors:
-                errors.remove("Invalid quantity format, defaulting to 1")
-
-            # Remaining Qty defaults
-            remaining_qty = entry.get('remaining_qty')
-            if remaining_qty is None:
-                remaining_qty = total_qty
-
-            parsed_entry = {
-                'item': item or 'Unknown Item',
-                'price': price,
-                'date': entry.get('date') or datetime.now().strftime("%d/%m/%Y"),
-                'storage_location': entry.get('storage_location', 'Not specified') or 'Not specified',
-                'box_label': entry.get('box_label', '') or '',
-                'total_qty': total_qty,
-                'remaining_qty': remaining_qty,
-                'place_bought': entry.get('place_bought', 'Unknown location') or 'Unknown location',
-                'errors': errors
-            }
-
-            parsed_entries.append(parsed_entry)
-
-        return parsed_entries
+    if not user_input or not choices:
+        log.debug("No user input or no choices available")
+        return None, []
 
-    except Exception as e:
-        print(f"Parsing Error: {str(e)}")
-        return [{'error': f"System error: {str(e)}", 'raw_entry': content}]
+    matcher = choices if isinstance(choices, FuzzyMatcher) else FuzzyMatcher(choices)
+    best_match, candidates = matcher.best(user_input, threshold=threshold)
 
+    if best_match:
+        log.debug("Best match: %s", best_match)
+    elif candidates:
+        log.info("Ambiguous match for %r: %s", user_input, candidates)
+    else:
+        log.info("No good match found for %r", user_input)
+    return best_match, candidates
 
 
-from rapidfuzz import process
+def match_or_keep(value, choices):
+    """Best fuzzy match for a free-text value, falling back to the top candidate or the value itself."""
+    best_match, candidates = find_best_match(value, choices)
+    return best_match or (candidates[0] if candidates else value)
 
-def find_best_match(user_input, choices, threshold=80):
-    """
-    Find the closest matching item in the list using RapidFuzz.
-    If no match meets the threshold, return the original user input.
-    """
-    print(f"DEBUG - Searching for: {user_input}")
-    print(f"DEBUG - Available choices: {choices}")
 
-    if not user_input or not choices:
-        print("⚠️ No user input or no choices available.")
-        return user_input  # Return original input if nothing to match against
+def is_truthy(value):
+    """Interpret a form/query/JSON flag such as "1", "true" or True."""
+    return str(value or "").lower() in ("1", "true", "yes", "on")
 
-    matches = process.extract(user_input, choices, limit=3, score_cutoff=threshold)
-    print(f"DEBUG - Fuzzy Matches: {matches}")
 
-    if not matches:
-        print(f"⚠️ No good match found for '{user_input}'. Keeping original input.")
-        return user_input  # No match found, return original input
+def wants_async(data):
+    """True when the client asked for the request to run as a background job."""
+    return is_truthy(data.get("async"))
 
-    best_match = matches[0][0]  # Get best match
-    confidence = matches[0][1]  # Get confidence score
 
-    print(f"✅ Best match: {best_match} (Confidence: {confidence}%)")
-    return best_match
+def enqueue_job(kind, fn, *args):
+    """Queue a job and return the 202 response pointing at its status URL."""
+    try:
+        job = job_queue.submit(kind, fn, *args)
+    except QueueFull as e:
+        return {"error": str(e)}, 503
+    return {"job_id": job.id, "status_url": url_for("job_status", job_id=job.id)}, 202
 
 
 @app.route('/process_voice_input', methods=['POST'])
@@ -197,64 +284,260 @@ def process_voice_input():
     if not transcript:
         return {"error": "No text received"}, 400
 
-    print(f"🔍 Processing voice input for mode: {mode}")
+    # "multi" utterances may cover several items and return a list of operations
+    handler = extract_voice_operations if is_truthy(data.get("multi")) else extract_voice_fields
 
-    # Use AI to extract structured data with explicit field constraints
+    if wants_async(data):
+        return enqueue_job("voice", handler, transcript, mode)
+
+    try:
+        return handler(transcript, mode)
+    except LLMUnavailable as e:
+        return {"error": str(e)}, 503
+
+
+def cached_deepseek_json(content, mode, system_prompt):
+    """
+    Ask DeepSeek for JSON (or reuse a cached answer). The answer is repaired
+    locally (see extraction.extract_json); None if it holds no JSON at all.
+    """
+    # The user message carries the vocabulary hints, so it is part of the key along with the prompt
+    cache_key = ExtractionCache.make_key(content, mode, DEEPSEEK_MODEL, system_prompt)
+    extracted_data = extraction_cache.get(cache_key)
+    if extracted_data is not None:
+        return extracted_data
+
+    options = {"response_format": RESPONSE_FORMAT} if JSON_MODE else {}
     response = deepseek_client.chat.completions.create(
-        model="deepseek-chat",
+        model=DEEPSEEK_MODEL,
         messages=[
-            {
-                "role": "system",
-                "content": f"""Extract relevant fields for mode '{mode}' and ensure they match values from the appropriate columns in the Maintenance sheet:
-                - `update_item_name` must match an item in the Inventory Sheet.
-                - `storage_location` must match one of these: {locations_list}
-                - `box_label` must match one of these: {box_labels_list}
-                - `place_bought` must match one of these: {place_bought_list}
-                
-                Return only JSON without any markdown formatting.
-                """
-            },
-            {"role": "user", "content": transcript}
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content}
         ],
-        temperature=0.3
+        temperature=0.3,
+        **options
     )
 
-    # Debug: Print raw AI response
-    raw_response = response.choices[0].message.content.strip()
-    print(f"🛑 RAW AI RESPONSE: {raw_response}")
+    raw_response = response.choices[0].message.content or ""
+    log.debug("Raw AI response: %s", raw_response)
 
-    # ✅ Strip markdown formatting (` ```json ... ``` `)
-    if raw_response.startswith("```json"):
-        raw_response = raw_response.split("```json")[1].split("```")[0].strip()
+    extracted_data = extract_json(raw_response)
+    if extracted_data is None:
+        log.warning("Failed to parse AI response as JSON: %s", raw_response)
+        return None
 
-    try:
-        extracted_data = json.loads(raw_response)
-    except json.JSONDecodeError:
-        print(f"⚠️ Failed to parse AI response as JSON: {raw_response}")
-        extracted_data = {"error": "Failed to parse AI response"}
+    extraction_cache.put(cache_key, extracted_data)
+    return extracted_data
 
-    print(f"📌 Extracted Data: {extracted_data}")
 
-    # ✅ Apply manual fuzzy matching for locations, box labels, and place bought
-    # ✅ Use fuzzy matching to ensure correct values from the Maintenance Sheet
-    if "storage_location" in extracted_data:
-        extracted_data["storage_location"] = find_best_match(extracted_data["storage_location"], locations_list)
+def extract_voice_fields(transcript, mode):
+    """
+    Extract update/sale form fields from a transcript and match them to the
+    Maintenance lists. Only the fields that were mentioned are returned.
+    """
+    log.debug("Processing voice input for mode: %s", mode)
+    schema = VOICE_SCHEMAS.get(mode, UPDATE_SCHEMA)
 
-    if "box_label" in extracted_data:
-        extracted_data["box_label"] = find_best_match(extracted_data["box_label"], box_labels_list)
+    # Stable system prompt; only the closest Maintenance values go in the user message
+    system_prompt, content = build_voice_prompt(store, transcript, VOICE_FIELDS_PROMPT, mode=schema.name)
 
-    if "place_bought" in extracted_data:
-        extracted_data["place_bought"] = find_best_match(extracted_data["place_bought"], place_bought_list)
+    raw = cached_deepseek_json(content, mode, system_prompt)
+    records = as_records(raw)
+    if not records:
+        return {"error": "Failed to parse AI response"}
 
+    entry = schema.validate(records[0], defaults=False)
+    log.debug("Extracted data: %s", entry)
 
-    print(f"📌 Matched Data: {extracted_data}")
+    # Use fuzzy matching to ensure correct values from the Maintenance Sheet
+    for field, col in VOCAB_COLUMNS.items():
+        if getattr(entry, field, None):
+            setattr(entry, field, match_or_keep(getattr(entry, field), store.maintenance_matcher(col)))
 
+    extracted_data = {key: value for key, value in entry.as_dict().items()
+                      if key != "errors" and value not in (None, "")}
+    log.debug("Matched data: %s", extracted_data)
     return extracted_data
 
 
+def entry_to_row(new_id, entry):
+    """Inventory sheet row for a validated ItemEntry."""
+    return [
+        new_id,
+        entry.item,
+        "",
+        entry.storage_location,
+        entry.box_label,
+        entry.price,
+        entry.total_qty,
+        entry.remaining_qty,
+        entry.date,
+        entry.place_bought
+    ]
+
+
+def extract_voice_operations(transcript, mode="multi"):
+    """Extract a list of update/restock/sale operations from one utterance and resolve their items."""
+    log.debug("Processing multi-item voice input")
 
+    system_prompt, content = build_voice_prompt(store, transcript, VOICE_OPERATIONS_PROMPT)
 
+    operations = as_records(cached_deepseek_json(content, "multi", system_prompt), "operations")
+    if not operations:
+        return {"error": "Failed to parse AI response"}
 
+    resolved = resolve_operations(store, operations)
+    log.debug("Resolved operations: %s", resolved)
+    return {"operations": resolved}
+
+
+@app.route('/apply_operations', methods=['POST'])
+def apply_operations_route():
+    """Apply a list of operations (as returned by /process_voice_input with multi) in one batched write."""
+    operations = (request.json or {}).get("operations")
+    if not operations or not isinstance(operations, list):
+        return {"error": "No operations received"}, 400
+
+    try:
+        return {"results": apply_operations(store, operations)}
+    except OperationError as e:
+        return {"error": "No changes were made", "errors": e.errors}, 400
+    except gspread.exceptions.APIError:
+        return {"error": "Google Sheets API error."}, 502
+
+
+def add_new_items(input_text):
+    """
+    Parse free text into inventory entries and append the valid ones to the Inventory sheet.
+
+    Returns every parsed entry as a dict with `status` "success" (and its new `id`) or
+    "error" (and its `errors`). Raises LLMUnavailable when the text could not be parsed.
+    """
+    parsed_entries = parse_input_with_deepseek(input_text)
+    log.debug("Parsed entries: %s", parsed_entries)
+
+    valid_entries = [entry for entry in parsed_entries if entry.valid]
+    # Reserve the IDs as one block so concurrent adds and bulk imports never share one
+    row_count = store.reserve_item_numbers(len(valid_entries))
+    new_rows = []
+
+    for entry in valid_entries:
+        new_id = f"ITEM-{row_count}"
+        row_count += 1
+
+        new_rows.append(entry_to_row(new_id, entry))
+        entry.id = new_id
+
+    # All parsed entries go to Sheets in a single append
+    store.append_inventory(new_rows)
+    return [dict(entry.as_dict(), status="success" if entry.valid else "error") for entry in parsed_entries]
+
+
+# Bulk imports share the store and the add-item parsing/validation
+bulk_importer = BulkImporter(store, parse_input_with_deepseek, ADD_SCHEMA.validate, entry_to_row)
+import_jobs = {}    # import_id -> job id of its latest run
+
+# Text commands from the WhatsApp bot (or any other chat front end)
+command_runner = CommandRunner(store, add_new_items, extract_voice_operations)
+COMMAND_API_TOKEN = os.getenv("COMMAND_API_TOKEN", "")
+
+
+@app.route("/api/command", methods=["POST"])
+def api_command():
+    """
+    Run one text command (see commands.py) and answer {"ok", "command", "reply", ...}.
+    When COMMAND_API_TOKEN is set, callers must send it as a Bearer token.
+    """
+    if COMMAND_API_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""),
+                                                     f"Bearer {COMMAND_API_TOKEN}"):
+        return {"error": "Unauthorized"}, 401
+    data = request.get_json(silent=True) or {}
+    log.debug("Command from %s: %s", data.get("sender") or "?", data.get("text"))
+    try:
+        return command_runner.run(data.get("text", ""))
+    except LLMUnavailable as e:
+        return {"ok": False, "reply": "Too busy to read that right now, please send it again in a minute.",
+                "error": str(e)}, 503
+    except gspread.exceptions.APIError:
+        return {"ok": False, "reply": "Google Sheets error, please check whether that was saved."}, 502
+
+
+@app.route("/import", methods=["POST"])
+def bulk_import():
+    """
+    Start (or resume) a bulk import from an uploaded CSV/JSONL/text file.
+    Resume by posting the same import_id, with or without re-uploading the file;
+    an import that is still queued or running is refused with 409.
+    """
+    upload = request.files.get("file")
+    import_id = request.form.get("import_id", "").strip()
+    fmt = request.form.get("format")
+
+    if bulk_importer.valid_id(import_id):
+        job = job_queue.get(import_jobs.get(import_id))
+        if (job and not job.finished) or bulk_importer.is_running(import_id):
+            return {"error": "Import already running", "import_id": import_id,
+                    "job_id": job.id if job else None}, 409
+
+    if upload:
+        import_id = bulk_importer.stage_upload(upload, import_id)
+        fmt = fmt or bulk_import_format(upload.filename)
+    elif not (bulk_importer.valid_id(import_id) and bulk_importer.upload_path(import_id).exists()):
+        return {"error": "No file received"}, 400
+
+    body, status = enqueue_job("import", bulk_importer.run, str(bulk_importer.upload_path(import_id)), fmt, import_id)
+    body["import_id"] = import_id
+    if status == 202:
+        import_jobs[import_id] = body["job_id"]
+    return body, status
+
+
+@app.route("/import/<import_id>")
+def bulk_import_status(import_id):
+    """Checkpointed progress and per-row errors of an import."""
+    state = bulk_importer.status(import_id)
+    if not state:
+        return {"error": "Unknown import"}, 404
+    return state
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Status of a background job. Pass ?wait=N to long-poll for up to N seconds."""
+    job = job_queue.get(job_id)
+    if not job:
+        return {"error": "Unknown job"}, 404
+
+    try:
+        wait = min(float(request.args.get("wait", 0)), 30.0)
+    except ValueError:
+        wait = 0
+    if wait > 0:
+        job.wait(wait)
+
+    return job.to_dict()
+
+
+@app.route("/jobs/<job_id>/stream")
+def job_stream(job_id):
+    """Server-sent events: one event per status or progress change until the job finishes."""
+    job = job_queue.get(job_id)
+    if not job:
+        return {"error": "Unknown job"}, 404
+
+    def events():
+        last_version = None
+        while True:
+            version = job.wait_for_change(last_version, 15)
+            if version != last_version:
+                last_version = version
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            if job.finished:
+                return
+
+    return Response(events(), mimetype="text/event-stream")
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -268,49 +551,30 @@ def home():
         # --- 1) Adding a NEW item ---
         if 'input_text' in form_keys:
             input_text = request.form["input_text"]
-            parsed_entries = parse_input_with_deepseek(input_text)
-            print("DEBUG - parsed_entries:", parsed_entries)
-
-            records = inventory_sheet.get_all_records()
-            row_count = len(records) + 1
-
-            for entry in parsed_entries:
-                if entry.get("errors"):
-                    continue
-
-                new_id = f"ITEM-{row_count}"
-                row_count += 1
-
-                row_data = [
-                    new_id,
-                    entry["item"],
-                    "",
-                    entry["storage_location"],
-                    entry["box_label"],
-                    entry["price"],
-                    entry["total_qty"],
-                    entry.get("remaining_qty", ""),
-                    entry["date"],
-                    entry["place_bought"]
-                ]
-                inventory_sheet.append_row(row_data)
-                entry["id"] = new_id
-                processed_entries.append(entry)
+            if wants_async(request.form):
+                return enqueue_job("add", add_new_items, input_text)
+
+            try:
+                processed_entries = add_new_items(input_text)
+            except LLMUnavailable as e:
+                log.error("Add skipped: %s", e)
+                failed = ItemEntry(item=None, errors=[f"{e}. Nothing was added, please try again shortly."])
+                processed_entries = [dict(failed.as_dict(), status="error")]
 
         # --- 2) Updating an existing Inventory entry (by ID or by name) ---
         elif 'update_id' in form_keys or 'update_item_name' in form_keys:
             try:
-                update_id = request.form.get('update_id', '').strip()
-                update_item_name = request.form.get('update_item_name', '').strip()
+                fields = UPDATE_SCHEMA.validate(request.form)
+                update_id, update_item_name = fields.update_id, fields.update_item_name
 
                 # 🔍 **Find entry by ID or Name**
+                row_number = None
                 if update_id:
-                    print(f"DEBUG - Searching by ID: {update_id}")
-                    cell = inventory_sheet.find(update_id)  
+                    log.debug("Searching by ID: %s", update_id)
+                    row_number = store.find_by_id(update_id)
                 elif update_item_name:
-                    print(f"DEBUG - Searching for closest match to '{update_item_name}'...")
-                    all_items = inventory_sheet.col_values(2)[1:]  # Ignore header row
-                    best_match, multiple_matches = find_best_match(update_item_name, all_items)
+                    log.debug("Searching for closest match to %r", update_item_name)
+                    best_match, multiple_matches = find_best_match(update_item_name, store.item_matcher())
 
                     if not best_match and multiple_matches:
                         update_result = f"⚠️ Multiple matches found: {', '.join(multiple_matches)}. Please refine your search."
@@ -320,98 +584,32 @@ def home():
                         update_result = f"⚠️ No matching items found for '{update_item_name}'."
                         return render_template("index.html", entries=processed_entries, update_result=update_result)
 
-                    cell = inventory_sheet.find(best_match, in_column=2)
-
-                if not cell:
-                    raise ValueError(f"⚠️ Error: Item '{update_item_name}' not found")
-
-                row_number = cell.row
-                row_values = inventory_sheet.row_values(row_number)
-                while len(row_values) < 10:
-                    row_values.append("")
-
-                # Fetch existing values
-                existing_catalogue, existing_storage_location, existing_box_label = row_values[2:5]
-                existing_price, existing_total_qty, existing_remaining_qty = row_values[5:8]
-                existing_place_bought = row_values[9]
-
-                try:
-                    existing_total_qty = int(existing_total_qty)
-                except ValueError:
-                    existing_total_qty = 1
-
-                try:
-                    existing_remaining_qty = int(existing_remaining_qty)
-                except ValueError:
-                    existing_remaining_qty = existing_total_qty
-
-                # Capture new input values
-                new_values = {
-                    "catalogue_number": request.form.get('catalogue_number', '').strip(),
-                    "storage_location": request.form.get('storage_location', '').strip(),
-                    "box_label": request.form.get('box_label', '').strip(),
-                    "place_bought": request.form.get('place_bought', '').strip(),
-                    "restock_qty": request.form.get('restock_qty', '').strip(),
-                    "quantity_sold": request.form.get('quantity_sold', '').strip()
-                }
-
-                update_data = []
-
-                # Update values if provided
-                for col_index, key, existing_value in [
-                    (3, "catalogue_number", existing_catalogue),
-                    (4, "storage_location", existing_storage_location),
-                    (5, "box_label", existing_box_label),
-                    (10, "place_bought", existing_place_bought)
-                ]:
-                    if new_values[key]:
-                        update_data.append((row_number, col_index, new_values[key]))
-                    else:
-                        new_values[key] = existing_value
-
-                # Process restocking
-                # --- Processing restocking ---
-                if new_values["restock_qty"]:
-                    try:
-                        restock_qty = int(new_values["restock_qty"])
-                        if restock_qty > 0:
-                            existing_total_qty += restock_qty
-                            existing_remaining_qty += restock_qty
-
-                            # Fetch existing restock history (column index: adjust as per your sheet structure)
-                            restock_history_col = 11  # Assuming column 11 stores restock history
-                            existing_restock_history = inventory_sheet.cell(row_number, restock_history_col).value or ""
-
-                            # Append new restock entry
-                            restock_entry = f"{datetime.now().strftime('%d/%m/%Y')} (x{restock_qty})"
-                            if existing_restock_history.strip():  # Ensure we don't append unnecessary commas
-                                updated_restock_history = f"{existing_restock_history}, {restock_entry}"
-                            else:
-                                updated_restock_history = restock_entry
-
-                            # ✅ Ensure update_data only stores valid key-value pairs
-                            update_data.append((row_number, restock_history_col, updated_restock_history))  # ✅ Correct format
-
-                    except ValueError:
-                        print("⚠️ Invalid restock quantity. Ignoring restock update.")
-
-
-
-                # Process sale
-                if new_values["quantity_sold"]:
-                    try:
-                        quantity_sold = int(new_values["quantity_sold"])
-                        existing_remaining_qty -= quantity_sold
-                        existing_remaining_qty = max(0, existing_remaining_qty)
-                    except ValueError:
-                        pass
-
-                update_data.append((row_number, 7, existing_total_qty))  
-                update_data.append((row_number, 8, existing_remaining_qty))
-
-                # Apply updates
-                for row_idx, col_idx, val in update_data:
-                    inventory_sheet.update_cell(row_idx, col_idx, val)
+                    row_number = store.find_by_name(best_match)
+
+                if not row_number:
+                    raise ValueError(f"⚠️ Error: Item '{update_id or update_item_name}' not found")
+
+                # Fields left blank keep their current value
+                update_data = {col_index: getattr(fields, key) for col_index, key in [
+                    (3, "catalogue_number"),
+                    (4, "storage_location"),
+                    (5, "box_label"),
+                    (10, "place_bought"),
+                ] if getattr(fields, key)}
+
+                # Stock changes, recorded atomically through the ledger (quantities are validated counts)
+                movements = []
+                if fields.restock_qty:
+                    # Adds to total and remaining, and is kept as a restock record
+                    movements.append({"row": row_number, "kind": "restock",
+                                      "remaining": fields.restock_qty, "total": fields.restock_qty})
+                if fields.quantity_sold:
+                    movements.append({"row": row_number, "kind": "adjust",
+                                      "remaining": -fields.quantity_sold, "clamp": True})
+
+                # Quantities go through the stock ledger; the other fields in one write
+                store.record_movements(movements)
+                store.update_row(row_number, update_data)
 
                 update_label = update_id if update_id else update_item_name
                 update_result = f"✅ Updated {update_label} successfully!"
@@ -426,45 +624,34 @@ def home():
         # --- 3) LOGGING A SALE ---
         elif 'sales_item' in form_keys:
             try:
-                sales_item_name = request.form.get('sales_item', '').strip()
-                quantity_sold = request.form.get('quantity_sold', '1').strip()
-                sold_price = request.form.get('sold_price', '').strip()
-                date_sold = request.form.get('date_sold', '').strip() or datetime.now().strftime("%d/%m/%Y")
-                buyer = request.form.get('buyer', '').strip()
-
-                try:
-                    quantity_sold = int(quantity_sold)
-                except ValueError:
-                    quantity_sold = 1
-
-                try:
-                    sold_price = float(sold_price)
-                except ValueError:
-                    sold_price = 0.0
+                sale = SALE_SCHEMA.validate(request.form)
+                if not sale.valid:
+                    raise ValueError("; ".join(sale.errors))
 
                 # Find best match
-                all_items = inventory_sheet.col_values(2)[1:]
-                best_match, multiple_matches = find_best_match(sales_item_name, all_items)
+                best_match, multiple_matches = find_best_match(sale.sales_item, store.item_matcher())
+
+                if not best_match and multiple_matches:
+                    # Let the user pick the intended item; the sale details are carried over
+                    update_result = f"⚠️ Multiple matches found for '{sale.sales_item}'."
+                    return render_template("index.html", entries=processed_entries, update_result=update_result,
+                                           suggested_matches=multiple_matches, pending_sale=request.form)
 
                 if not best_match:
-                    update_result = f"⚠️ No matching items found for '{sales_item_name}'."
+                    update_result = f"⚠️ No matching items found for '{sale.sales_item}'."
                     return render_template("index.html", entries=processed_entries, update_result=update_result)
 
-                item_row = next((i + 1 for i, row in enumerate(inventory_sheet.get_all_values()) if row[1] == best_match), None)
+                item_row = store.find_by_name(best_match)
                 if not item_row:
                     raise ValueError(f"⚠️ '{best_match}' matched but not found.")
 
-                existing_remaining = int(inventory_sheet.cell(item_row, 8).value or 0)
-                if existing_remaining < quantity_sold:
-                    raise ValueError(f"⚠️ Not enough stock for {quantity_sold} of '{best_match}'.")
-
-                inventory_sheet.update_cell(item_row, 8, existing_remaining - quantity_sold)
-
-                sale_id = f"{best_match.replace(' ', '_')}-{datetime.now().strftime('%d%m')}-{buyer.replace(' ', '_')}"
-                sales_data = [sale_id, best_match, quantity_sold, sold_price, date_sold, buyer, existing_remaining - quantity_sold]
-                sales_sheet.append_row(sales_data)
+                # Checked and recorded atomically, so concurrent sales can never oversell
+                sale_id = make_sale_id(best_match, sale.buyer)
+                sales_data = [sale_id, best_match, sale.quantity_sold, sale.sold_price, sale.date_sold, sale.buyer, None]
+                remaining, = store.record_movements([{"row": item_row, "kind": "sale",
+                                                      "remaining": -sale.quantity_sold, "sale": sales_data}])
 
-                update_result = f"✅ Sold {quantity_sold}x '{best_match}' to {buyer}. Remaining: {existing_remaining - quantity_sold}"
+                update_result = f"✅ Sold {sale.quantity_sold}x '{best_match}' to {sale.buyer}. Remaining: {remaining}"
 
             except ValueError as e:
                 update_result = f"⚠️ {str(e)}"
@@ -474,7 +661,192 @@ def home():
     return render_template("index.html", entries=processed_entries, update_result=update_result)
 
 
+def snapshot_response(build):
+    """
+    JSON from `build(snapshot)`, with an ETag tied to the snapshot version.
+    A matching If-None-Match gets 304 without running the query.
+    """
+    snapshot = snapshots.get()
+    if request.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        try:
+            response = jsonify(build(snapshot))
+        except QueryError as e:
+            return {"error": str(e)}, 400
+    response.set_etag(snapshot.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def select_fields(record, fields):
+    return {key: record[key] for key in fields if key in record} if fields else record
+
+
+def requested_fields():
+    return [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+
+
+@app.route("/api/items")
+def api_items():
+    """
+    Inventory items, paginated. Query parameters (all optional):
+    q (item name), match (auto|prefix|fuzzy), storage_location, box_label,
+    place_bought, low_stock (remaining <= N), fields (comma-separated),
+    limit and cursor (from the previous page's next_cursor).
+    """
+    def build(snapshot):
+        low_stock = request.args.get("low_stock")
+        if low_stock not in (None, "") and not low_stock.lstrip("-").isdigit():
+            raise QueryError("low_stock must be an integer")
+        positions, ranked = snapshot.search_items(
+            request.args.get("q", ""), request.args.get("match", "auto"),
+            filters={field: request.args.get(field) for field in FILTER_FIELDS},
+            low_stock=int(low_stock) if low_stock not in (None, "") else None,
+            matcher=store.item_matcher(),
+        )
+        page, next_cursor = paginate(positions, request.args.get("cursor"),
+                                     page_limit(request.args.get("limit")), ranked)
+        fields = requested_fields()
+        return {
+            "items": [select_fields(snapshot.item_at(p), fields) for p in page],
+            "total": len(positions),
+            "next_cursor": next_cursor,
+            "version": snapshot.etag,
+        }
+
+    return snapshot_response(build)
+
+
+@app.route("/api/items/<item_id>")
+def api_item(item_id):
+    """One inventory item by ID."""
+    snapshot = snapshots.get()
+    if snapshot.item(item_id) is None:
+        return {"error": "Unknown item"}, 404
+    return snapshot_response(lambda s: s.item(item_id) or {})
+
+
+@app.route("/api/sales")
+def api_sales():
+    """Sales, paginated; filter with item (name contains) and buyer."""
+    def build(snapshot):
+        positions = snapshot.search_sales(request.args.get("item"), request.args.get("buyer"))
+        page, next_cursor = paginate(positions, request.args.get("cursor"),
+                                     page_limit(request.args.get("limit")), ranked=False)
+        fields = requested_fields()
+        return {
+            "sales": [select_fields(snapshot.sale_at(p), fields) for p in page],
+            "total": len(positions),
+            "next_cursor": next_cursor,
+            "version": snapshot.etag,
+        }
+
+    return snapshot_response(build)
+
+
+@app.route("/api/restocks")
+def api_restocks():
+    """
+    Restock records, oldest first: ?item_id=ITEM-1, ?from=YYYY-MM-DD and
+    ?to=YYYY-MM-DD (inclusive) narrow them down; ?limit caps the count.
+    """
+    start, end = request.args.get("from"), request.args.get("to")
+    for value in (start, end):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                return {"error": "Dates must be YYYY-MM-DD"}, 400
+    try:
+        limit = page_limit(request.args.get("limit"))
+    except QueryError as e:
+        return {"error": str(e)}, 400
+    item_id = request.args.get("item_id")
+    restocks = store.ledger.restocks(item_id, start, end, limit=limit)
+    return {"restocks": restocks, "total_quantity": sum(r["quantity"] for r in restocks)}
+
+
+@app.route("/analytics/stock")
+def analytics_stock():
+    """
+    Stock value (price x remaining) and units by storage_location, box_label
+    or place_bought (?by=...). Pass ?key=B4 for a single group.
+    """
+    by = request.args.get("by", "storage_location")
+    if by not in STOCK_DIMENSIONS:
+        return {"error": f"by must be one of: {', '.join(STOCK_DIMENSIONS)}"}, 400
+    store.ensure_fresh()
+    key = request.args.get("key")
+    if key is not None:
+        group = analytics.stock(by, key)
+        if group is None:
+            return {"error": f"No stock with {by} '{key}'"}, 404
+        return {"by": by, "key": key, **group}
+    return {"by": by, "groups": analytics.stock(by), "total": analytics.stock_total()}
+
+
+@app.route("/analytics/sales")
+def analytics_sales():
+    """
+    Units, revenue, cost and margin by day, month, item or supplier (?by=...).
+    Pass ?key=... for a single group, and ?month=YYYY-MM with by=supplier for one month.
+    """
+    by = request.args.get("by", "month")
+    if by not in SALES_DIMENSIONS:
+        return {"error": f"by must be one of: {', '.join(SALES_DIMENSIONS)}"}, 400
+    month = request.args.get("month") if by == "supplier" else None
+    store.ensure_fresh()
+    key = request.args.get("key")
+    if key is not None:
+        group = analytics.sales(by, key, month=month)
+        if group is None:
+            return {"error": f"No sales with {by} '{key}'"}, 404
+        return {"by": by, "key": key, "month": month, **group}
+    return {"by": by, "month": month, "groups": analytics.sales(by, month=month), "total": analytics.sales_total()}
+
+
+@app.route("/extraction_cache")
+def extraction_cache_stats():
+    """Hit/miss counters and size of the DeepSeek extraction cache."""
+    return extraction_cache.stats()
+
+
+def storage_status():
+    """Backend, and for SQLite the mirror's progress."""
+    status = storage.status()
+    if sheets_mirror is not None:
+        status["mirror"] = sheets_mirror.status()
+    return status
+
+
+@app.route("/ready")
+def ready():
+    """Readiness probe: 200 once the inventory store has loaded, 503 until then."""
+    services = {"llm": deepseek_client.status(), "storage": storage_status()}
+    if store.loaded:
+        return {"status": "ready", **services}
+    return {"status": startup["state"], "error": startup["error"], **services}, 503
+
+
+@app.route("/refresh", methods=["POST"])
+def refresh_cache():
+    """
+    Write pending stock movements, then reload the cached tables from the storage. With the
+    SQLite backend this also copies pending changes to the spreadsheet and takes the
+    Maintenance lists, which are edited there, back from it.
+    """
+    store.flush()
+    if sheets_mirror is not None:
+        sheets_mirror.sync()
+        sheets_mirror.pull("maintenance")
+    store.refresh()
+    return {"status": "refreshed"}
+
+
 
 if __name__ == "__main__":
-    print("Starting up the eBay Inventory Manager...")
+    log.info("Starting up the eBay Inventory Manager...")
+    # HTTP/1.1 so the WhatsApp bot's keep-alive connections are reused instead of closed after each reply
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run(debug=True)
@@ -0,0 +1,230 @@
+"""
+In-memory stand-ins for the external services, each with injectable latency:
+gspread worksheets/spreadsheet, the OpenAI-compatible DeepSeek client and a
+speech_stream recognizer backend.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import gspread
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+INVENTORY_HEADER = ["ID", "Item", "Catalogue Number", "Storage Location", "Box Label", "Price",
+                    "Total Qty", "Remaining Qty", "Date Bought", "Place Bought", "Restock History"]
+SALES_HEADER = ["Sale ID", "Item", "Quantity", "Sold Price", "Date Sold", "Buyer", "Remaining"]
+
+BRANDS = ["Nike", "Levi's", "Adidas", "Carhartt", "Ralph Lauren", "Patagonia", "Stone Island",
+          "The North Face", "Barbour", "Dickies", "Champion", "Tommy Hilfiger"]
+GARMENTS = ["Hoodie", "Jacket", "Jeans", "T-Shirt", "Fleece", "Sweatshirt", "Shirt", "Cap",
+            "Trainers", "Gilet", "Cargo Trousers", "Polo"]
+COLOURS = ["Black", "Navy", "Grey", "Red", "Green", "White", "Beige", "Blue"]
+SIZES = ["XS", "S", "M", "L", "XL", "XXL"]
+LOCATIONS = [f"Shelf {c}" for c in "ABCDEFGH"] + ["Garage", "Loft", "Storage Unit"]
+BOXES = [f"B{i}" for i in range(1, 51)]
+PLACES = ["Vinted", "eBay", "Car Boot", "Charity Shop", "Depop", "Wholesale"]
+
+
+class FakeWorksheet:
+    """Enough of gspread.Worksheet for the app, backed by a list of rows."""
+
+    def __init__(self, title, rows, latency=0.0):
+        self.title = title
+        self.rows = [list(map(str, row)) for row in rows]
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _remote(self, op):
+        self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        target = self.rows[row - 1]
+        while len(target) < col:
+            target.append("")
+        target[col - 1] = str(value)
+
+    def get_all_values(self, *args, **kwargs):
+        self._remote("get_all_values")
+        with self._lock:
+            width = max((len(row) for row in self.rows), default=0)
+            return [row + [""] * (width - len(row)) for row in self.rows]
+
+    def col_values(self, col):
+        self._remote("col_values")
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def row_values(self, row):
+        self._remote("row_values")
+        with self._lock:
+            return list(self.rows[row - 1])
+
+    def batch_get(self, ranges, *args, **kwargs):
+        """Single cells only ("A5"), answered like the API: [[value]], or [] for an empty cell."""
+        self._remote("batch_get")
+        with self._lock:
+            values = []
+            for a1 in ranges:
+                row, col = a1_to_rowcol(a1)
+                value = self.rows[row - 1][col - 1] if row <= len(self.rows) and col <= len(self.rows[row - 1]) else ""
+                values.append([[value]] if value else [])
+            return values
+
+    def append_row(self, values, *args, **kwargs):
+        self._remote("append_row")
+        with self._lock:
+            self.rows.append([str(v) for v in values])
+
+    def append_rows(self, values, *args, **kwargs):
+        self._remote("append_rows")
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(v) for v in row] for row in values)
+            last = rowcol_to_a1(len(self.rows), max((len(row) for row in values), default=1))
+            return {"updates": {"updatedRange": f"{self.title}!A{first}:{last}", "updatedRows": len(values)}}
+
+    def update_cell(self, row, col, value):
+        self._remote("update_cell")
+        with self._lock:
+            self._set(row, col, value)
+
+    def update_cells(self, cells, *args, **kwargs):
+        self._remote("update_cells")
+        with self._lock:
+            for cell in cells:
+                self._set(cell.row, cell.col, cell.value)
+
+    def batch_update(self, data, *args, **kwargs):
+        self._remote("batch_update")
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"].split(":")[0])
+                for i, values in enumerate(item["values"]):
+                    for j, value in enumerate(values):
+                        self._set(row + i, col + j, value)
+
+
+class FakeSpreadsheet:
+    """Holds the worksheets; `worksheet()` and `add_worksheet()` mirror gspread.Spreadsheet."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sheets = {}
+
+    def load(self, inventory, sales=(), maintenance=()):
+        """Replace the contents of Inventory, Sales and Maintenance in place."""
+        for title, header, rows in (("Inventory", INVENTORY_HEADER, inventory),
+                                    ("Sales", SALES_HEADER, sales),
+                                    ("Maintenance", None, maintenance)):
+            sheet = self.sheets.setdefault(title, FakeWorksheet(title, [], self.latency))
+            sheet.rows = [list(map(str, row)) for row in ([header] if header else []) + list(rows)]
+            sheet.calls.clear()
+
+    def worksheet(self, title):
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows=100, cols=26):
+        sheet = self.sheets[title] = FakeWorksheet(title, [], self.latency)
+        return sheet
+
+    def call_counts(self):
+        total = Counter()
+        for sheet in self.sheets.values():
+            total.update({f"{sheet.title}.{op}": n for op, n in sheet.calls.items()})
+        return total
+
+
+def synthetic_inventory(size, seed=0):
+    """`size` plausible inventory rows plus a matching Maintenance sheet."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(1, size + 1):
+        name = f"{rng.choice(BRANDS)} {rng.choice(COLOURS)} {rng.choice(GARMENTS)} {rng.choice(SIZES)} #{i}"
+        qty = rng.randint(1, 20) * 100    # plenty of stock, so sale workloads never run dry
+        rows.append([f"ITEM-{i}", name, "", rng.choice(LOCATIONS), rng.choice(BOXES),
+                     f"{rng.uniform(2, 80):.2f}", qty, qty, "01/01/2025", rng.choice(PLACES), ""])
+
+    maintenance = [["Storage Location", "Box Label", "Notes", "Place Bought"]]
+    for location, box, place in itertools.zip_longest(LOCATIONS, BOXES, PLACES, fillvalue=""):
+        maintenance.append([location, box, "", place])
+    return rows, maintenance
+
+
+class FakeLLMClient:
+    """
+    OpenAI-compatible client whose answers are generated from the prompt:
+    a JSON array of new items for add prompts, a list of operations for
+    multi-item prompts and a single update dict otherwise.
+    """
+
+    def __init__(self, latency=0.0, item_names=()):
+        self.latency = latency
+        self.item_names = list(item_names)
+        self.calls = 0
+        self._rng = random.Random(1)
+        self._lock = threading.Lock()
+        self._prefixes = set()    # system prompts seen before count as prompt-cache hits
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=lambda: SimpleNamespace(data=[SimpleNamespace(id="deepseek-chat")]))
+
+    def _create(self, model=None, messages=(), **kwargs):
+        with self._lock:
+            self.calls += 1
+            pick = self._rng.choice
+        if self.latency:
+            time.sleep(self.latency)
+
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        item = pick(self.item_names) if self.item_names else "Nike Black Hoodie M #1"
+
+        if "inventory details" in system:
+            answer = [{"item": f"{line.strip()[:40]}", "price": round(self._rng.uniform(2, 80), 2),
+                       "total_qty": self._rng.randint(1, 3), "storage_location": pick(LOCATIONS),
+                       "box_label": pick(BOXES), "place_bought": pick(PLACES)}
+                      for line in user.splitlines() if line.strip()]
+        elif "one or more inventory changes" in system:
+            answer = [{"action": "restock", "item": item, "quantity": 1},
+                      {"action": "update", "item": item, "box_label": pick(BOXES)}]
+        else:
+            answer = {"update_item_name": item, "storage_location": pick(LOCATIONS).lower(),
+                      "box_label": pick(BOXES), "restock_qty": 1}
+
+        content = json.dumps(answer)
+        with self._lock:
+            hit = len(system) // 4 if system in self._prefixes else 0
+            self._prefixes.add(system)
+        prompt = len(system + user) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt, completion_tokens=len(content) // 4,
+                                prompt_cache_hit_tokens=hit, prompt_cache_miss_tokens=prompt - hit)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class FakeSpeechBackend:
+    """speech_stream backend that 'recognizes' every window after a fixed delay."""
+    name = "fake"
+
+    def __init__(self, latency=0.0, text="moved the nike hoodie to box b4"):
+        self.latency = latency
+        self.text = text
+        self.calls = 0
+
+    def recognize(self, recognizer, audio):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.text
@@ -0,0 +1,176 @@
+"""
+Offline benchmark for the app's hot routes.
+
+Runs scripted add / update / sale / voice / speech workloads against the real
+Flask app with in-memory stand-ins for Google Sheets, DeepSeek and speech
+recognition, over synthetic inventories of increasing size, and reports
+p50/p99 latency, throughput and remote calls per request for each route.
+
+Usage (from the repo root):
+    python -m bench.run
+    python -m bench.run --sizes 100,10000 --requests 200 --concurrency 8 --sheets-latency 0.08
+    python -m bench.run --storage sqlite    # local SQLite tables, mirrored to the fake spreadsheet
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# The app must not touch real services or the on-disk caches when imported
+os.environ.setdefault("WARM_UP_ON_START", "0")
+os.environ.setdefault("EXTRACTION_CACHE_PATH", ":memory:")
+os.environ.setdefault("LEDGER_PATH", ":memory:")
+os.environ.setdefault("STORAGE_PATH", ":memory:")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fakes import FakeSpreadsheet, FakeLLMClient, FakeSpeechBackend, synthetic_inventory  # noqa: E402
+
+WORKLOADS = ("add", "update", "sale", "voice", "speech")
+
+
+def make_wav(seconds, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        out.writeframes(b"\x00\x01" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def request_for(workload, n, names, wav, run):
+    """(method, path, kwargs) for the n-th request of a workload; `run` keeps texts unique across runs."""
+    name = names[(n * 7919) % len(names)]
+    if workload == "add":
+        return "post", "/", {"data": {"input_text": f"Bench item {run}-{n} bought for £{n % 50 + 1} at car boot"}}
+    if workload == "update":
+        return "post", "/", {"data": {"update_item_name": name, "restock_qty": "1", "box_label": "B4"}}
+    if workload == "sale":
+        return "post", "/", {"data": {"sales_item": name, "quantity_sold": "1", "sold_price": "10", "buyer": f"buyer{n}"}}
+    if workload == "voice":
+        return "post", "/process_voice_input", {"json": {"text": f"move {name} to box b{n % 50} ({run}-{n})", "mode": "update"}}
+    return "post", "/upload", {"data": wav, "content_type": "audio/wav"}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_workload(app_module, spreadsheet, llm, speech, workload, requests, concurrency, names, wav, run):
+    from metrics import registry
+
+    registry.reset()
+    for sheet in spreadsheet.sheets.values():
+        sheet.calls.clear()
+    llm_calls, speech_calls = llm.calls, speech.calls
+
+    client_app = app_module.app
+    latencies = []
+    failures = 0
+
+    def one(n):
+        method, path, kwargs = request_for(workload, n, names, wav, run)
+        client = client_app.test_client()
+        start = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        response.get_data()
+        return time.perf_counter() - start, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for seconds, status in pool.map(one, range(requests)):
+            latencies.append(seconds)
+            failures += status >= 400
+    elapsed = time.perf_counter() - started
+
+    # Charge this workload's background stock writes (and their mirroring) to it, not to the next one
+    app_module.store.flush()
+    if app_module.sheets_mirror is not None:
+        app_module.sheets_mirror.sync()
+    sheet_calls = sum(spreadsheet.call_counts().values())
+    llm_tokens = registry.snapshot().get("app_llm_prompt_tokens_total", {})
+    return {
+        "workload": workload,
+        "requests": requests,
+        "failures": failures,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_rps": round(requests / elapsed, 1),
+        "sheets_calls_per_req": round(sheet_calls / requests, 2),
+        "llm_calls_per_req": round((llm.calls - llm_calls) / requests, 2),
+        "llm_prompt_tokens_per_req": round(sum(llm_tokens.values()) / requests, 1),
+        "speech_calls_per_req": round((speech.calls - speech_calls) / requests, 2),
+        "sheets_calls": dict(spreadsheet.call_counts()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="inventory sizes to test")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=100, help="requests per workload")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="seconds per Sheets call")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per DeepSeek call")
+    parser.add_argument("--speech-latency", type=float, default=0.2, help="seconds per recognized window")
+    parser.add_argument("--audio-seconds", type=float, default=10.0)
+    parser.add_argument("--storage", choices=("sheets", "sqlite"), default="sheets", help="storage backend")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+    os.environ["STORAGE_BACKEND"] = args.storage
+
+    import app as app_module
+    from storage import LOADED_TABLES
+
+    spreadsheet = FakeSpreadsheet(latency=args.sheets_latency)
+    llm = FakeLLMClient(latency=args.llm_latency)
+    speech = FakeSpeechBackend(latency=args.speech_latency)
+    spreadsheet.load([], [], [])
+    app_module.use_backends(spreadsheet=spreadsheet, llm_client=llm, speech_backend=speech)
+    wav = make_wav(args.audio_seconds)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        inventory, maintenance = synthetic_inventory(size)
+        names = [row[1] for row in inventory]
+        llm.item_names = names
+
+        spreadsheet.load(inventory, [], maintenance)
+        if args.storage == "sqlite":    # seeded once; copy this size's data in without mirroring it back
+            for table, rows in app_module.sheets_storage.load(LOADED_TABLES).items():
+                app_module.storage.replace(table, rows)
+        app_module.store.invalidate()
+        load_start = time.perf_counter()
+        app_module.store.refresh()
+        load_ms = (time.perf_counter() - load_start) * 1000
+        print(f"\n== {size} rows (initial load {load_ms:.0f} ms) ==")
+        print(f"{'workload':<8} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8} {'sheets/req':>11} "
+              f"{'llm/req':>8} {'tok/req':>8} {'speech/req':>11} {'fail':>5}")
+
+        for workload in [w for w in args.workloads.split(",") if w in WORKLOADS]:
+            result = run_workload(app_module, spreadsheet, llm, speech, workload,
+                                  args.requests, args.concurrency, names, wav, run=size)
+            result.update(size=size, load_ms=round(load_ms, 1))
+            results.append(result)
+            print(f"{workload:<8} {result['p50_ms']:>9} {result['p99_ms']:>9} {result['throughput_rps']:>8} "
+                  f"{result['sheets_calls_per_req']:>11} {result['llm_calls_per_req']:>8} "
+                  f"{result['llm_prompt_tokens_per_req']:>8} {result['speech_calls_per_req']:>11} {result['failures']:>5}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
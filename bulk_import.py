@@ -0,0 +1,313 @@
+"""
+Bulk inventory import from CSV, JSONL or free-text files.
+
+Structured rows (CSV columns / JSON objects) are written as-is after
+validation; free-text lines - and rows whose only field is a `text` or
+`description` - are sent to DeepSeek in chunks, a few chunks at a time.
+Progress is checkpointed after every written batch, so an interrupted import
+can be resumed with the same import ID (in the format it was started with).
+When DeepSeek is unavailable the import stops as "failed" before the batch it
+was parsing, so a resume retries those lines instead of skipping them. Only
+one run of an import ID works from its checkpoint at a time.
+
+Usage: python bulk_import.py FILE [--format csv|jsonl|text] [--resume IMPORT_ID]
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:     # Windows: runs are only kept apart within one process
+    fcntl = None
+
+from jobs import report_progress
+from llm_client import LLMUnavailable
+
+IMPORT_DIR = Path(os.getenv("IMPORT_DIR", str(Path(__file__).parent / "imports")))
+FORMATS = ("csv", "jsonl", "text")
+MAX_REPORTED_ERRORS = 100
+# A structured row with only one of these fields is free text for the LLM
+FREE_TEXT_FIELDS = ("text", "description")
+
+
+class ImportInProgress(Exception):
+    """Raised when an import ID is started while another run of it is still going."""
+
+
+def detect_format(filename):
+    suffix = Path(filename or "").suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "text"
+
+
+def _clean_keys(row):
+    return {str(k).strip().lower().replace(" ", "_"): v for k, v in row.items() if k is not None}
+
+
+def _as_record(obj):
+    """
+    A structured dict, or free text for a row with nothing but a text or
+    description. A structured row with a missing or blank item stays a dict,
+    so validation reports it rather than it being dropped.
+    """
+    if isinstance(obj, dict):
+        obj = _clean_keys(obj)
+        text = " ".join(str(obj[key]).strip() for key in FREE_TEXT_FIELDS if str(obj.get(key) or "").strip())
+        has_fields = any(str(value).strip() for key, value in obj.items()
+                         if key not in FREE_TEXT_FIELDS and value is not None)
+        return text if text and not has_fields else obj
+    return str(obj).strip()
+
+
+def iter_records(handle, fmt):
+    """Yield (line_no, record, error) from an open file; record is a dict or a free-text string."""
+    if fmt == "csv":
+        reader = csv.DictReader(handle)
+        for row in reader:
+            yield reader.line_num, _as_record(row), None
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, _as_record(json.loads(line)), None
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"Invalid JSON: {e}"
+    else:
+        for line_no, line in enumerate(handle, 1):
+            if line.strip():
+                yield line_no, line.strip(), None
+
+
+class BulkImporter:
+    """
+    Streams an import file into the Inventory sheet.
+
+    `parse_text` turns free text into validated ItemEntry records (parse_input_with_deepseek),
+    `normalize_entry` validates a structured row into one (ADD_SCHEMA.validate) and
+    `entry_to_row` lays an entry out as a sheet row; they are passed in so this
+    module does not import app.py.
+    """
+
+    def __init__(self, store, parse_text, normalize_entry, entry_to_row,
+                 chunk_lines=None, concurrency=None, batch_rows=None):
+        self.store = store
+        self.parse_text = parse_text
+        self.normalize_entry = normalize_entry
+        self.entry_to_row = entry_to_row
+        self.chunk_lines = chunk_lines or int(os.getenv("IMPORT_CHUNK_LINES", "20"))
+        self.concurrency = concurrency or int(os.getenv("IMPORT_LLM_CONCURRENCY", "4"))
+        self.batch_rows = batch_rows or int(os.getenv("IMPORT_BATCH_ROWS", "500"))
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    # --- Checkpoints ---
+
+    @staticmethod
+    def valid_id(import_id):
+        return bool(import_id and re.fullmatch(r"[0-9a-f]{32}", import_id))
+
+    def _state_path(self, import_id):
+        return IMPORT_DIR / f"{import_id}.json"
+
+    def upload_path(self, import_id):
+        return IMPORT_DIR / f"{import_id}.upload"
+
+    def status(self, import_id):
+        """Saved checkpoint for an import, or None."""
+        path = self._state_path(import_id)
+        if not self.valid_id(import_id) or not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def _save(self, state):
+        IMPORT_DIR.mkdir(parents=True, exist_ok=True)
+        path = self._state_path(state["import_id"])
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, path)
+
+    def _lock_path(self, import_id):
+        return IMPORT_DIR / f"{import_id}.lock"
+
+    @contextmanager
+    def _claim(self, import_id):
+        """
+        Hold an import ID for one run: an in-process set, plus an flock on
+        <id>.lock so a CLI run and a server job cannot share a checkpoint
+        either. The lock goes with the process, so a crashed run can be resumed.
+        """
+        IMPORT_DIR.mkdir(parents=True, exist_ok=True)
+        with open(self._lock_path(import_id), "a") as handle:
+            with self._running_lock:
+                if import_id in self._running:
+                    raise ImportInProgress(f"Import {import_id} is already running")
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        raise ImportInProgress(f"Import {import_id} is already running")
+                self._running.add(import_id)
+            try:
+                yield
+            finally:
+                with self._running_lock:
+                    self._running.discard(import_id)
+
+    def is_running(self, import_id):
+        """Whether a run of this import ID is in progress, here or in another process."""
+        if import_id in self._running:
+            return True
+        path = self._lock_path(import_id)
+        if fcntl is None or not path.exists():
+            return False
+        with open(path, "a") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+        return False
+
+    def stage_upload(self, upload, import_id=None):
+        """Save an uploaded file under IMPORT_DIR so the job (and any resume) can read it."""
+        import_id = import_id if self.valid_id(import_id) else uuid.uuid4().hex
+        IMPORT_DIR.mkdir(parents=True, exist_ok=True)
+        upload.save(str(self.upload_path(import_id)))
+        return import_id
+
+    # --- Import ---
+
+    def run(self, path, fmt=None, import_id=None, on_progress=report_progress):
+        """
+        Import a file, resuming from the checkpoint if `import_id` has one.
+        The format is `fmt`, else the one the import was started with, else
+        detected from the file name. Returns a summary; raises
+        ImportInProgress if this import ID is already running.
+        """
+        import_id = import_id if self.valid_id(import_id) else uuid.uuid4().hex
+        with self._claim(import_id):
+            return self._run(path, fmt, import_id, on_progress)
+
+    def _run(self, path, fmt, import_id, on_progress):
+        state = self.status(import_id)
+        if fmt not in FORMATS:
+            fmt = (state or {}).get("format") or detect_format(path)
+        state = state or {
+            "import_id": import_id, "source": str(path), "format": fmt, "status": "running",
+            "position": 0, "imported": 0, "error_count": 0, "errors": [],
+        }
+        if state["status"] == "complete":
+            return state
+        state["status"] = "running"
+        state["format"] = fmt
+        state.pop("last_error", None)
+        skip = state["position"]
+
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as handle:
+                window = []
+                for position, record in enumerate(iter_records(handle, fmt)):
+                    if position < skip:
+                        continue
+                    window.append(record)
+                    if len(window) >= self.batch_rows:
+                        self._import_window(window, state, on_progress)
+                        window = []
+                if window:
+                    self._import_window(window, state, on_progress)
+        except LLMUnavailable as e:
+            # Nothing of the failed batch was written or checkpointed; answers already parsed are cached
+            state["status"] = "failed"
+            state["last_error"] = str(e)
+            self._save(state)
+            raise
+
+        state["status"] = "complete"
+        self._save(state)
+        upload = self.upload_path(import_id)
+        if Path(path) == upload and upload.exists():
+            upload.unlink()
+        return state
+
+    def _import_window(self, window, state, on_progress):
+        entries, errors = [], []
+        free_text = []
+
+        for line_no, record, error in window:
+            if error:
+                errors.append({"line": line_no, "error": error})
+            elif isinstance(record, dict):
+                entry = self.normalize_entry(record)
+                if entry.errors:
+                    errors.append({"line": line_no, "error": "; ".join(entry.errors)})
+                else:
+                    entries.append(entry)
+            elif record:
+                free_text.append((line_no, record))
+            else:
+                errors.append({"line": line_no, "error": "Empty record"})
+
+        chunks = [free_text[i:i + self.chunk_lines] for i in range(0, len(free_text), self.chunk_lines)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            parsed = pool.map(self.parse_text, ["\n".join(text for _, text in chunk) for chunk in chunks])
+            for chunk, chunk_entries in zip(chunks, parsed):
+                lines = f"{chunk[0][0]}-{chunk[-1][0]}"
+                for entry in chunk_entries:
+                    if entry.errors:
+                        errors.append({"line": lines, "error": "; ".join(entry.errors)})
+                    else:
+                        entries.append(entry)
+
+        if entries:
+            first = self.store.reserve_item_numbers(len(entries))
+            rows = [self.entry_to_row(f"ITEM-{first + i}", entry) for i, entry in enumerate(entries)]
+            self.store.append_inventory(rows)
+
+        state["position"] += len(window)
+        state["imported"] += len(entries)
+        state["error_count"] += len(errors)
+        state["errors"] = (state["errors"] + errors)[:MAX_REPORTED_ERRORS]
+        self._save(state)
+        on_progress(processed=state["position"], imported=state["imported"], errors=state["error_count"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import inventory into the Inventory sheet.")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--resume", metavar="IMPORT_ID", help="continue an interrupted import")
+    args = parser.parse_args()
+
+    from app import bulk_importer
+
+    import_id = args.resume or uuid.uuid4().hex
+    print(f"Import ID: {import_id} (pass --resume {import_id} to continue if interrupted)")
+
+    def show(processed, imported, errors):
+        print(f"Processed {processed} rows, imported {imported}, errors {errors}")
+
+    try:
+        summary = bulk_importer.run(args.file, args.format, import_id, on_progress=show)
+    except LLMUnavailable as e:
+        raise SystemExit(f"Import stopped: {e}. Run again with --resume {import_id} to continue.")
+    except ImportInProgress as e:
+        raise SystemExit(str(e))
+    print(f"Import {summary['import_id']} complete: {summary['imported']} imported, "
+          f"{summary['error_count']} errors")
+    for error in summary["errors"]:
+        print(f"  line {error['line']}: {error['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Plain-text inventory commands from chat front ends (the WhatsApp bot), as
+served by /api/command.
+
+    add <description>            new item(s), parsed like the Add form
+    sold|sale <description>      sales, e.g. "sold 2 nike hoodies to sam for £20 each"
+    restock <description>        more units of an existing item
+    update <description>         move an item or change its details
+    stock <item or ID>           remaining quantity and where it is kept (no LLM call)
+    help                         this list
+
+Sales, restocks and updates go through the same extraction and batched,
+all-or-nothing apply as multi-item voice commands. Every command returns
+a dict with `ok` and a short `reply` for the chat.
+"""
+import re
+
+from inventory_store import COL_ID, COL_ITEM, COL_STORAGE_LOCATION, COL_BOX_LABEL, COL_REMAINING_QTY
+from operations import apply_operations, OperationError
+
+# Command word -> command; the rest of the message is its argument
+VERBS = {
+    "add": "add", "new": "add",
+    "sold": "sale", "sale": "sale", "sell": "sale",
+    "restock": "restock", "restocked": "restock",
+    "update": "update", "move": "update", "moved": "update",
+    "stock": "stock", "stock?": "stock", "check": "stock", "how": "stock",
+    "help": "help", "?": "help",
+}
+COMMANDS = ("add", "sale", "restock", "update", "stock", "help")
+
+HELP = ("Commands:\n"
+        "add <item, price, qty, where>\n"
+        "sold <qty> <item> [to <buyer>] [for £<price>]\n"
+        "restock <qty> <item>\n"
+        "update <item> <new location/box>\n"
+        "stock <item or ID>")
+
+STOCK_MATCHES = 3    # items listed for a stock query that matches several
+
+
+class CommandError(ValueError):
+    """Raised for a message that is not a command."""
+
+
+def parse_command(text):
+    """(command, argument) for a message; CommandError for unknown or empty ones."""
+    text = (text or "").strip()
+    if not text:
+        raise CommandError("Empty message. " + HELP)
+    word, _, rest = text.partition(" ")
+    command = VERBS.get(word.lower().rstrip(":,"))
+    if command is None:
+        raise CommandError(f"Unknown command '{word}'. " + HELP)
+    if command == "stock":
+        # "how many X are left", "stock of X"
+        rest = re.sub(r"^(?:many|much|of|for)\s+", "", rest.strip(), flags=re.I)
+        rest = re.sub(r"\s+(?:are |do we have )?(?:left|in stock)\??$", "", rest, flags=re.I)
+    if command != "help" and not rest.strip():
+        raise CommandError(f"'{word}' needs a description. " + HELP)
+    return command, rest.strip()
+
+
+def _stock_line(row):
+    where = ", ".join(part for part in (row[COL_STORAGE_LOCATION - 1], row[COL_BOX_LABEL - 1]) if part)
+    return (f"{row[COL_ITEM - 1]} ({row[COL_ID - 1]}): {row[COL_REMAINING_QTY - 1] or 0} left"
+            + (f" - {where}" if where else ""))
+
+
+def stock_reply(store, query):
+    """Remaining stock for an item ID or (fuzzy) name."""
+    row_number = store.find_by_id(query.upper()) if re.fullmatch(r"(?i)item-\d+", query) else None
+    if row_number:
+        return {"ok": True, "reply": _stock_line(store.row(row_number))}
+
+    best, candidates = store.item_matcher().best(query)
+    names = [best] if best else candidates[:STOCK_MATCHES]
+    if not names:
+        return {"ok": False, "reply": f"No item matches '{query}'."}
+    lines = [_stock_line(store.row(store.find_by_name(name))) for name in names]
+    if not best:
+        lines.insert(0, f"Several items match '{query}':")
+    return {"ok": bool(best), "reply": "\n".join(lines)}
+
+
+def _unresolved_reply(operations):
+    lines = []
+    for op in operations:
+        if op.get("item_id"):
+            continue
+        spoken = op.get("spoken_item") or "?"
+        if op.get("candidates"):
+            lines.append(f"Which item did you mean by '{spoken}'? " + " / ".join(op["candidates"][:STOCK_MATCHES]))
+        else:
+            lines.append(f"No item matches '{spoken}'.")
+    return "\n".join(lines + ["Nothing was changed."])
+
+
+class CommandRunner:
+    """
+    Runs parsed commands against the store. `add_items(text)` and
+    `extract_operations(text)` are app.add_new_items and
+    app.extract_voice_operations, passed in so this module does not import app.py.
+    """
+
+    def __init__(self, store, add_items, extract_operations):
+        self.store = store
+        self.add_items = add_items
+        self.extract_operations = extract_operations
+
+    def run(self, text):
+        try:
+            command, argument = parse_command(text)
+        except CommandError as e:
+            return {"ok": False, "command": None, "reply": str(e)}
+        result = getattr(self, f"_{command}")(command, argument)
+        result["command"] = command
+        return result
+
+    def _help(self, command, argument):
+        return {"ok": True, "reply": HELP}
+
+    def _stock(self, command, argument):
+        return stock_reply(self.store, argument)
+
+    def _add(self, command, argument):
+        entries = self.add_items(argument)    # LLMUnavailable propagates: /api/command answers 503
+        if not entries:
+            return {"ok": False, "reply": "Couldn't find an item with a price in that. Nothing was added."}
+        lines = []
+        for e in entries:
+            if e["status"] == "success":
+                lines.append(f"Added {e['item']} ({e['id']}): {e['total_qty']} x £{e['price']:.2f}"
+                             + (f" - {e['storage_location']}" if e["storage_location"] != "Not specified" else ""))
+            else:
+                lines.append(f"Not added ({e['item'] or '?'}): {'; '.join(e['errors'])}")
+        ok = all(e["status"] == "success" for e in entries)
+        return {"ok": ok, "reply": "\n".join(lines), "items": entries}
+
+    def _operations(self, command, argument):
+        extracted = self.extract_operations(f"{command} {argument}")
+        operations = extracted.get("operations")
+        if not operations:
+            return {"ok": False, "reply": extracted.get("error") or "Couldn't work out what to change."}
+        if not all(op.get("item_id") for op in operations):
+            return {"ok": False, "reply": _unresolved_reply(operations), "operations": operations}
+        try:
+            results = apply_operations(self.store, operations)
+        except OperationError as e:
+            return {"ok": False, "reply": "\n".join(err["error"] for err in e.errors) + "\nNothing was changed.",
+                    "errors": e.errors}
+        return {"ok": True, "reply": "\n".join(r["result"] for r in results), "results": results}
+
+    _sale = _restock = _update = _operations
@@ -0,0 +1,324 @@
+"""
+Schemas for the entries the LLM (and the forms) produce, and local repair
+of the usual mistakes in model output.
+
+DeepSeek is asked for JSON-mode output, but answers are still repaired
+before anything is rejected: markdown fences, prose before or after the
+JSON, trailing commas, a single object where a list was expected (or a
+list wrapped in an object), prices like "£12" or "1,200", quantities like
+"two" or "3x" and dates in other common formats. A malformed answer is
+fixed here instead of costing the user a second round trip.
+
+Each schema validates a raw dict - a model answer or a submitted form -
+into a typed record; problems that make the record unusable are listed in
+its `errors`.
+"""
+import dataclasses
+import json
+import os
+import re
+from datetime import datetime
+
+# Ask for JSON-mode output (response_format) on every extraction call
+JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+RESPONSE_FORMAT = {"type": "json_object"}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12, "twenty": 20,
+}
+DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d %B %Y", "%d %b %Y")
+
+
+def today():
+    return datetime.now().strftime("%d/%m/%Y")
+
+
+# --- Repairing model output ---
+
+def extract_json(text):
+    """
+    The first JSON value in a model answer, or None. Tolerates markdown
+    fences, text before or after the JSON and trailing commas.
+    """
+    if not isinstance(text, str):
+        return text
+    text = re.sub(r"```(?:json)?", "", text)
+    decoder = json.JSONDecoder()
+    for candidate in (text, re.sub(r",\s*([\]}])", r"\1", text)):
+        for match in re.finditer(r"[\[{]", candidate):
+            try:
+                return decoder.raw_decode(candidate, match.start())[0]
+            except json.JSONDecodeError:
+                continue
+    return None
+
+
+def as_records(value, key=None):
+    """
+    A list of dicts from an array, a single object, or an object wrapping
+    the array (under `key`, or as its only list).
+    """
+    if isinstance(value, dict):
+        if key and isinstance(value.get(key), list):
+            value = value[key]
+        else:
+            lists = [v for v in value.values() if isinstance(v, list)]
+            if len(value) == 1 and lists:
+                value = lists[0]
+            else:
+                return [value]
+    if isinstance(value, list):
+        return [record for record in value if isinstance(record, dict)]
+    return []
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def to_text(value):
+    return str(value).strip()
+
+
+def to_price(value):
+    """
+    A price as a float: 12, "12.50", "£12", "12 pounds", "1,200", "12,50".
+    Negative prices ("-5", "£-5") are rejected.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value < 0:
+            raise ValueError(value)
+        return float(value)
+    match = re.search(r"(?:-\s*)?\d[\d,]*(?:\.\d+)?", str(value))
+    if not match or match.group().startswith("-"):
+        raise ValueError(value)
+    number = match.group()
+    if re.fullmatch(r"\d+,\d{1,2}", number):    # decimal comma
+        return float(number.replace(",", "."))
+    return float(number.replace(",", ""))
+
+
+def to_int(value):
+    """
+    A non-negative whole number: 2, 2.0, "2", "2x", "x 2", "1,200", "two".
+    Negative ("-3") and fractional ("2.5") values are rejected, not rounded.
+    """
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        value = int(value)
+    if isinstance(value, int):
+        if value < 0:
+            raise ValueError(value)
+        return value
+    text = str(value).strip().lower()
+    match = re.search(r"(?:-\s*)?\d[\d,]*(?:\.\d+)?", text)
+    if match:
+        number = float(re.sub(r"[\s,]", "", match.group()))
+        if number < 0 or not number.is_integer():
+            raise ValueError(value)
+        return int(number)
+    words = [word for word in re.findall(r"[a-z]+", text) if word in NUMBER_WORDS]
+    # "a"/"an" only count when no other number word is given ("a dozen" is 12)
+    words = [word for word in words if word not in ("a", "an")] or words
+    if words:
+        return NUMBER_WORDS[words[0]]
+    raise ValueError(value)
+
+
+def to_count(value):
+    """A positive whole number."""
+    count = to_int(value)
+    if count <= 0:
+        raise ValueError(value)
+    return count
+
+
+def to_date(value):
+    """A date as DD/MM/YYYY, from that or another common format."""
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", str(value).strip())
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
+KINDS = {"text": to_text, "price": to_price, "int": to_int, "count": to_count, "date": to_date}
+# How each kind is named in prompts
+KIND_NAMES = {"text": "text", "price": "number", "int": "integer", "count": "integer", "date": "date"}
+
+
+# --- Schemas ---
+
+class Field:
+    """
+    One field of a schema. `kind` picks the coercion (see KINDS). A missing
+    or invalid required field is an error; an optional one falls back to
+    `default` (a value or a function of no arguments). A `strict` optional
+    field may be left out, but a value given for it must be valid.
+    """
+
+    def __init__(self, name, kind="text", required=False, default=None, aliases=(), description="",
+                 strict=False):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.strict = strict
+        self.default = default
+        self.aliases = aliases
+        self.description = description
+
+    def default_value(self):
+        return self.default() if callable(self.default) else self.default
+
+
+def _key(name):
+    return re.sub(r"[\s\-]+", "_", str(name).strip().lower())
+
+
+class Schema:
+    """Validates raw dicts (model answers or forms) into `record` instances."""
+
+    def __init__(self, name, record, fields):
+        self.name = name
+        self.record = record
+        self.fields = fields
+        self._names = {}
+        for f in fields:
+            for alias in (f.name,) + tuple(f.aliases):
+                self._names.setdefault(_key(alias), f.name)
+
+    def validate(self, raw, defaults=True):
+        """
+        A record from a raw dict; with defaults=False fields that are
+        missing or invalid are None instead of their default.
+        """
+        values = {}
+        for key, value in (raw or {}).items():
+            name = self._names.get(_key(key))
+            if name and (name not in values or _blank(values[name])):
+                values[name] = value
+
+        data, errors = {}, []
+        for f in self.fields:
+            value = values.get(f.name)
+            if _blank(value):
+                if f.required:
+                    errors.append(f"Missing required field: {f.name}")
+                data[f.name] = f.default_value() if defaults else None
+                continue
+            try:
+                data[f.name] = KINDS[f.kind](value)
+            except (TypeError, ValueError):
+                if f.required or f.strict:
+                    errors.append(f"Invalid {f.name.replace('_', ' ')} format")
+                data[f.name] = f.default_value() if defaults else None
+        return self.record(**data, errors=errors)
+
+    def validate_many(self, value, key=None):
+        return [self.validate(record) for record in as_records(value, key)]
+
+    def describe(self, exclude=()):
+        """The fields as prompt lines: - `name` (kind, required): description."""
+        lines = []
+        for f in self.fields:
+            if f.name in exclude:
+                continue
+            notes = KIND_NAMES[f.kind] + (", required" if f.required else "")
+            lines.append(f"- `{f.name}` ({notes})" + (f": {f.description}" if f.description else ""))
+        return "\n".join(lines)
+
+
+class Record:
+    @property
+    def valid(self):
+        return not self.errors
+
+    def as_dict(self):
+        return dataclasses.asdict(self)
+
+
+@dataclasses.dataclass
+class ItemEntry(Record):
+    """A new inventory item."""
+    item: str = "Unknown Item"
+    price: float = 0.0
+    date: str = ""
+    storage_location: str = "Not specified"
+    box_label: str = ""
+    total_qty: int = 1
+    remaining_qty: int = None
+    place_bought: str = "Unknown location"
+    errors: list = dataclasses.field(default_factory=list)
+    id: str = None
+
+    def __post_init__(self):
+        if self.remaining_qty is None:
+            self.remaining_qty = self.total_qty
+
+
+@dataclasses.dataclass
+class UpdateEntry(Record):
+    """Changes to an existing item, found by ID or name."""
+    update_id: str = ""
+    update_item_name: str = ""
+    catalogue_number: str = ""
+    storage_location: str = ""
+    box_label: str = ""
+    place_bought: str = ""
+    restock_qty: int = None
+    quantity_sold: int = None
+    errors: list = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class SaleEntry(Record):
+    """A sale of an existing item."""
+    sales_item: str = ""
+    quantity_sold: int = 1
+    sold_price: float = 0.0
+    date_sold: str = ""
+    buyer: str = ""
+    errors: list = dataclasses.field(default_factory=list)
+
+
+ADD_SCHEMA = Schema("add", ItemEntry, [
+    Field("item", required=True, default="Unknown Item", aliases=("name", "item_name")),
+    Field("price", "price", required=True, default=0.0, aliases=("cost", "price_gbp"),
+          description="GBP, extracted exactly as stated and never inflated"),
+    Field("date", "date", default=today, aliases=("date_bought",), description="DD/MM/YYYY", strict=True),
+    Field("storage_location", default="Not specified", aliases=("location",)),
+    Field("box_label", default="", aliases=("box",)),
+    Field("total_qty", "count", default=1, aliases=("quantity", "qty")),
+    Field("remaining_qty", "int"),
+    Field("place_bought", default="Unknown location", aliases=("supplier", "bought_from")),
+])
+
+UPDATE_SCHEMA = Schema("update", UpdateEntry, [
+    Field("update_id", default="", aliases=("id", "item_id")),
+    Field("update_item_name", default="", aliases=("item", "item_name", "name"),
+          description="the item name as spoken"),
+    Field("catalogue_number", default=""),
+    Field("storage_location", default="", aliases=("location",)),
+    Field("box_label", default="", aliases=("box",)),
+    Field("place_bought", default="", aliases=("supplier",)),
+    Field("restock_qty", "count", aliases=("restock", "quantity_restocked"), description="units that arrived"),
+    Field("quantity_sold", "count", description="units sold"),
+])
+
+SALE_SCHEMA = Schema("sale", SaleEntry, [
+    Field("sales_item", required=True, default="", aliases=("item", "item_name", "sale_item", "name"),
+          description="the item name as spoken"),
+    Field("quantity_sold", "count", default=1, aliases=("quantity", "qty")),
+    Field("sold_price", "price", default=0.0, aliases=("price",), description="GBP per unit", strict=True),
+    Field("date_sold", "date", default=today, aliases=("date",), description="DD/MM/YYYY", strict=True),
+    Field("buyer", default=""),
+])
+
+# Voice extraction modes and the schema each one fills in
+VOICE_SCHEMAS = {"update": UPDATE_SCHEMA, "sale": SALE_SCHEMA}
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent / "extraction_cache.db"
+
+
+def normalize_text(text):
+    """Case-fold, collapse whitespace and drop trailing punctuation so retries hit the same key."""
+    text = re.sub(r"\s+", " ", (text or "").casefold()).strip()
+    return text.rstrip(" .!?,;")
+
+
+def prompt_hash(system_prompt):
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of LLM extraction results.
+
+    Entries are keyed on the normalized input text, the mode, the model name
+    and a hash of the system prompt, so changing the prompt (or the
+    Maintenance lists embedded in it) never serves stale answers. The cache
+    holds at most `max_entries` rows and evicts the least recently used.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        if path is None:
+            path = os.getenv("EXTRACTION_CACHE_PATH", str(DEFAULT_PATH))
+        if max_entries is None:
+            max_entries = int(os.getenv("EXTRACTION_CACHE_SIZE", "5000"))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON extractions(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text, mode, model, system_prompt):
+        parts = [normalize_text(text), mode or "", model or "", prompt_hash(system_prompt)]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Cached value for `key`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM extractions WHERE key IN ("
+                " SELECT key FROM extractions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size, "max_entries": self.max_entries}
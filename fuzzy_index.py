@@ -0,0 +1,144 @@
+import importlib.util
+import threading
+from collections import Counter, defaultdict
+
+from rapidfuzz import fuzz, process, utils
+
+# process.cdist needs numpy
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Above this many choices, lookups first narrow the scan to choices sharing words with the query
+PREFILTER_MIN_CHOICES = 2000
+PREFILTER_LIMIT = 1000
+# extract_many only spreads cdist over all cores for batches this big; smaller ones are faster on one thread
+PARALLEL_MIN_CELLS = 1_000_000
+
+
+class FuzzyMatcher:
+    """
+    Reusable fuzzy lookup over one vocabulary (item names, locations, ...).
+
+    Choices are preprocessed once (lower-cased, punctuation stripped) when
+    they are added, so a lookup is a single rapidfuzz scan with no per-call
+    list building. New choices can be added incrementally.
+
+    Exact (normalized) matches are answered from a dict. For large
+    vocabularies a word index narrows the scan to the choices sharing the
+    most words with the query, falling back to a full scan when that finds
+    nothing, so lookup time stays roughly flat as the vocabulary grows.
+    The cut is by overlap count only, never by insertion order: every
+    choice tied with the last one kept is scanned too.
+    """
+
+    def __init__(self, choices=(), scorer=fuzz.WRatio):
+        self.scorer = scorer
+        self._choices = []
+        self._processed = []
+        self._seen = set()
+        self._exact = {}                      # processed choice -> index of first choice
+        self._words = defaultdict(list)       # word -> indexes of choices containing it
+        self._lock = threading.Lock()
+        self.extend(choices)
+
+    def __len__(self):
+        return len(self._choices)
+
+    def __iter__(self):
+        return iter(list(self._choices))
+
+    def add(self, choice):
+        if not choice:
+            return
+        with self._lock:
+            if choice in self._seen:
+                return
+            processed = utils.default_process(choice)
+            index = len(self._choices)
+            self._seen.add(choice)
+            self._choices.append(choice)
+            self._processed.append(processed)
+            self._exact.setdefault(processed, index)
+            for word in set(processed.split()):
+                self._words[word].append(index)
+
+    def extend(self, choices):
+        for choice in choices:
+            self.add(choice)
+
+    def extract(self, query, limit=3, threshold=80, scorer=None):
+        """
+        Ranked [(choice, score), ...] for one query, best first.
+        `scorer` overrides the matcher's own for this call (e.g. a cheaper one for rough hints).
+        """
+        if not query or not self._choices:
+            return []
+        scorer = scorer or self.scorer
+        processed = utils.default_process(query)
+
+        if len(self._choices) > PREFILTER_MIN_CHOICES:
+            candidates = self._candidates(processed)
+            if candidates and len(candidates) < len(self._choices):
+                matches = process.extract(
+                    processed, [self._processed[idx] for idx in candidates],
+                    scorer=scorer, processor=None, limit=limit, score_cutoff=threshold,
+                )
+                if matches:
+                    return [(self._choices[candidates[pos]], score) for _, score, pos in matches]
+
+        matches = process.extract(
+            processed, self._processed,
+            scorer=scorer, processor=None, limit=limit, score_cutoff=threshold,
+        )
+        return [(self._choices[idx], score) for _, score, idx in matches]
+
+    def _candidates(self, processed_query):
+        """
+        Indexes of the choices sharing the most words with the query: the top
+        PREFILTER_LIMIT, plus any tied with the last of those (so possibly more).
+        """
+        counts = Counter()
+        for word in set(processed_query.split()):
+            counts.update(self._words.get(word, ()))
+        if len(counts) <= PREFILTER_LIMIT:
+            return list(counts)
+        cutoff = sorted(counts.values(), reverse=True)[PREFILTER_LIMIT - 1]
+        return [idx for idx, count in counts.items() if count >= cutoff]
+
+    def extract_many(self, queries, limit=3, threshold=80, scorer=None):
+        """Ranked candidates for several queries at once, using one cdist pass when numpy is available."""
+        if not HAVE_NUMPY or not self._choices:
+            return [self.extract(query, limit, threshold, scorer) for query in queries]
+
+        processed = [utils.default_process(query or "") for query in queries]
+        workers = -1 if len(processed) * len(self._processed) >= PARALLEL_MIN_CELLS else 1
+        scores = process.cdist(processed, self._processed, scorer=scorer or self.scorer,
+                               processor=None, score_cutoff=threshold, workers=workers)
+        results = []
+        for query, row in zip(queries, scores):
+            if not query:
+                results.append([])
+                continue
+            ranked = row.argsort()[::-1][:limit]
+            results.append([(self._choices[idx], float(row[idx])) for idx in ranked if row[idx] >= threshold])
+        return results
+
+    def best(self, query, threshold=80, margin=5):
+        """
+        (best_match, candidates) for a query.
+
+        best_match is None when nothing reaches the threshold, or when the top
+        candidates are within `margin` points of each other and the caller
+        should ask which one was meant; candidates holds the ranked names.
+        """
+        exact = self._exact.get(utils.default_process(query or ""))
+        if exact is not None:
+            return self._choices[exact], [self._choices[exact]]
+
+        matches = self.extract(query, limit=5, threshold=threshold)
+        candidates = [choice for choice, _ in matches]
+        if not matches:
+            return None, []
+        top_score = matches[0][1]
+        if top_score >= 100 or len(matches) == 1 or top_score - matches[1][1] >= margin:
+            return matches[0][0], candidates
+        return None, [choice for choice, score in matches if top_score - score < margin]
@@ -0,0 +1,262 @@
+"""
+Read-only queries over the Inventory and Sales sheets, for the JSON read API.
+
+Queries run against an InventorySnapshot: an immutable copy of the store's
+rows with sorted-name, ID and per-field indexes. SnapshotCache rebuilds it
+only when the store has changed (and at most once per `interval` seconds),
+so polling clients never cause a sheet download or a full scan.
+"""
+import base64
+import bisect
+import os
+import threading
+import time
+import uuid
+
+from inventory_store import (
+    COL_ID, COL_ITEM, COL_CATALOGUE, COL_STORAGE_LOCATION, COL_BOX_LABEL, COL_PRICE,
+    COL_TOTAL_QTY, COL_REMAINING_QTY, COL_DATE, COL_PLACE_BOUGHT, COL_RESTOCK_HISTORY,
+)
+
+ITEM_FIELDS = {
+    "id": COL_ID,
+    "item": COL_ITEM,
+    "catalogue_number": COL_CATALOGUE,
+    "storage_location": COL_STORAGE_LOCATION,
+    "box_label": COL_BOX_LABEL,
+    "price": COL_PRICE,
+    "total_qty": COL_TOTAL_QTY,
+    "remaining_qty": COL_REMAINING_QTY,
+    "date": COL_DATE,
+    "place_bought": COL_PLACE_BOUGHT,
+    "restock_history": COL_RESTOCK_HISTORY,
+}
+SALE_FIELDS = ("sale_id", "item", "quantity", "sold_price", "date_sold", "buyer", "remaining")
+
+# Item fields that can be filtered on (exact, case-insensitive)
+FILTER_FIELDS = ("storage_location", "box_label", "place_bought")
+
+MATCH_MODES = ("auto", "prefix", "fuzzy")
+FUZZY_RESULTS = 200    # fuzzy search ranks at most this many names
+DEFAULT_PAGE = 50
+MAX_PAGE = 500
+
+# ETags must change across restarts too, not just with the store version
+_BOOT_ID = uuid.uuid4().hex[:8]
+
+
+class QueryError(ValueError):
+    """Raised for an invalid query parameter (bad cursor, unknown mode, ...)."""
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(str(value).replace("£", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _item(row, row_number):
+    item = {field: row[col - 1] for field, col in ITEM_FIELDS.items()}
+    item["price"] = _float(item["price"])
+    for field in ("total_qty", "remaining_qty"):
+        item[field] = _int(item[field])
+    item["row"] = row_number
+    return item
+
+
+def _sale(row, position):
+    row = list(row) + [""] * (len(SALE_FIELDS) - len(row))
+    sale = dict(zip(SALE_FIELDS, row))
+    sale["quantity"] = _int(sale["quantity"])
+    sale["sold_price"] = _float(sale["sold_price"])
+    sale["remaining"] = _int(sale["remaining"])
+    sale["row"] = position + 2
+    return sale
+
+
+# --- Cursors ---
+
+def encode_cursor(kind, value):
+    return base64.urlsafe_b64encode(f"{kind}:{value}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, kind):
+    """The value of a cursor made by `encode_cursor(kind, ...)`; None for no cursor."""
+    if not cursor:
+        return None
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, value = text.split(":", 1)
+        if prefix == kind:
+            return int(value)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    raise QueryError("Invalid cursor")
+
+
+def paginate(positions, cursor, limit, ranked):
+    """
+    One page of `positions`, and the cursor for the next page (or None).
+
+    Row-ordered results page by position ("after row N"), which stays
+    correct as rows are appended; ranked results page by offset.
+    """
+    if ranked:
+        start = decode_cursor(cursor, "o") or 0
+        page = positions[start:start + limit]
+        more = start + limit < len(positions)
+        return page, encode_cursor("o", start + limit) if more else None
+
+    after = decode_cursor(cursor, "r")
+    start = bisect.bisect_right(positions, after) if after is not None else 0
+    page = positions[start:start + limit]
+    more = start + limit < len(positions)
+    return page, encode_cursor("r", page[-1]) if more else None
+
+
+def page_limit(value):
+    limit = _int(value) if value not in (None, "") else DEFAULT_PAGE
+    if limit is None or limit <= 0:
+        raise QueryError("limit must be a positive integer")
+    return min(limit, MAX_PAGE)
+
+
+class InventorySnapshot:
+    """
+    Immutable, indexed copy of the inventory and sales rows at one store version.
+
+    Rows are kept as plain lists and only turned into dicts for the page
+    being returned; the indexes cover what queries filter on.
+    """
+
+    def __init__(self, version, inventory, sales):
+        self.version = version
+        self.etag = f"{_BOOT_ID}-{version}"
+        self.built_at = time.monotonic()
+        self._inventory = inventory
+        self._sales = sales
+        self._remaining = None    # remaining_qty per item, built by the first low-stock query
+
+        self._by_id = {}
+        self._by_name = {}
+        self._by_field = {field: {} for field in FILTER_FIELDS}
+        filter_columns = [(self._by_field[field], ITEM_FIELDS[field] - 1) for field in FILTER_FIELDS]
+        id_col, name_col = COL_ID - 1, COL_ITEM - 1
+        for position, row in enumerate(inventory):
+            if row[id_col]:
+                self._by_id.setdefault(row[id_col], position)
+            if row[name_col]:
+                self._by_name.setdefault(row[name_col], []).append(position)
+            for index, col in filter_columns:
+                index.setdefault(row[col].casefold(), []).append(position)
+        # (casefolded name, position), sorted, for prefix search by bisection
+        self._names = sorted((row[name_col].casefold(), position)
+                             for position, row in enumerate(inventory) if row[name_col])
+
+    def item_at(self, position):
+        return _item(self._inventory[position], position + 2)
+
+    def sale_at(self, position):
+        return _sale(self._sales[position], position)
+
+    def item(self, item_id):
+        position = self._by_id.get(item_id)
+        return self.item_at(position) if position is not None else None
+
+    def _prefix(self, query):
+        prefix = query.casefold()
+        start = bisect.bisect_left(self._names, (prefix,))
+        positions = []
+        for index in range(start, len(self._names)):
+            name, position = self._names[index]
+            if not name.startswith(prefix):
+                break
+            positions.append(position)
+        return sorted(positions)
+
+    def _fuzzy(self, query, matcher):
+        positions = []
+        for name, _ in matcher.extract(query, limit=FUZZY_RESULTS, threshold=60):
+            positions.extend(self._by_name.get(name, ()))
+        return positions
+
+    def search_items(self, query="", match="auto", filters=None, low_stock=None, matcher=None):
+        """
+        Positions of matching items and whether they are ranked by relevance.
+
+        `match` is "prefix" (name starts with the query, in row order),
+        "fuzzy" (best matches first, needs `matcher`) or "auto" (prefix,
+        falling back to fuzzy when nothing starts with the query).
+        `low_stock` keeps items with at most that many remaining.
+        """
+        if match not in MATCH_MODES:
+            raise QueryError(f"match must be one of: {', '.join(MATCH_MODES)}")
+        query = (query or "").strip()
+        ranked = False
+
+        if not query:
+            positions = range(len(self._inventory))
+        elif match == "fuzzy":
+            positions, ranked = self._fuzzy(query, matcher), True
+        else:
+            positions = self._prefix(query)
+            if not positions and match == "auto" and matcher is not None:
+                positions, ranked = self._fuzzy(query, matcher), True
+
+        keep = None
+        for field, value in (filters or {}).items():
+            if value:
+                matching = set(self._by_field[field].get(value.strip().casefold(), ()))
+                keep = matching if keep is None else keep & matching
+        if keep is not None:
+            positions = sorted(keep) if not query else [p for p in positions if p in keep]
+        if low_stock is not None:
+            if self._remaining is None:
+                self._remaining = [_int(row[COL_REMAINING_QTY - 1]) for row in self._inventory]
+            remaining = self._remaining
+            positions = [p for p in positions if remaining[p] is not None and remaining[p] <= low_stock]
+        return list(positions), ranked
+
+    def search_sales(self, item="", buyer=""):
+        """Positions of sales whose item name contains `item` and whose buyer is `buyer` (case-insensitive)."""
+        item, buyer = (item or "").strip().casefold(), (buyer or "").strip().casefold()
+        return [position for position, row in enumerate(self._sales)
+                if (not item or (len(row) > 1 and item in row[1].casefold()))
+                and (not buyer or (len(row) > 5 and row[5].casefold() == buyer))]
+
+
+class SnapshotCache:
+    """
+    Builds InventorySnapshots from a store on demand.
+
+    A snapshot is reused while the store is unchanged, and for at most
+    `interval` seconds after it changes, so a burst of writes costs one
+    rebuild rather than one per poll.
+    """
+
+    def __init__(self, store, interval=None):
+        if interval is None:
+            interval = float(os.getenv("INVENTORY_SNAPSHOT_INTERVAL", "1"))
+        self.store = store
+        self.interval = interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None and (snapshot.version == self.store.version
+                                     or time.monotonic() - snapshot.built_at < self.interval):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != self.store.version:
+                snapshot = self._snapshot = InventorySnapshot(*self.store.export())
+            return snapshot
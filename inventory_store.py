@@ -0,0 +1,619 @@
+import logging
+import os
+import threading
+import time
+
+from fuzzy_index import FuzzyMatcher
+from ledger import StockLedger
+from sheet_writer import StaleRows
+
+log = logging.getLogger("elliotonline.store")
+
+# Inventory sheet layout (1-based column numbers, as used by gspread)
+COL_ID = 1
+COL_ITEM = 2
+COL_CATALOGUE = 3
+COL_STORAGE_LOCATION = 4
+COL_BOX_LABEL = 5
+COL_PRICE = 6
+COL_TOTAL_QTY = 7
+COL_REMAINING_QTY = 8
+COL_DATE = 9
+COL_PLACE_BOUGHT = 10
+COL_RESTOCK_HISTORY = 11
+INVENTORY_WIDTH = 11
+
+# Columns owned by the stock ledger; only `record_movements()` changes them
+STOCK_COLUMNS = (COL_TOTAL_QTY, COL_REMAINING_QTY, COL_RESTOCK_HISTORY)
+
+
+def _column(rows, col):
+    """Return one column (1-based) from a block of rows, without trailing blanks."""
+    values = [row[col - 1] if len(row) >= col else "" for row in rows]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+def _quantity(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _sheet_balance(row):
+    """(remaining, total, history) as the sheet row has them."""
+    total = _quantity(row[COL_TOTAL_QTY - 1], 1)
+    return _quantity(row[COL_REMAINING_QTY - 1], total), total, row[COL_RESTOCK_HISTORY - 1] or ""
+
+
+class InventoryStore:
+    """
+    In-process copy of the Inventory, Sales and Maintenance tables.
+
+    All three tables are loaded once from `storage` (a SheetsStorage or
+    SQLiteStorage, see storage.py) and kept in memory. Lookups are served
+    from the local rows and indexes; writes go to the storage first and are
+    then applied locally, so the cache never runs ahead of the storage.
+    The whole store is reloaded when it is older than `ttl` seconds or when
+    `invalidate()` is called.
+
+    Write methods take an optional `batch` (from `store.batch()`); queued
+    writes are sent together by `store.commit(batch)`. Without a batch each
+    call is committed on its own.
+
+    Cached row numbers can go stale before the TTL does (another worker
+    appends, someone sorts the sheet), so every row edit also checks that
+    the row still holds the item's ID. If it does not, the store reloads,
+    moves the edit to the item's current row and tries once more; appended
+    rows are placed where the storage reports they landed.
+
+    Stock is the exception: sales, restocks and adjustments go through
+    `record_movements()`, which checks and records them atomically in the
+    StockLedger and updates the local rows at once. Pending movements are
+    written to the storage in batches by `flush()` - from a background thread
+    every `flush_interval` seconds, or inline when the interval is 0.
+
+    Listeners (see `add_listener()`) are told about every local change, so
+    derived data such as the analytics rollups can follow incrementally.
+    """
+
+    def __init__(self, storage, ttl=None, ledger=None, flush_interval=None, flush_rows=None):
+        self.storage = storage
+        if ttl is None:
+            ttl = float(os.getenv("INVENTORY_CACHE_TTL", "300"))
+        self.ttl = ttl
+        self.ledger = ledger or StockLedger()
+        if flush_interval is None:
+            flush_interval = float(os.getenv("LEDGER_FLUSH_INTERVAL", "0.5"))
+        if flush_rows is None:
+            flush_rows = int(os.getenv("LEDGER_FLUSH_ROWS", "500"))
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.RLock()    # one download or stock flush at a time; others wait for it
+        self._flush_wanted = threading.Event()
+        self._flusher = None
+        self._loaded_at = None
+        self._version = 0       # bumped on every change to the local rows
+        self._inventory = []    # includes the header row, so index == row number - 1
+        self._sales = []
+        self._maintenance = []
+        self._by_id = {}
+        self._by_name = {}
+        self._item_matcher = FuzzyMatcher()
+        self._maintenance_matchers = {}
+        self._listeners = []
+
+    # --- Loading ---
+
+    def refresh(self):
+        """Load all three tables, rebuild the indexes and reconcile them with the ledger."""
+        with self._refresh_lock:
+            as_of = time.time()
+            tables = self.storage.load()
+            inventory, sales, maintenance = tables["inventory"], tables["sales"], tables["maintenance"]
+
+            with self._lock:
+                self._inventory = [self._pad(row) for row in inventory] or [self._pad([])]
+                self._sales = sales
+                self._maintenance = maintenance
+                self._maintenance_matchers = {}
+                self._rebuild_indexes()
+                self._reconcile_ledger(as_of)
+                self._loaded_at = time.monotonic()
+                self._version += 1
+                self._notify("reset", self._inventory[1:], self._sales[1:])
+
+        if self.ledger.pending_count():
+            self._schedule_flush()
+
+    def _reconcile_ledger(self, as_of):
+        """
+        Make the ledger and the freshly loaded rows agree: idle items take
+        the sheet's values, items with movements the sheet does not show yet
+        keep the ledger's, and unwritten sales are added to the local rows.
+        """
+        balances = {self._stock_key(n): _sheet_balance(self._inventory[n - 1])
+                    for n in range(2, len(self._inventory) + 1)}
+        for key, balance in self.ledger.reseed(balances, as_of).items():
+            row_number = self._row_for_key(key)
+            if row_number:
+                self._set_balance(row_number, balance)
+        for movement in self.ledger.pending():
+            if movement["data"] and movement["data"].get("sale"):
+                self._sales.append([str(value) for value in movement["data"]["sale"]])
+
+    def invalidate(self):
+        """Force a reload on the next access."""
+        with self._lock:
+            self._loaded_at = None
+
+    @property
+    def loaded(self):
+        """True once the tables have been loaded at least once."""
+        return bool(self._inventory)
+
+    def ensure_fresh(self):
+        """Reload now if the cached tables have expired (listeners then get a reset)."""
+        self._ensure_fresh()
+
+    def _stale(self):
+        with self._lock:
+            return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def _ensure_fresh(self):
+        if not self._stale():
+            return
+        with self._refresh_lock:
+            if self._stale():    # another thread may have just reloaded
+                self.refresh()
+
+    def _rebuild_indexes(self):
+        self._by_id = {}
+        self._by_name = {}
+        self._item_matcher = FuzzyMatcher()
+        for idx in range(1, len(self._inventory)):
+            self._index_row(idx + 1)
+
+    def _index_row(self, row_number):
+        row = self._inventory[row_number - 1]
+        item_id, item_name = row[COL_ID - 1], row[COL_ITEM - 1]
+        if item_id:
+            self._by_id.setdefault(item_id, row_number)
+        if item_name:
+            self._by_name.setdefault(item_name, row_number)
+            self._item_matcher.add(item_name)
+
+    def _stock_key(self, row_number):
+        """Ledger key of an inventory row: its ID, or its row number for rows without one."""
+        return self._inventory[row_number - 1][COL_ID - 1] or f"row:{row_number}"
+
+    def _row_for_key(self, key):
+        if key.startswith("row:"):
+            row_number = int(key[4:])
+            return row_number if 1 < row_number <= len(self._inventory) else None
+        return self._by_id.get(key)
+
+    def _set_balance(self, row_number, balance):
+        remaining, total, history = balance
+        row = self._inventory[row_number - 1]
+        row[COL_REMAINING_QTY - 1] = str(remaining)
+        row[COL_TOTAL_QTY - 1] = str(total)
+        row[COL_RESTOCK_HISTORY - 1] = history
+
+    # --- Listeners ---
+
+    def add_listener(self, listener):
+        """
+        Follow changes to the local rows. The listener's methods are called
+        under the store lock and must not call back into the store:
+
+        - reset(inventory_rows, sales_rows) after every reload (headers excluded; read-only)
+        - row_changed(old_row, new_row) when an inventory row changes (old_row None for new rows)
+        - sale_added(sale_row, item_row) when a sale is recorded (item_row None if unknown)
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if self._inventory:
+                self._notify("reset", self._inventory[1:], self._sales[1:])
+
+    def _notify(self, event, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception:
+                log.exception("Store listener %r failed on %s", listener, event)
+
+    @staticmethod
+    def _pad(row):
+        row = list(row)
+        while len(row) < INVENTORY_WIDTH:
+            row.append("")
+        return row
+
+    # --- Inventory reads ---
+
+    def find_by_id(self, item_id):
+        """Row number of the item with this ID, or None."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._by_id.get(item_id)
+
+    def find_by_name(self, item_name):
+        """Row number of the first item with exactly this name, or None."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._by_name.get(item_name)
+
+    def row(self, row_number):
+        """Copy of an inventory row, padded to the full sheet width."""
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._inventory[row_number - 1])
+
+    def item_names(self):
+        """All item names (column B), header excluded."""
+        self._ensure_fresh()
+        with self._lock:
+            return [row[COL_ITEM - 1] for row in self._inventory[1:] if row[COL_ITEM - 1]]
+
+    def item_matcher(self):
+        """FuzzyMatcher over item names; kept up to date as rows are appended."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._item_matcher
+
+    def next_item_number(self):
+        """Number the next ITEM-N id will get (at least data rows + 1)."""
+        self._ensure_fresh()
+        return self.ledger.peek("item", floor=len(self._inventory))
+
+    def reserve_item_numbers(self, count):
+        """
+        Reserve a block of `count` ITEM-N numbers and return the first one.
+
+        Numbers come from the ledger's counter, so they are never handed out
+        twice - not across threads, worker processes or restarts.
+        """
+        self._ensure_fresh()
+        return self.ledger.reserve("item", count, floor=len(self._inventory))
+
+    @property
+    def version(self):
+        """Counter that changes whenever the local rows do."""
+        self._ensure_fresh()
+        return self._version
+
+    def export(self):
+        """(version, inventory rows, sales rows), copied together; headers excluded."""
+        self._ensure_fresh()
+        with self._lock:
+            return (self._version, [list(row) for row in self._inventory[1:]],
+                    [list(row) for row in self._sales[1:]])
+
+    # --- Other sheets ---
+
+    def maintenance_column(self, col):
+        """Values from a Maintenance column (1-based), header excluded."""
+        self._ensure_fresh()
+        with self._lock:
+            return _column(self._maintenance, col)[1:]
+
+    def maintenance_matcher(self, col):
+        """FuzzyMatcher over a Maintenance column, built once per refresh."""
+        self._ensure_fresh()
+        with self._lock:
+            if col not in self._maintenance_matchers:
+                self._maintenance_matchers[col] = FuzzyMatcher(_column(self._maintenance, col)[1:])
+            return self._maintenance_matchers[col]
+
+    def sales_rows(self):
+        """Sales rows, header excluded."""
+        self._ensure_fresh()
+        with self._lock:
+            return [list(row) for row in self._sales[1:]]
+
+    # --- Writes (through to the storage, then local) ---
+
+    def batch(self):
+        """Start a batch of writes to be sent with `commit()`."""
+        return self.storage.batch()
+
+    def commit(self, batch):
+        """
+        Send a batch to the storage; local rows are updated once it succeeds.
+        If inventory rows have moved, reload and retry once with the edits on
+        the items' current rows.
+        """
+        try:
+            self.storage.submit(batch)
+        except StaleRows as e:
+            if e.worksheet != self.storage.inventory:
+                raise
+            log.warning("%s since the last load; reloading", e)
+            self.refresh()
+            self._relocate(batch)
+            self.storage.submit(batch)
+
+    def _expect_row(self, batch, row_number):
+        """Have `batch` check that an inventory row still holds the item cached there (by ID, else name)."""
+        row = self._inventory[row_number - 1]
+        col = COL_ID if row[COL_ID - 1] else COL_ITEM
+        batch.expect(self.storage.inventory, row_number, col, row[col - 1])
+        return col, row[col - 1]
+
+    def _locate(self, row_number, col, value):
+        """The row now holding the item whose ID (or name) was `value` at `row_number`, or None."""
+        if row_number <= len(self._inventory) and self._inventory[row_number - 1][col - 1] == value:
+            return row_number
+        return (self._by_id if col == COL_ID else self._by_name).get(value)
+
+    def _relocate(self, batch):
+        with self._lock:
+            moves = {}
+            for (row_number, col), value in batch.expected(self.storage.inventory).items():
+                found = self._locate(row_number, col, value)
+                if not found:
+                    raise StaleRows(self.storage.inventory, [row_number])
+                moves[row_number] = found
+        batch.move_rows(self.storage.inventory, moves)
+
+    def _write(self, queue, batch):
+        if batch is None:
+            own = self.batch()
+            queue(own)
+            self.commit(own)
+        else:
+            queue(batch)
+
+    def update_row(self, row_number, changes, batch=None):
+        """Write {column: value} changes for one inventory row (stock columns go through `record_movements`)."""
+        if not changes:
+            return
+        self._ensure_fresh()
+        changes = dict(changes)
+        expected = []
+
+        def apply():
+            with self._lock:
+                current = self._locate(row_number, *expected)
+                if not current:    # gone since the write; the next load shows where it went
+                    self._loaded_at = None
+                    return
+                row = self._inventory[current - 1]
+                old = list(row)
+                for col, value in changes.items():
+                    while len(row) < col:
+                        row.append("")
+                    row[col - 1] = str(value)
+                if row[COL_ID - 1] != old[COL_ID - 1] or row[COL_ITEM - 1] != old[COL_ITEM - 1]:
+                    self._rebuild_indexes()
+                self._version += 1
+                self._notify("row_changed", old, list(row))
+
+        def queue(target):
+            with self._lock:
+                expected[:] = self._expect_row(target, row_number)
+            target.update_row(self.storage.inventory, row_number, changes)
+            target.on_commit(apply)
+
+        self._write(queue, batch)
+
+    def append_inventory(self, rows, batch=None):
+        """Append new inventory rows and index them at the row numbers the storage gave them."""
+        if not rows:
+            return
+        self._ensure_fresh()
+        rows = [list(row) for row in rows]
+
+        def apply(target):
+            with self._lock:
+                next_row = len(self._inventory) + 1
+                landed = target.appended_rows.get(self.storage.inventory) or []
+                if len(landed) != len(rows):    # a storage that does not report them
+                    landed = range(next_row, next_row + len(rows))
+                for row_number, row in zip(landed, rows):
+                    row = self._pad(str(value) for value in row)
+                    while len(self._inventory) < row_number - 1:
+                        self._inventory.append(self._pad([]))    # rows added elsewhere; the reload fills them in
+                    if row_number <= len(self._inventory):
+                        self._inventory[row_number - 1] = row
+                    else:
+                        self._inventory.append(row)
+                    self._index_row(row_number)
+                    self._notify("row_changed", None, list(row))
+                if landed[0] != next_row:
+                    # The storage has rows this copy has not seen: index what we know, reload on next access
+                    self._rebuild_indexes()
+                    self._loaded_at = None
+                self._version += 1
+
+        def queue(target):
+            target.append_rows(self.storage.inventory, rows)
+            target.on_commit(lambda: apply(target))
+
+        self._write(queue, batch)
+
+    def append_sales(self, rows, batch=None):
+        """Append rows to the Sales table."""
+        if not rows:
+            return
+        self._ensure_fresh()
+        rows = [list(row) for row in rows]
+
+        def apply():
+            with self._lock:
+                for row in rows:
+                    sale = [str(value) for value in row]
+                    self._sales.append(sale)
+                    item_row = self._by_name.get(sale[1]) if len(sale) > 1 else None
+                    self._notify("sale_added", sale, list(self._inventory[item_row - 1]) if item_row else None)
+                self._version += 1
+
+        def queue(target):
+            target.append_rows(self.storage.sales, rows)
+            target.on_commit(apply)
+
+        self._write(queue, batch)
+
+    # --- Stock (through the ledger, then to the storage in batches) ---
+
+    def record_movements(self, movements):
+        """
+        Check and record stock movements, all or none, and apply them locally.
+
+        Each movement is a dict with the inventory `row`, a `kind` ("sale",
+        "restock" or "adjust"), a `remaining` delta and optionally a `total`
+        delta and `clamp` (stop at zero rather than refuse). A restock may give
+        its `date` (dd/mm/yyyy, default today); the Restock History cell is
+        kept as a summary by the ledger. A sale carries its Sales-sheet row as
+        `sale`; the last (Remaining) column is filled in here.
+
+        Returns the remaining quantity after each movement. Raises
+        InsufficientStock (a ValueError) when a movement would oversell.
+        """
+        if not movements:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            entries = []
+            for m in movements:
+                row = self._inventory[m["row"] - 1]
+                entry = {key: m[key] for key in ("kind", "remaining", "total", "date", "clamp") if key in m}
+                entry.update(item_id=self._stock_key(m["row"]), item=row[COL_ITEM - 1], base=_sheet_balance(row))
+                if m.get("sale"):
+                    entry["data"] = {"sale": list(m["sale"])}
+                entries.append(entry)
+
+        balances = self.ledger.record(entries)
+
+        with self._lock:
+            for m, entry, balance in zip(movements, entries, balances):
+                old = list(self._inventory[m["row"] - 1])
+                self._set_balance(m["row"], balance)
+                new = list(self._inventory[m["row"] - 1])
+                self._notify("row_changed", old, new)
+                if "data" in entry:
+                    sale = entry["data"]["sale"]
+                    sale[-1] = balance[0]
+                    sale = [str(value) for value in sale]
+                    self._sales.append(sale)
+                    self._notify("sale_added", sale, new)
+            self._version += 1
+        self._schedule_flush()
+        return [remaining for remaining, _, _ in balances]
+
+    def flush(self):
+        """Write pending stock movements to the storage, up to `flush_rows` per batch; returns how many were written."""
+        written = 0
+        with self._refresh_lock:
+            self._ensure_fresh()
+            while True:
+                movements, balances = self.ledger.claim(self.flush_rows)
+                if not movements:
+                    return written
+                migrated = [m for m in movements if m["kind"] == "migrate"]
+                if migrated:
+                    # Old-style restock history reaches the Restocks table before any summary replaces its cell
+                    try:
+                        self.storage.submit(self._migrated_restocks_batch(migrated))
+                    except Exception:
+                        self.ledger.release(movements)
+                        raise
+                    self.ledger.mark_synced(migrated)
+                    written += len(migrated)
+                    movements = [m for m in movements if m["kind"] != "migrate"]
+                    balances = {key: balances[key] for key in {m["item_id"] for m in movements}}
+                    if not movements:
+                        continue
+                try:
+                    try:
+                        self.storage.submit(self._stock_batch(movements, balances))
+                    except StaleRows as e:
+                        # Rows moved since the last load: find the items again and rebuild the batch
+                        log.warning("%s since the last load; reloading before the stock flush", e)
+                        self.refresh()
+                        self.storage.submit(self._stock_batch(movements, balances))
+                except Exception:
+                    self.ledger.release(movements)
+                    raise
+                self.ledger.mark_synced(movements)
+                written += len(movements)
+
+    def _stock_batch(self, movements, balances):
+        """
+        The storage writes for claimed movements: each item's balance on its
+        row (checked to still hold its ID), its sales and its restocks.
+        """
+        with self._lock:
+            unknown = [key for key in balances if not self._row_for_key(key)]
+        if unknown:    # added by another worker since our last load
+            self.refresh()
+
+        batch = self.storage.batch()
+        with self._lock:
+            for key, (remaining, total, history) in balances.items():
+                row_number = self._row_for_key(key)
+                if not row_number:
+                    log.warning("Stock movement for unknown item %s not written to %s", key, self.storage.name)
+                    continue
+                if not key.startswith("row:"):
+                    batch.expect(self.storage.inventory, row_number, COL_ID, key)
+                batch.update_row(self.storage.inventory, row_number, {
+                    COL_TOTAL_QTY: total, COL_REMAINING_QTY: remaining, COL_RESTOCK_HISTORY: history,
+                })
+        sales, restocks = [], []
+        for m in movements:
+            if m["data"] and m["data"].get("sale"):
+                sale = list(m["data"]["sale"])
+                sale[-1] = m["remaining"]
+                sales.append(sale)
+            if m["kind"] == "restock" and m["total_delta"] > 0:
+                restocks.append(self._restock_row(m["item_id"], (m["data"] or {}).get("date", ""), m["total_delta"]))
+        batch.append_rows(self.storage.sales, sales)
+        if self.storage.restocks is not None:
+            batch.append_rows(self.storage.restocks, restocks)
+        return batch
+
+    def _migrated_restocks_batch(self, movements):
+        """Restocks-table rows for the entries carried by "migrate" movements."""
+        batch = self.storage.batch()
+        if self.storage.restocks is not None:
+            batch.append_rows(self.storage.restocks, [
+                self._restock_row(m["item_id"], date, quantity)
+                for m in movements for date, quantity in m["data"]["restocks"]
+            ])
+        return batch
+
+    def _restock_row(self, item_id, date, quantity):
+        with self._lock:
+            row_number = self._row_for_key(item_id)
+            name = self._inventory[row_number - 1][COL_ITEM - 1] if row_number else ""
+        return [item_id, name, date, quantity]
+
+    def _schedule_flush(self):
+        if self.flush_interval <= 0:
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning("Stock flush failed, movements stay pending: %s", e)
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name="stock-flush", daemon=True)
+                self._flusher.start()
+        self._flush_wanted.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wanted.wait()
+            time.sleep(self.flush_interval)    # let concurrent movements join the same batch
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning("Stock flush failed, will retry: %s", e)
+                self._flush_wanted.set()
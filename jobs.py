@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("elliotonline.jobs")
+
+_current = threading.local()
+
+
+def report_progress(**fields):
+    """Update the progress of the job running on this thread (no-op outside a job)."""
+    job = getattr(_current, "job", None)
+    if job is not None:
+        with job._changed:
+            job.progress = {**(job.progress or {}), **fields}
+            job.version += 1
+            job._changed.notify_all()
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds its maximum number of jobs."""
+
+
+class Job:
+    """One unit of background work and its outcome."""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"    # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.version = 0    # bumped on every status or progress change
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        data = {"job_id": self.id, "kind": self.kind, "status": self.status}
+        if self.progress:
+            data["progress"] = dict(self.progress)
+        if self.status == "done":
+            data["result"] = self.result
+        if self.status == "failed":
+            data["error"] = self.error
+        return data
+
+    def _set(self, status, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            if self.finished:
+                self.finished_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or `timeout` seconds pass."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.finished, timeout=timeout)
+        return self.finished
+
+    def wait_for_change(self, since, timeout=None):
+        """Block until the job's version moves past `since`; returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != since or self.finished, timeout=timeout)
+            return self.version
+
+
+class JobQueue:
+    """
+    Bounded worker pool for slow calls (LLM parsing, speech recognition).
+
+    `submit()` returns a Job immediately; at most `max_pending` jobs may be
+    queued or running at once, beyond which QueueFull is raised so callers can
+    answer 503 instead of piling up work. Finished jobs are kept for
+    `retention` seconds so clients can collect their results.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, retention=None):
+        if max_workers is None:
+            max_workers = int(os.getenv("JOB_WORKERS", "8"))
+        if max_pending is None:
+            max_pending = int(os.getenv("JOB_MAX_PENDING", "100"))
+        if retention is None:
+            retention = float(os.getenv("JOB_RETENTION", "3600"))
+        self.retention = retention
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull("Too many jobs in progress, try again shortly")
+
+        self._purge()
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        _current.job = job
+        try:
+            job._set("running")
+            job._set("done", result=fn(*args, **kwargs))
+        except Exception as e:
+            log.exception("Job %s (%s) failed: %s", job.id, job.kind, e)
+            job._set("failed", error=str(e))
+        finally:
+            _current.job = None
+            self._slots.release()
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,408 @@
+"""
+Append-only ledger of stock movements, and monotonic ID allocation.
+
+Sales, restocks and stock adjustments are checked and recorded here, in one
+SQLite transaction, before they reach Google Sheets. The ledger keeps every
+item's current balance (remaining, total and restock summary), so two
+workers selling the same item - threads or processes sharing the file -
+can never both take the last unit, and `reserve()` hands out ITEM-N numbers
+that are never given out twice.
+
+Every restock is also kept as a (item, date, quantity) record, indexed by
+item and by date; the Restock History cell only holds a short summary.
+Restocks still listed in an old-style history cell become records on the
+first reseed, with a pending "migrate" movement that copies them to the
+storage's Restocks table before the cell is ever replaced by a summary.
+
+Movements stay pending until a flusher `claim()`s them, writes them to
+Sheets in one batch and calls `mark_synced()`. Only one claim is
+outstanding at a time, so flushes from different workers never interleave.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent / "stock_ledger.db"
+
+RESTOCK_ENTRY = re.compile(r"(\d{1,2}/\d{1,2}/\d{4})\s*\(x(\d+)\)")
+RESTOCK_SUMMARY = re.compile(r"^Last restock (.+\(x\d+\)), (\d+) restocked in total$")
+
+
+def restock_summary(last, restocked):
+    """Restock History cell: the latest 'dd/mm/yyyy (xN)' entry and the total restocked so far."""
+    return f"Last restock {last}, {restocked} restocked in total" if last else ""
+
+
+def parse_restock_history(cell):
+    """
+    (entries, last, restocked) from a Restock History cell, which is either a
+    summary or the old comma-joined 'dd/mm/yyyy (xN), ...' list. `entries`
+    holds (dd/mm/yyyy, quantity) pairs for the old format only.
+    """
+    cell = (cell or "").strip()
+    summary = RESTOCK_SUMMARY.match(cell)
+    if summary:
+        return [], summary.group(1), int(summary.group(2))
+    entries = [(date, int(quantity)) for date, quantity in RESTOCK_ENTRY.findall(cell)]
+    if not entries:
+        return [], "", 0
+    date, quantity = entries[-1]
+    return entries, f"{date} (x{quantity})", sum(quantity for _, quantity in entries)
+
+
+def _iso(date):
+    """YYYY-MM-DD for a dd/mm/yyyy date (the original text if it is not one)."""
+    try:
+        return datetime.strptime(date, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return date
+
+
+def _dmy(date):
+    """dd/mm/yyyy for a YYYY-MM-DD date (the original text if it is not one)."""
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").strftime("%d/%m/%Y")
+    except ValueError:
+        return date
+
+
+class InsufficientStock(ValueError):
+    """Raised when a movement would take an item's remaining stock below zero; nothing is recorded."""
+
+    def __init__(self, item, requested, available, position=0):
+        super().__init__(f"Not enough stock for {requested} of '{item}' ({available} left)")
+        self.item = item
+        self.requested = requested
+        self.available = available
+        self.position = position    # index of the refused movement in the recorded list
+
+
+class StockLedger:
+    """
+    SQLite-backed stock balances and the movements that produced them.
+
+    A movement is a dict with `item_id`, `kind` ("sale", "restock" or
+    "adjust"), a `remaining` delta and optionally a `total` delta, a `clamp`
+    flag (stop at zero instead of refusing) and a JSON-able `data` payload.
+    A restock of `total` units is also stored as a restock record dated
+    `date` (dd/mm/yyyy, default today). `item` (a name for error messages)
+    and `base` ((remaining, total, history cell) to open the balance with if
+    the ledger has none yet) are optional.
+    """
+
+    def __init__(self, path=None, claim_timeout=None):
+        if path is None:
+            path = os.getenv("LEDGER_PATH", str(DEFAULT_PATH))
+        if claim_timeout is None:
+            claim_timeout = float(os.getenv("LEDGER_CLAIM_TIMEOUT", "60"))
+        self.claim_timeout = claim_timeout
+
+        self._lock = threading.Lock()
+        # Autocommit mode; every write opens its own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS balances ("
+            " item_id TEXT PRIMARY KEY, remaining INTEGER NOT NULL, total INTEGER NOT NULL,"
+            " history TEXT NOT NULL DEFAULT '', version INTEGER NOT NULL DEFAULT 0,"
+            " restocked INTEGER NOT NULL DEFAULT 0, last_restock TEXT NOT NULL DEFAULT '');"
+            "CREATE TABLE IF NOT EXISTS movements ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, item_id TEXT NOT NULL, kind TEXT NOT NULL,"
+            " remaining_delta INTEGER NOT NULL, total_delta INTEGER NOT NULL,"
+            " remaining INTEGER NOT NULL, total INTEGER NOT NULL, data TEXT,"
+            " created_at REAL NOT NULL, claimed_at REAL, synced_at REAL);"
+            "CREATE INDEX IF NOT EXISTS idx_movements_pending ON movements(seq) WHERE synced_at IS NULL;"
+            "CREATE INDEX IF NOT EXISTS idx_movements_item ON movements(item_id, seq);"
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS restocks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, item_id TEXT NOT NULL, date TEXT NOT NULL,"
+            " quantity INTEGER NOT NULL, seq INTEGER);"
+            "CREATE INDEX IF NOT EXISTS idx_restocks_item ON restocks(item_id, date);"
+            "CREATE INDEX IF NOT EXISTS idx_restocks_date ON restocks(date);"
+        )
+        # Ledgers created before restocks were tracked separately
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(balances)")}
+        for name, definition in (("restocked", "INTEGER NOT NULL DEFAULT 0"),
+                                 ("last_restock", "TEXT NOT NULL DEFAULT ''")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE balances ADD COLUMN {name} {definition}")
+        # Restocks migrated by older versions without being copied to the storage
+        with self._transaction() as conn:
+            unexported = {}
+            for item_id, date, quantity in conn.execute(
+                "SELECT item_id, date, quantity FROM restocks WHERE seq IS NULL ORDER BY id"
+            ):
+                unexported.setdefault(item_id, []).append((_dmy(date), quantity))
+            for item_id, entries in unexported.items():
+                seq = self._migrate(conn, item_id, entries, time.time())
+                conn.execute("UPDATE restocks SET seq = ? WHERE item_id = ? AND seq IS NULL", (seq, item_id))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- Balances ---
+
+    def balance(self, item_id):
+        """(remaining, total, history) for an item, or None if the ledger has no balance for it."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT remaining, total, history FROM balances WHERE item_id = ?", (item_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def reseed(self, balances, as_of):
+        """
+        Replace balances with values read from the sheet at time `as_of`.
+
+        Items with pending movements, or movements written to the sheet after
+        `as_of`, keep their ledger balance (the sheet values are older). Their
+        balances are returned as {item_id: (remaining, total, history)}.
+
+        Restocks listed in an old-style (comma-joined) history cell become
+        restock records the first time the item is seen, and a pending
+        "migrate" movement (data {"restocks": [[dd/mm/yyyy, quantity], ...]})
+        that the flush writes to the storage's Restocks table.
+        """
+        with self._transaction() as conn:
+            busy = {
+                item_id: (remaining, total, history)
+                for item_id, remaining, total, history in conn.execute(
+                    "SELECT b.item_id, b.remaining, b.total, b.history FROM balances b"
+                    " WHERE b.item_id IN (SELECT item_id FROM movements"
+                    "  WHERE synced_at IS NULL OR synced_at >= ?)", (as_of,)
+                )
+            }
+            known = {row[0] for row in conn.execute("SELECT DISTINCT item_id FROM restocks")}
+            rows, imported = [], {}
+            for item_id, (remaining, total, history) in balances.items():
+                if item_id in busy:
+                    continue
+                entries, last, restocked = parse_restock_history(history)
+                rows.append((item_id, remaining, total, history, restocked, last))
+                if entries and item_id not in known:
+                    imported[item_id] = entries
+            conn.executemany(
+                "INSERT INTO balances (item_id, remaining, total, history, restocked, last_restock)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(item_id) DO UPDATE SET remaining = excluded.remaining,"
+                " total = excluded.total, history = excluded.history, restocked = excluded.restocked,"
+                " last_restock = excluded.last_restock, version = version + 1",
+                rows,
+            )
+            now = time.time()
+            for item_id, entries in imported.items():
+                seq = self._migrate(conn, item_id, entries, now)
+                conn.executemany("INSERT INTO restocks (item_id, date, quantity, seq) VALUES (?, ?, ?, ?)",
+                                 [(item_id, _iso(date), quantity, seq) for date, quantity in entries])
+        return busy
+
+    @staticmethod
+    def _migrate(conn, item_id, entries, now):
+        """Record a pending "migrate" movement carrying an item's old-style restock entries; returns its seq."""
+        remaining, total = conn.execute(
+            "SELECT remaining, total FROM balances WHERE item_id = ?", (item_id,)
+        ).fetchone() or (0, 0)
+        return conn.execute(
+            "INSERT INTO movements (item_id, kind, remaining_delta, total_delta, remaining, total,"
+            " data, created_at) VALUES (?, 'migrate', 0, 0, ?, ?, ?, ?)",
+            (item_id, remaining, total, json.dumps({"restocks": [list(entry) for entry in entries]}), now),
+        ).lastrowid
+
+    # --- Movements ---
+
+    def record(self, movements):
+        """
+        Check and record movements, all or none, in order.
+
+        Returns (remaining, total, history) after each movement. Raises
+        InsufficientStock if one would take an item below zero.
+        """
+        results = []
+        now = time.time()
+        with self._transaction() as conn:
+            for position, m in enumerate(movements):
+                item_id = m["item_id"]
+                current = conn.execute(
+                    "SELECT remaining, total, history, restocked, last_restock FROM balances WHERE item_id = ?",
+                    (item_id,),
+                ).fetchone()
+                if current is None:
+                    if m.get("base") is None:
+                        raise KeyError(f"No stock balance for '{item_id}'")
+                    remaining, total, history = m["base"]
+                    _, last, restocked = parse_restock_history(history)
+                    current = (remaining, total, history, restocked, last)
+                    conn.execute(
+                        "INSERT INTO balances (item_id, remaining, total, history, restocked, last_restock)"
+                        " VALUES (?, ?, ?, ?, ?, ?)", (item_id, *current),
+                    )
+                remaining, total, history, restocked, last = current
+
+                remaining_delta = int(m.get("remaining") or 0)
+                total_delta = int(m.get("total") or 0)
+                if remaining + remaining_delta < 0:
+                    if not m.get("clamp"):
+                        raise InsufficientStock(m.get("item") or item_id, -remaining_delta, remaining, position)
+                    remaining_delta = -remaining
+                remaining += remaining_delta
+                total += total_delta
+                data = m.get("data")
+                restock_date = None
+                if m["kind"] == "restock" and total_delta > 0:
+                    restock_date = m.get("date") or datetime.now().strftime("%d/%m/%Y")
+                    last = f"{restock_date} (x{total_delta})"
+                    restocked += total_delta
+                    history = restock_summary(last, restocked)
+                    data = {**(data or {}), "date": restock_date}
+
+                conn.execute(
+                    "UPDATE balances SET remaining = ?, total = ?, history = ?, restocked = ?, last_restock = ?,"
+                    " version = version + 1 WHERE item_id = ?",
+                    (remaining, total, history, restocked, last, item_id),
+                )
+                seq = conn.execute(
+                    "INSERT INTO movements (item_id, kind, remaining_delta, total_delta, remaining, total,"
+                    " data, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (item_id, m["kind"], remaining_delta, total_delta, remaining, total,
+                     json.dumps(data) if data is not None else None, now),
+                ).lastrowid
+                if restock_date:
+                    conn.execute("INSERT INTO restocks (item_id, date, quantity, seq) VALUES (?, ?, ?, ?)",
+                                 (item_id, _iso(restock_date), total_delta, seq))
+                results.append((remaining, total, history))
+        return results
+
+    def claim(self, limit=500):
+        """
+        Claim up to `limit` pending movements for writing to the sheet.
+
+        Returns (movements, balances): the movements in order and the current
+        balance of every item they touch. Returns nothing while another
+        claim is outstanding (and younger than `claim_timeout`).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if conn.execute(
+                "SELECT 1 FROM movements WHERE synced_at IS NULL AND claimed_at > ? LIMIT 1",
+                (now - self.claim_timeout,),
+            ).fetchone():
+                return [], {}
+            movements = [
+                self._movement(row) for row in conn.execute(
+                    "SELECT seq, item_id, kind, remaining_delta, total_delta, remaining, total, data, created_at"
+                    " FROM movements WHERE synced_at IS NULL ORDER BY seq LIMIT ?", (limit,)
+                )
+            ]
+            if not movements:
+                return [], {}
+            conn.executemany("UPDATE movements SET claimed_at = ? WHERE seq = ?",
+                             [(now, m["seq"]) for m in movements])
+            balances = {}
+            for item_id in {m["item_id"] for m in movements}:
+                row = conn.execute("SELECT remaining, total, history FROM balances WHERE item_id = ?",
+                                   (item_id,)).fetchone()
+                balances[item_id] = tuple(row)
+        return movements, balances
+
+    def mark_synced(self, movements):
+        """Mark claimed movements as written to the sheet."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE movements SET synced_at = ?, claimed_at = NULL WHERE seq = ?",
+                             [(now, m["seq"]) for m in movements])
+
+    def release(self, movements):
+        """Give claimed movements back (the write failed); the next claim retries them."""
+        with self._transaction() as conn:
+            conn.executemany("UPDATE movements SET claimed_at = NULL WHERE seq = ?",
+                             [(m["seq"],) for m in movements])
+
+    def pending(self):
+        """Movements not yet written to the sheet, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, item_id, kind, remaining_delta, total_delta, remaining, total, data, created_at"
+                " FROM movements WHERE synced_at IS NULL ORDER BY seq"
+            ).fetchall()
+        return [self._movement(row) for row in rows]
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM movements WHERE synced_at IS NULL").fetchone()[0]
+
+    def history(self, item_id, limit=100):
+        """The latest movements of one item, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, item_id, kind, remaining_delta, total_delta, remaining, total, data, created_at"
+                " FROM movements WHERE item_id = ? ORDER BY seq DESC LIMIT ?", (item_id, limit)
+            ).fetchall()
+        return [self._movement(row) for row in rows]
+
+    def restocks(self, item_id=None, start=None, end=None, limit=1000):
+        """
+        Restock records, oldest first, as {item_id, date (YYYY-MM-DD), quantity}
+        dicts; optionally for one item and/or between two YYYY-MM-DD dates (inclusive).
+        """
+        clauses, params = [], []
+        for clause, value in (("item_id = ?", item_id), ("date >= ?", start), ("date <= ?", end)):
+            if value:
+                clauses.append(clause)
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT item_id, date, quantity FROM restocks{where} ORDER BY date, id LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [{"item_id": item_id, "date": date, "quantity": quantity} for item_id, date, quantity in rows]
+
+    @staticmethod
+    def _movement(row):
+        seq, item_id, kind, remaining_delta, total_delta, remaining, total, data, created_at = row
+        return {
+            "seq": seq, "item_id": item_id, "kind": kind,
+            "remaining_delta": remaining_delta, "total_delta": total_delta,
+            "remaining": remaining, "total": total,
+            "data": json.loads(data) if data else None, "created_at": created_at,
+        }
+
+    # --- IDs ---
+
+    def reserve(self, name, count, floor=1):
+        """Reserve `count` consecutive numbers from counter `name` (never below `floor`); returns the first."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+            first = max(row[0] if row else floor, floor)
+            conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, first + count))
+        return first
+
+    def peek(self, name, floor=1):
+        """The number `reserve(name, ...)` would hand out next."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return max(row[0] if row else floor, floor)
+
+    def stats(self):
+        with self._lock:
+            movements, pending = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(synced_at) FROM movements"
+            ).fetchone()
+            items = self._conn.execute("SELECT COUNT(*) FROM balances").fetchone()[0]
+        return {"movements": movements, "pending": pending, "items": items}
@@ -0,0 +1,262 @@
+"""
+Fault-tolerant access to the DeepSeek (OpenAI-compatible) chat API.
+
+ResilientLLMClient has the same `chat.completions.create(...)` shape as
+the OpenAI client, so call sites don't change, but every call is bounded:
+
+- each attempt has a timeout and the whole call a deadline, enforced here
+  (the attempt runs on a pool thread and is abandoned when it overruns),
+  so a hung connection can't hold a request worker;
+- timeouts, connection errors, 429s and 5xx are retried with jittered
+  exponential backoff while the deadline allows; other errors are not;
+- each endpoint has a circuit breaker: after repeated failures calls skip
+  it for a while instead of waiting on it, then one trial call is let
+  through to see whether it has recovered;
+- optionally, an attempt still running after `hedge_after` seconds gets a
+  duplicate request and the first answer wins;
+- an optional fallback endpoint/model is tried when the primary one fails
+  or its breaker is open.
+
+All endpoints share one pooled HTTP client, so connections are reused
+across threads rather than opened per call. When every endpoint fails
+LLMUnavailable is raised, with the reason, for the caller to report.
+"""
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+
+import openai
+
+from metrics import registry, InstrumentedLLMClient
+from services import LazyProxy
+
+log = logging.getLogger("elliotonline.llm")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))          # seconds per attempt
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))        # seconds per call, across retries and endpoints
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))             # extra attempts per endpoint
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))         # base of the jittered exponential backoff
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))   # 0 disables hedged requests
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "32"))
+
+# HTTP statuses worth retrying: timeout, conflict, rate limit and server errors
+RETRY_STATUSES = {408, 409, 429}
+
+
+class LLMUnavailable(Exception):
+    """Raised when no endpoint produced an answer within the deadline."""
+
+
+class AttemptTimeout(Exception):
+    """One attempt ran past its timeout (it is abandoned, not cancelled)."""
+
+
+def is_retryable(error):
+    if isinstance(error, (AttemptTimeout, openai.APIConnectionError)):    # includes APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUSES or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` consecutive failures, then open for `reset_after`
+    seconds; after that one trial call is allowed (half-open), which closes
+    the breaker on success and re-opens it on failure.
+    """
+
+    def __init__(self, name, failures=None, reset_after=None):
+        self.name = name
+        self.failures = LLM_BREAKER_FAILURES if failures is None else failures
+        self.reset_after = LLM_BREAKER_RESET if reset_after is None else reset_after
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._trial else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_after:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                log.info("LLM endpoint %s recovered, circuit closed", self.name)
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or (self._opened_at is None and self._count >= self.failures):
+                self._opened_at = time.monotonic()
+                self._trial = False
+                registry.inc("app_llm_circuit_open_total", {"endpoint": self.name})
+                log.warning("LLM endpoint %s failing, circuit open for %.0fs", self.name, self.reset_after)
+
+
+class LLMEndpoint:
+    """An OpenAI-compatible client, the model to ask it for (None keeps the caller's) and its breaker."""
+
+    def __init__(self, name, client, model=None):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.breaker = CircuitBreaker(name)
+
+
+_http_client = None
+_http_lock = threading.Lock()
+
+
+def shared_http_client():
+    """The pooled httpx client used by every endpoint (created on first use)."""
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=min(LLM_TIMEOUT, 5.0)),
+            )
+        return _http_client
+
+
+def openai_endpoint(name, api_key, base_url, model=None):
+    """An endpoint for an OpenAI-compatible API; the client connects on first use, over the shared pool."""
+    client = LazyProxy(lambda: openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                                             timeout=LLM_TIMEOUT, http_client=shared_http_client()))
+    return LLMEndpoint(name, InstrumentedLLMClient(client), model)
+
+
+def endpoints_from_env(api_key, base_url, model):
+    """
+    The primary endpoint, plus a fallback when LLM_FALLBACK_MODEL or
+    LLM_FALLBACK_BASE_URL is set (LLM_FALLBACK_API_KEY defaults to `api_key`).
+    """
+    endpoints = [openai_endpoint("primary", api_key, base_url, model)]
+    fallback_model = os.getenv("LLM_FALLBACK_MODEL")
+    fallback_url = os.getenv("LLM_FALLBACK_BASE_URL")
+    if fallback_model or fallback_url:
+        endpoints.append(openai_endpoint("fallback", os.getenv("LLM_FALLBACK_API_KEY", api_key),
+                                         fallback_url or base_url, fallback_model or model))
+    return endpoints
+
+
+class ResilientLLMClient:
+    """
+    Drop-in for an OpenAI client's `chat.completions.create`, with the
+    timeouts, retries, circuit breakers, hedging and fallback described in
+    the module docstring.
+    """
+
+    def __init__(self, endpoints, timeout=None, deadline=None, retries=None, backoff=None,
+                 hedge_after=None, workers=None):
+        self.endpoints = list(endpoints)
+        self.timeout = LLM_TIMEOUT if timeout is None else timeout
+        self.deadline = LLM_DEADLINE if deadline is None else deadline
+        self.retries = LLM_RETRIES if retries is None else retries
+        self.backoff = LLM_BACKOFF if backoff is None else backoff
+        self.hedge_after = LLM_HEDGE_AFTER if hedge_after is None else hedge_after
+        self._executor = ThreadPoolExecutor(max_workers=workers or LLM_WORKERS, thread_name_prefix="llm")
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def use_client(self, client):
+        """Send every endpoint's calls to `client` instead (used by the offline benchmarks)."""
+        for endpoint in self.endpoints:
+            endpoint.client = InstrumentedLLMClient(client)
+            endpoint.breaker.record_success()
+
+    def status(self):
+        return {endpoint.name: endpoint.breaker.state for endpoint in self.endpoints}
+
+    def create(self, **kwargs):
+        deadline = time.monotonic() + self.deadline
+        reasons = []
+        for endpoint in self.endpoints:
+            if not endpoint.breaker.allow():
+                reasons.append(f"{endpoint.name}: circuit open")
+                continue
+            request = dict(kwargs, model=endpoint.model or kwargs.get("model"))
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    response = self._attempt(endpoint, request, min(self.timeout, remaining))
+                except Exception as e:
+                    if not is_retryable(e):
+                        endpoint.breaker.record_success()    # it answered; the request itself was bad
+                        raise
+                    endpoint.breaker.record_failure()
+                    reasons.append(f"{endpoint.name}: {type(e).__name__}")
+                    log.warning("LLM call to %s failed (attempt %d): %s", endpoint.name, attempt + 1, e)
+                    if attempt == self.retries or not endpoint.breaker.allow():
+                        break
+                    registry.inc("app_llm_retries_total", {"endpoint": endpoint.name})
+                    delay = random.uniform(0, self.backoff * 2 ** attempt)
+                    time.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+                    continue
+                endpoint.breaker.record_success()
+                if endpoint is not self.endpoints[0]:
+                    registry.inc("app_llm_fallbacks_total", {"endpoint": endpoint.name})
+                return response
+            if time.monotonic() >= deadline:
+                reasons.append(f"deadline of {self.deadline:g}s reached")
+                break
+        reasons = list(dict.fromkeys(reasons)) or ["no endpoints"]
+        raise LLMUnavailable(f"Language model unavailable ({'; '.join(reasons)})")
+
+    def _attempt(self, endpoint, request, timeout):
+        """One attempt, hedged after `hedge_after` seconds; raises AttemptTimeout past `timeout`."""
+        create = endpoint.client.chat.completions.create
+        request = dict(request, timeout=timeout)
+        started = time.monotonic()
+        pending = {self._submit(create, request)}
+        hedged = False
+        error = None
+        while pending:
+            left = timeout - (time.monotonic() - started)
+            if left <= 0:
+                break
+            hedge_in = self.hedge_after - (time.monotonic() - started) if not hedged and self.hedge_after else None
+            done, pending = wait(pending, timeout=min(left, hedge_in) if hedge_in is not None else left,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if error is not None and not pending:
+                raise error
+            if not done and hedge_in is not None and hedge_in <= left:
+                hedged = True
+                registry.inc("app_llm_hedges_total", {"endpoint": endpoint.name})
+                pending.add(self._submit(create, request))
+        raise AttemptTimeout(f"no answer from {endpoint.name} within {timeout:.1f}s")
+
+    def _submit(self, create, request):
+        # Run in a copy of the caller's context so metrics still see the Flask route
+        return self._executor.submit(contextvars.copy_context().run, create, **request)
@@ -0,0 +1,61 @@
+import logging
+import os
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per message template every `period`
+    seconds; the rest are dropped and counted, and the count is reported on
+    the next record that gets through.
+    """
+
+    def __init__(self, burst=20, period=60.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows = {}    # (logger, msg template) -> [window start, emitted, suppressed]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def configure_logging():
+    """
+    Set up the app's logger from the environment:
+    LOG_LEVEL (default INFO; DEBUG shows the old debug output, WARNING or OFF for production),
+    LOG_RATE_BURST / LOG_RATE_PERIOD to tune rate limiting.
+    """
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    logger = logging.getLogger("elliotonline")
+    if logger.handlers:
+        return logger
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(RateLimitFilter(
+        burst=int(os.getenv("LOG_RATE_BURST", "20")),
+        period=float(os.getenv("LOG_RATE_PERIOD", "60")),
+    ))
+    logger.addHandler(handler)
+    logger.propagate = False
+    if level == "OFF":
+        logger.disabled = True
+    else:
+        logger.setLevel(getattr(logging, level, logging.INFO))
+    return logger
@@ -0,0 +1,317 @@
+"""
+Latency and volume metrics for calls to Google Sheets, DeepSeek and speech
+recognition, exposed in the Prometheus text format.
+
+Every remote call is recorded against the Flask route that made it (or
+"background" for work on pool threads), so a slow `home` POST can be broken
+down into its Sheets, LLM and speech time.
+"""
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from flask import has_request_context, request
+except ImportError:    # metrics can be used without Flask (e.g. from the CLI)
+    has_request_context = lambda: False  # noqa: E731
+    request = None
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger("elliotonline.metrics")
+
+# LLM prices in USD per million tokens; cache hits are input tokens the provider served from its prompt cache
+LLM_PRICE_INPUT_PER_M = float(os.getenv("LLM_PRICE_INPUT_PER_M", "0.27"))
+LLM_PRICE_CACHED_INPUT_PER_M = float(os.getenv("LLM_PRICE_CACHED_INPUT_PER_M", "0.07"))
+LLM_PRICE_OUTPUT_PER_M = float(os.getenv("LLM_PRICE_OUTPUT_PER_M", "1.10"))
+
+# gspread methods that only read
+SHEETS_READS = {"get_all_values", "get_all_records", "col_values", "row_values", "cell", "find", "findall", "get"}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """Counters and histograms keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._histograms.setdefault(key, Histogram()).observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """{name: {labels: value}} for counters; histograms as (count, sum)."""
+        with self._lock:
+            data = {}
+            for (name, labels), value in self._counters.items():
+                data.setdefault(name, {})[labels] = value
+            for (name, labels), hist in self._histograms.items():
+                data.setdefault(name, {})[labels] = (hist.count, hist.total)
+            return data
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), hist in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ("+Inf",), hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {hist.total:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + inner + "}"
+
+
+registry = Registry()
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "background"
+
+
+def record_call(kind, op, seconds, rows=0, size=0, error=False, route=None):
+    labels = {"kind": kind, "op": op, "route": route or current_route()}
+    registry.inc("app_remote_calls_total", labels)
+    registry.observe("app_remote_call_seconds", labels, seconds)
+    if rows:
+        registry.inc("app_remote_rows_total", labels, rows)
+    if size:
+        registry.inc("app_remote_bytes_total", labels, size)
+    if error:
+        registry.inc("app_remote_errors_total", labels)
+
+
+@contextmanager
+def timed(kind, op):
+    """Time a block as one remote call; exceptions are counted as errors and re-raised."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_call(kind, op, time.perf_counter() - start, error=error)
+
+
+def timed_function(kind, op=None):
+    """Decorator form of `timed`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(kind, op or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_request(route, seconds, status):
+    labels = {"route": route or "unknown", "status": str(status)}
+    registry.inc("app_requests_total", labels)
+    registry.observe("app_request_seconds", {"route": route or "unknown"}, seconds)
+
+
+def _cached_tokens(usage):
+    """Prompt tokens served from the provider's cache (DeepSeek and OpenAI report these differently)."""
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = getattr(details, "cached_tokens", None) if details is not None else None
+    return hit or 0
+
+
+def llm_cost(prompt_tokens, cached_tokens, completion_tokens):
+    """USD cost of one call at the LLM_PRICE_* rates."""
+    return ((prompt_tokens - cached_tokens) * LLM_PRICE_INPUT_PER_M
+            + cached_tokens * LLM_PRICE_CACHED_INPUT_PER_M
+            + completion_tokens * LLM_PRICE_OUTPUT_PER_M) / 1_000_000
+
+
+def record_llm_usage(model, usage):
+    """Count and log the tokens and cost of one chat completion."""
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    cached = min(_cached_tokens(usage), prompt)
+    cost = llm_cost(prompt, cached, completion)
+    route = current_route()
+    labels = {"model": model, "route": route}
+    registry.inc("app_llm_prompt_tokens_total", labels, prompt)
+    registry.inc("app_llm_prompt_cached_tokens_total", labels, cached)
+    registry.inc("app_llm_completion_tokens_total", labels, completion)
+    registry.inc("app_llm_cost_usd_total", labels, cost)
+    log.info("LLM call %s on %s: %d prompt tokens (%d cached), %d completion tokens, $%.6f",
+             model, route, prompt, cached, completion, cost)
+
+
+# --- Size estimates ---
+
+def _cells(values):
+    """(rows, bytes) of a list of rows, a single row or a scalar."""
+    if isinstance(values, list):
+        if values and isinstance(values[0], list):
+            return len(values), sum(len(str(cell)) for row in values for cell in row)
+        return 1, sum(len(str(cell)) for cell in values)
+    return 0, len(str(values)) if values is not None else 0
+
+
+def _write_size(op, args, kwargs):
+    if op in ("append_rows", "append_row", "update_cells"):
+        values = args[0] if args else next(iter(kwargs.values()), [])
+        if op == "update_cells":
+            return len({cell.row for cell in values}), sum(len(str(cell.value)) for cell in values)
+        return _cells(values)
+    if op == "batch_update":
+        data = args[0] if args else kwargs.get("data", [])
+        rows = sum(len(item.get("values", [])) for item in data)
+        size = sum(len(str(cell)) for item in data for row in item.get("values", []) for cell in row)
+        return rows, size
+    if op == "update_cell":
+        return 1, len(str(args[2])) if len(args) > 2 else 0
+    return 0, 0
+
+
+# --- Instrumented wrappers ---
+
+class InstrumentedWorksheet:
+    """Wraps a gspread worksheet (or LazyProxy of one); every method call is timed and sized."""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                record_call("sheets", name, time.perf_counter() - start, error=True)
+                raise
+            if name in SHEETS_READS:
+                rows, size = _cells(result)
+            else:
+                rows, size = _write_size(name, args, kwargs)
+            record_call("sheets", name, time.perf_counter() - start, rows=rows, size=size)
+            return result
+
+        return call
+
+
+class _InstrumentedCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._completions.create(*args, **kwargs)
+        except Exception:
+            record_call("llm", "chat.completions.create", time.perf_counter() - start, error=True)
+            raise
+        content = response.choices[0].message.content or ""
+        record_call("llm", "chat.completions.create", time.perf_counter() - start, size=len(content))
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record_llm_usage(kwargs.get("model", ""), usage)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class _InstrumentedChat:
+    def __init__(self, chat):
+        self._chat = chat
+
+    @property
+    def completions(self):
+        return _InstrumentedCompletions(self._chat.completions)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+class InstrumentedLLMClient:
+    """Wraps an OpenAI-compatible client; `chat.completions.create` calls are timed."""
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def chat(self):
+        return _InstrumentedChat(self._client.chat)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class InstrumentedSpeechBackend:
+    """Wraps a speech_stream backend; each recognized window is timed and sized."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.name = backend.name
+
+    def recognize(self, recognizer, audio):
+        start = time.perf_counter()
+        error = False
+        try:
+            return self._backend.recognize(recognizer, audio)
+        except Exception:
+            error = True
+            raise
+        finally:
+            record_call("speech", f"recognize_{self.name}", time.perf_counter() - start,
+                        size=len(audio.frame_data), error=error)
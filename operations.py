@@ -0,0 +1,207 @@
+"""
+Structured inventory operations (update, restock, sale), as extracted from a
+multi-item voice command, and applying a list of them in one batched write.
+"""
+from datetime import datetime
+
+from extraction import to_count, to_date, to_price
+from inventory_store import (
+    COL_CATALOGUE, COL_STORAGE_LOCATION, COL_BOX_LABEL, COL_PLACE_BOUGHT,
+    COL_TOTAL_QTY, COL_REMAINING_QTY, COL_ID, COL_ITEM, STOCK_COLUMNS,
+)
+from ledger import InsufficientStock
+
+ACTIONS = ("update", "restock", "sale")
+
+# Fields an "update" may change, and where they live
+UPDATE_FIELDS = {
+    "catalogue_number": COL_CATALOGUE,
+    "storage_location": COL_STORAGE_LOCATION,
+    "box_label": COL_BOX_LABEL,
+    "place_bought": COL_PLACE_BOUGHT,
+}
+
+# Maintenance column holding the allowed values for a field
+MAINTENANCE_COLUMNS = {"storage_location": 1, "box_label": 2, "place_bought": 4}
+
+
+class OperationError(ValueError):
+    """Raised when one or more operations in a batch are invalid; nothing is written."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(f"#{e['index']}: {e['error']}" for e in errors))
+        self.errors = errors
+
+
+def today():
+    return datetime.now().strftime("%d/%m/%Y")
+
+
+def make_sale_id(item_name, buyer):
+    return f"{item_name.replace(' ', '_')}-{datetime.now().strftime('%d%m')}-{buyer.replace(' ', '_')}"
+
+
+def _to_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _field(op, name, coerce, default, error=None):
+    """
+    `op[name]` through one of the extraction coercions (to_count, to_price,
+    to_date), or `default` when it is missing. An invalid value, or a
+    missing one without a default, raises ValueError with `error`.
+    """
+    value = op.get(name)
+    if value is None or str(value).strip() == "":
+        if default is None:
+            raise ValueError(error or f"Missing {name.replace('_', ' ')}")
+        return default
+    try:
+        return coerce(value)
+    except (TypeError, ValueError):
+        raise ValueError(error or f"Invalid {name.replace('_', ' ')} format")
+
+
+# --- Resolution ---
+
+def resolve_operations(store, operations, threshold=80):
+    """
+    Fuzzy-resolve the item, location, box and place of each operation against
+    the store. Each operation gets `item_id` and the matched `item` name, or a
+    `candidates` list when the item is ambiguous or unknown.
+    """
+    matcher = store.item_matcher()
+    resolved = []
+
+    for op in operations:
+        if not isinstance(op, dict):
+            continue
+        op = dict(op)
+        op["action"] = str(op.get("action", "")).lower()
+        spoken = str(op.get("item") or "").strip()
+        op["spoken_item"] = spoken
+
+        best, candidates = matcher.best(spoken, threshold=threshold) if spoken else (None, [])
+        if best:
+            op["item"] = best
+            op["item_id"] = store.row(store.find_by_name(best))[COL_ID - 1]
+        else:
+            op["item_id"] = None
+            op["candidates"] = candidates
+
+        for field, col in MAINTENANCE_COLUMNS.items():
+            if op.get(field):
+                match, options = store.maintenance_matcher(col).best(op[field], threshold=threshold)
+                op[field] = match or (options[0] if options else op[field])
+
+        resolved.append(op)
+
+    return resolved
+
+
+# --- Applying ---
+
+def _locate(store, op):
+    row_number = None
+    if op.get("item_id"):
+        row_number = store.find_by_id(op["item_id"])
+    elif op.get("item"):
+        row_number = store.find_by_name(op["item"])
+    if not row_number:
+        raise ValueError(f"Item '{op.get('item_id') or op.get('item') or '?'}' not found")
+    return row_number
+
+
+def _apply_one(op, row, movements):
+    """
+    Apply one operation to a working copy of its row; stock changes are also
+    added to `movements` (without `row`). Returns a short summary.
+    """
+    action = op.get("action")
+    item_name = row[COL_ITEM - 1]
+
+    if action == "update":
+        changed = []
+        for field, col in UPDATE_FIELDS.items():
+            if op.get(field):
+                row[col - 1] = str(op[field]).strip()
+                changed.append(field)
+        if not changed:
+            raise ValueError("Nothing to update")
+        return f"Updated {', '.join(changed)} of '{item_name}'"
+
+    if action == "restock":
+        quantity = _field(op, "quantity", to_count, None, "Restock quantity must be a positive number")
+        total = _to_int(row[COL_TOTAL_QTY - 1], 1)
+        remaining = _to_int(row[COL_REMAINING_QTY - 1], total)
+        row[COL_TOTAL_QTY - 1] = total + quantity
+        row[COL_REMAINING_QTY - 1] = remaining + quantity
+        movements.append({"kind": "restock", "remaining": quantity, "total": quantity})
+        return f"Restocked {quantity}x '{item_name}'"
+
+    if action == "sale":
+        quantity = _field(op, "quantity", to_count, 1, "Sale quantity must be a positive number")
+        sold_price = _field(op, "sold_price", to_price, 0.0)
+        date_sold = _field(op, "date_sold", to_date, today())
+        remaining = _to_int(row[COL_REMAINING_QTY - 1], 0)
+        if remaining < quantity:
+            raise ValueError(f"Not enough stock for {quantity} of '{item_name}'")
+        row[COL_REMAINING_QTY - 1] = remaining - quantity
+        buyer = str(op.get("buyer") or "").strip()
+        movements.append({"kind": "sale", "remaining": -quantity, "sale": [
+            make_sale_id(item_name, buyer), item_name, quantity,
+            sold_price, date_sold,
+            buyer, remaining - quantity,
+        ]})
+        return f"Sold {quantity}x '{item_name}'. Remaining: {remaining - quantity}"
+
+    raise ValueError(f"Unknown action '{action}' (expected one of {', '.join(ACTIONS)})")
+
+
+def apply_operations(store, operations):
+    """
+    Validate and apply operations against the Inventory and Sales sheets.
+
+    Operations on the same item are applied in order to one working copy of
+    its row. If any operation is invalid, OperationError lists them and
+    nothing is written. Stock changes are then recorded in the ledger in one
+    atomic step (which re-checks stock, so a concurrent sale cannot make this
+    batch oversell) and the other field changes go out in one batch.
+    """
+    working = {}      # row_number -> (original row, working row)
+    movements = []
+    results, errors = [], []
+
+    for index, op in enumerate(operations):
+        try:
+            row_number = _locate(store, op)
+            if row_number not in working:
+                original = store.row(row_number)
+                working[row_number] = (original, list(original))
+            op_movements = []
+            results.append({"index": index, "result": _apply_one(op, working[row_number][1], op_movements)})
+            movements.extend(dict(m, row=row_number, index=index) for m in op_movements)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    if errors:
+        raise OperationError(errors)
+
+    try:
+        remaining = store.record_movements(movements)
+    except InsufficientStock as e:
+        raise OperationError([{"index": movements[e.position]["index"], "error": str(e)}])
+    for m, left in zip(movements, remaining):
+        if m["kind"] == "sale":
+            results[m["index"]]["result"] = f"Sold {-m['remaining']}x '{m['sale'][1]}'. Remaining: {left}"
+
+    batch = store.batch()
+    for row_number, (original, row) in working.items():
+        changes = {col: row[col - 1] for col in range(1, len(row) + 1)
+                   if col not in STOCK_COLUMNS and row[col - 1] != original[col - 1]}
+        store.update_row(row_number, changes, batch=batch)
+    store.commit(batch)
+    return results
@@ -0,0 +1,100 @@
+"""
+Prompts for the voice extraction calls.
+
+The system prompt is a fixed prefix per task - it never contains the
+Maintenance lists - so it is byte-identical across calls and the
+provider's prompt cache can serve it. The vocabulary goes in the user
+message instead, narrowed locally: a fuzzy pass over the transcript's
+words and short phrases picks the top-K storage locations, box labels and
+places, and only those are offered to the model. Whatever the model
+answers is still resolved against the full lists with find_best_match.
+"""
+import os
+
+from rapidfuzz import fuzz
+
+from extraction import UPDATE_SCHEMA, SALE_SCHEMA
+
+# Maintenance sheet column of each vocabulary field
+VOCAB_COLUMNS = {"storage_location": 1, "box_label": 2, "place_bought": 4}
+
+TOP_K = int(os.getenv("PROMPT_VOCAB_TOP_K", "8"))
+MAX_PHRASE_WORDS = 3       # transcript phrases of up to this many words are matched
+CANDIDATE_THRESHOLD = 60   # looser than find_best_match: these are only hints
+# Whole-phrase ratio is enough once the transcript is cut into phrases, and far cheaper than WRatio
+CANDIDATE_SCORER = fuzz.QRatio
+
+_KNOWN_VALUES = ("`storage_location`, `box_label` and `place_bought` should be one of the known values "
+                 "listed in the user message when one fits; otherwise give them as spoken.")
+
+VOICE_FIELDS_PROMPT = f"""Extract the fields for the mode given in the user message and return them as one JSON object.
+Leave out fields that are not mentioned.
+Mode "update" (change, restock or sell some of an existing item) uses these keys:
+{UPDATE_SCHEMA.describe()}
+Mode "sale" (a sale to a buyer) uses these keys:
+{SALE_SCHEMA.describe()}
+{_KNOWN_VALUES}
+
+Return only JSON without any markdown formatting."""
+
+VOICE_OPERATIONS_PROMPT = f"""The user describes one or more inventory changes. Return a JSON object {{"operations": [...]}} with one object per change:
+- `action`: "update" (change where an item is kept or bought), "restock" (more units arrived) or "sale" (units sold)
+- `item`: the item name as spoken
+- `quantity`: integer number of units (restock and sale)
+- `storage_location`, `box_label`, `place_bought`, `catalogue_number`: only when mentioned
+- `sold_price` (GBP, number), `buyer`, `date_sold` (DD/MM/YYYY): only for sales, only when mentioned
+{_KNOWN_VALUES}
+
+Return only JSON without any markdown formatting."""
+
+
+def transcript_phrases(transcript, max_words=MAX_PHRASE_WORDS):
+    """Distinct runs of 1..max_words consecutive words of the transcript."""
+    words = transcript.split()
+    phrases = []
+    seen = set()
+    for size in range(1, max_words + 1):
+        for start in range(len(words) - size + 1):
+            phrase = " ".join(words[start:start + size])
+            if phrase.casefold() not in seen:
+                seen.add(phrase.casefold())
+                phrases.append(phrase)
+    return phrases
+
+
+def vocabulary_candidates(phrases, matcher, top_k=None):
+    """
+    The `top_k` choices of a FuzzyMatcher that best match any of the
+    transcript `phrases`, best first. Small vocabularies are returned whole.
+    """
+    top_k = TOP_K if top_k is None else top_k
+    if len(matcher) <= top_k:
+        return list(matcher)
+    best = {}
+    for matches in matcher.extract_many(phrases, limit=top_k,
+                                        threshold=CANDIDATE_THRESHOLD, scorer=CANDIDATE_SCORER):
+        for choice, score in matches:
+            if score > best.get(choice, -1):
+                best[choice] = score
+    return sorted(best, key=best.get, reverse=True)[:top_k]
+
+
+def user_message(transcript, candidates, mode=None):
+    """The user turn: the mode (if any), the known-value hints and the transcript."""
+    lines = []
+    if mode:
+        lines.append(f"Mode: {mode}")
+    known = [(field, values) for field, values in candidates.items() if values]
+    if known:
+        lines.append("Known values:")
+        lines.extend(f"- {field}: {', '.join(values)}" for field, values in known)
+    lines.append(f"Transcript: {transcript}")
+    return "\n".join(lines)
+
+
+def build_voice_prompt(store, transcript, system_prompt, mode=None, top_k=None):
+    """(system prompt, user message) for a voice extraction call against `store`'s Maintenance lists."""
+    phrases = transcript_phrases(transcript)
+    candidates = {field: vocabulary_candidates(phrases, store.maintenance_matcher(col), top_k)
+                  for field, col in VOCAB_COLUMNS.items()}
+    return system_prompt, user_message(transcript, candidates, mode)
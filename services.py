@@ -0,0 +1,88 @@
+"""
+Lazily initialised connections to external services.
+
+Nothing here talks to the network until it is first used, so importing the
+app (and starting a worker) never waits on Google or DeepSeek.
+"""
+import threading
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+SHEETS_SCOPE = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+
+class LazyProxy:
+    """Stands in for an object that is only built (once, thread-safely) on first attribute access."""
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    @property
+    def resolved(self):
+        return object.__getattribute__(self, "_instance") is not None
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+
+class SheetsConnection:
+    """One authorised gspread client and one open spreadsheet, shared by every worksheet."""
+
+    def __init__(self, spreadsheet_name, credentials_file):
+        self.spreadsheet_name = spreadsheet_name
+        self.credentials_file = credentials_file
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, SHEETS_SCOPE)
+                self._spreadsheet = gspread.authorize(creds).open(self.spreadsheet_name)
+            return self._spreadsheet
+
+    def worksheet(self, title, header=None):
+        """A worksheet by title; with a `header` row it is created if the spreadsheet lacks it."""
+        spreadsheet = self.spreadsheet()
+        with self._lock:
+            if title not in self._worksheets:
+                try:
+                    self._worksheets[title] = spreadsheet.worksheet(title)
+                except gspread.exceptions.WorksheetNotFound:
+                    if header is None:
+                        raise
+                    worksheet = spreadsheet.add_worksheet(title, rows=1000, cols=len(header))
+                    worksheet.append_row(header)
+                    self._worksheets[title] = worksheet
+            return self._worksheets[title]
+
+    def use_spreadsheet(self, spreadsheet):
+        """Use an already-open spreadsheet (or a stand-in for one) instead of connecting."""
+        with self._lock:
+            self._spreadsheet = spreadsheet
+            self._worksheets = {}
+
+    def lazy_worksheet(self, title, header=None):
+        """Proxy for a worksheet that connects on first use."""
+        return LazyProxy(lambda: self.worksheet(title, header))
+
+    @property
+    def connected(self):
+        return self._spreadsheet is not None
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+
+class StaleRows(Exception):
+    """
+    Raised by a commit when rows no longer hold the values `expect()`ed of
+    them (another worker appended, or the sheet was sorted or edited);
+    nothing in the batch has been written.
+    """
+
+    def __init__(self, worksheet, rows):
+        super().__init__(f"Rows {', '.join(map(str, sorted(rows)))} of {_title(worksheet)} have moved")
+        self.worksheet = worksheet
+        self.rows = set(rows)
+
+
+class WriteBatch:
+    """
+    Cell edits and appended rows collected for one or more worksheets.
+
+    Nothing is sent until `commit()`, which issues at most one `batch_update`
+    and one `append_rows` call per worksheet. Callbacks registered with
+    `on_commit()` run after every write has succeeded.
+
+    Cells `expect()`ed to hold a value (an item's ID, say) are read back in
+    one `batch_get` per worksheet before anything is written; if one holds
+    something else the commit raises StaleRows instead of writing to rows
+    that have moved. After a commit, `appended_rows[worksheet]` holds the
+    row number each appended row landed on, as the sheet reported it.
+    """
+
+    def __init__(self):
+        self._cells = {}      # worksheet -> {(row, col): value}
+        self._appends = {}    # worksheet -> [row, ...]
+        self._expected = {}   # worksheet -> {(row, col): value}
+        self._callbacks = []
+        self._parts = []      # (batch, {worksheet: index of its first appended row}) merged into this one
+        self.appended_rows = {}
+
+    def __bool__(self):
+        return bool(self._cells or self._appends or self._callbacks)
+
+    def expect(self, worksheet, row, col, value):
+        """Only write this batch if cell (row, col) still holds `value`."""
+        self._expected.setdefault(worksheet, {})[(row, col)] = str(value)
+
+    def expected(self, worksheet):
+        """{(row, col): value} expected of a worksheet."""
+        return dict(self._expected.get(worksheet, {}))
+
+    def move_rows(self, worksheet, moves):
+        """Point queued edits and expectations for a worksheet at new row numbers ({old: new})."""
+        for queued in (self._cells, self._expected):
+            if worksheet in queued:
+                queued[worksheet] = {(moves.get(row, row), col): value
+                                     for (row, col), value in queued[worksheet].items()}
+
+    def update_cell(self, worksheet, row, col, value):
+        self._cells.setdefault(worksheet, {})[(row, col)] = value
+
+    def update_row(self, worksheet, row, changes):
+        """Queue {column: value} changes for one row."""
+        for col, value in changes.items():
+            self.update_cell(worksheet, row, col, value)
+
+    def append_rows(self, worksheet, rows):
+        self._appends.setdefault(worksheet, []).extend(list(row) for row in rows)
+
+    def on_commit(self, callback):
+        self._callbacks.append(callback)
+
+    def merge(self, other):
+        """Fold another batch into this one; later cell edits win."""
+        for worksheet, cells in other._cells.items():
+            self._cells.setdefault(worksheet, {}).update(cells)
+        for worksheet, cells in other._expected.items():
+            self._expected.setdefault(worksheet, {}).update(cells)
+        offsets = {}
+        for worksheet, rows in other._appends.items():
+            offsets[worksheet] = len(self._appends.get(worksheet, ()))
+            self._appends.setdefault(worksheet, []).extend(rows)
+        self._parts.append((other, offsets))
+        self._callbacks.extend(other._callbacks)
+
+    def commit(self):
+        """Send all queued writes, one request per worksheet and write type."""
+        for worksheet, expected in self._expected.items():
+            if expected:
+                _check_expected(worksheet, expected)
+        for worksheet, cells in self._cells.items():
+            if cells:
+                worksheet.batch_update(_cell_ranges(cells), value_input_option="USER_ENTERED")
+        for worksheet, rows in self._appends.items():
+            if rows:
+                self._appended(worksheet, _first_row(worksheet.append_rows(rows)))
+        for callback in self._callbacks:
+            callback()
+
+    def _appended(self, worksheet, first_row):
+        """Record where this batch's appended rows (and those of batches merged into it) landed."""
+        if first_row is None:
+            return
+        rows = list(range(first_row, first_row + len(self._appends[worksheet])))
+        self.appended_rows[worksheet] = rows
+        for part, offsets in self._parts:
+            if worksheet in offsets:
+                start = offsets[worksheet]
+                part.appended_rows[worksheet] = rows[start:start + len(part._appends[worksheet])]
+
+
+def _title(worksheet):
+    return getattr(worksheet, "title", worksheet)
+
+
+def _check_expected(worksheet, expected):
+    """Read back the expected cells in one call; raise StaleRows if any differ."""
+    cells = sorted(expected)
+    values = worksheet.batch_get([rowcol_to_a1(row, col) for row, col in cells])
+    stale = {row for (row, col), value in zip(cells, values)
+             if (value[0][0] if value and value[0] else "") != expected[(row, col)]}
+    if stale:
+        raise StaleRows(worksheet, stale)
+
+
+def _first_row(response):
+    """First row number written by a values.append call, from its `updates.updatedRange`."""
+    updated = ((response or {}).get("updates") or {}).get("updatedRange")
+    if not updated:
+        return None
+    return a1_to_rowcol(updated.split("!")[-1].split(":")[0])[0]
+
+
+def _cell_ranges(cells):
+    """Group {(row, col): value} into A1 ranges, merging adjacent cells in a row."""
+    data = []
+    run_start, run_values, prev = None, [], None
+    for row, col in sorted(cells):
+        if prev and row == prev[0] and col == prev[1] + 1:
+            run_values.append(cells[(row, col)])
+        else:
+            if run_start:
+                data.append(_range(run_start, run_values))
+            run_start, run_values = (row, col), [cells[(row, col)]]
+        prev = (row, col)
+    if run_start:
+        data.append(_range(run_start, run_values))
+    return data
+
+
+def _range(start, values):
+    row, col = start
+    a1 = rowcol_to_a1(row, col)
+    if len(values) > 1:
+        a1 = f"{a1}:{rowcol_to_a1(row, col + len(values) - 1)}"
+    return {"range": a1, "values": [values]}
+
+
+class _Round:
+    def __init__(self):
+        self.batches = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class SheetWriter:
+    """
+    Sends WriteBatches to Google Sheets.
+
+    With `window` > 0, batches submitted within `window` seconds of each other
+    are merged and sent together: the first submitter waits out the window,
+    commits the combined batch, and every submitter returns (or raises) once
+    that commit has finished.
+    """
+
+    def __init__(self, window=None):
+        if window is None:
+            window = float(os.getenv("SHEETS_WRITE_WINDOW", "0"))
+        self.window = window
+        self._lock = threading.Lock()
+        self._round = None
+
+    def batch(self):
+        return WriteBatch()
+
+    def submit(self, batch):
+        if not batch:
+            return
+        if self.window <= 0:
+            batch.commit()
+            return
+
+        with self._lock:
+            current = self._round
+            leader = current is None
+            if leader:
+                current = self._round = _Round()
+            current.batches.append(batch)
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                self._round = None
+            merged = WriteBatch()
+            for pending in current.batches:
+                merged.merge(pending)
+            try:
+                merged.commit()
+            except Exception as e:
+                current.error = e
+            finally:
+                current.done.set()
+        else:
+            current.done.wait()
+
+        if current.error:
+            raise current.error
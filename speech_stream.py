@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+SPOOL_MAX_BYTES = 5 * 1024 * 1024    # uploads larger than this spill to a temp file
+
+
+class GoogleBackend:
+    """Google Web Speech API (the original recognizer)."""
+    name = "google"
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_google(audio, language=os.getenv("SPEECH_LANGUAGE", "en-GB"))
+
+
+class SphinxBackend:
+    """CMU PocketSphinx; runs offline (needs the pocketsphinx package)."""
+    name = "sphinx"
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_sphinx(audio)
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleBackend, SphinxBackend)}
+
+
+def get_backend(name=None):
+    name = name or os.getenv("SPEECH_BACKEND", "google")
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown speech backend '{name}' (choose from {', '.join(BACKENDS)})")
+
+
+def spool(stream, chunk_size=64 * 1024):
+    """Copy a (non-seekable) request stream into a seekable temp buffer, a chunk at a time."""
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    shutil.copyfileobj(stream, buffer, chunk_size)
+    buffer.seek(0)
+    return buffer
+
+
+def recognize_window(backend, recognizer, audio):
+    """Transcribe one window; never raises so one bad window doesn't end the stream."""
+    try:
+        return {"text": backend.recognize(recognizer, audio)}
+    except sr.UnknownValueError:
+        return {"text": ""}
+    except sr.RequestError as e:
+        return {"text": "", "error": f"Speech recognition error: {e}"}
+
+
+class StreamingTranscriber:
+    """
+    Transcribes audio in fixed-size windows on a worker pool.
+
+    The file is decoded one window at a time, so memory use is bounded by the
+    window size times the number of windows in flight rather than by the
+    length of the recording. Results are yielded in order as soon as each
+    window is recognized.
+    """
+
+    def __init__(self, backend=None, window_seconds=None, workers=None):
+        self.backend = backend or get_backend()
+        self.window_seconds = window_seconds or float(os.getenv("SPEECH_WINDOW_SECONDS", "15"))
+        workers = workers or int(os.getenv("SPEECH_WORKERS", "4"))
+        self.max_in_flight = workers * 2
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speech")
+
+    def windows(self, audio_file):
+        """Yield AudioData windows from a path or seekable WAV/AIFF/FLAC file object."""
+        with sr.AudioFile(audio_file) as source:
+            # Read the decoded stream directly: Recognizer.record(duration=...) drops the
+            # chunk that crosses the duration, which would lose audio between windows.
+            chunks_per_window = max(1, round(self.window_seconds * source.SAMPLE_RATE / source.CHUNK))
+            while True:
+                frames = bytearray()
+                for _ in range(chunks_per_window):
+                    buffer = source.stream.read(source.CHUNK)
+                    if not buffer:
+                        break
+                    frames.extend(buffer)
+                if not frames:
+                    return
+                yield sr.AudioData(bytes(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+
+    def transcribe(self, audio_file):
+        """Yield {"index", "start", "end", "text"[, "error"]} per window, in order."""
+        recognizer = sr.Recognizer()
+        pending = deque()
+
+        def drain(limit):
+            while len(pending) > limit:
+                index, start, end, future = pending.popleft()
+                result = future.result()
+                result.update(index=index, start=round(start, 3), end=round(end, 3))
+                yield result
+
+        offset = 0.0
+        for index, audio in enumerate(self.windows(audio_file)):
+            length = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+            future = self._pool.submit(recognize_window, self.backend, recognizer, audio)
+            pending.append((index, offset, offset + length, future))
+            offset += length
+            yield from drain(self.max_in_flight - 1)
+        yield from drain(0)
+
+    def transcribe_all(self, audio_file):
+        """Full transcript of a file (windows joined with spaces)."""
+        parts = [result["text"] for result in self.transcribe(audio_file) if result["text"]]
+        return " ".join(parts)
@@ -0,0 +1,33 @@
+// 🔍 Item name suggestions from /api/items, for inputs with a data-item-search attribute
+function attachItemSearch(input) {
+    let list = document.createElement("datalist");
+    list.id = input.name + "_suggestions";
+    input.setAttribute("list", list.id);
+    input.after(list);
+
+    let timer = null;
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        let query = input.value.trim();
+        if (query.length < 2) {
+            return;
+        }
+        timer = setTimeout(function () {
+            fetch("/api/items?fields=item&limit=10&q=" + encodeURIComponent(query))
+                .then(response => response.json())
+                .then(data => {
+                    list.innerHTML = "";
+                    (data.items || []).forEach(item => {
+                        let option = document.createElement("option");
+                        option.value = item.item;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(error => console.error("❌ Item search failed:", error));
+        }, 200);
+    });
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("input[data-item-search]").forEach(attachItemSearch);
+});
@@ -0,0 +1,486 @@
+"""
+Where the inventory data lives: the Inventory, Sales, Maintenance and
+Restocks tables, behind one small interface with two implementations.
+
+- SheetsStorage reads and writes the Google Sheets worksheets directly.
+- SQLiteStorage keeps the tables in an indexed SQLite file in WAL mode, so
+  reads and writes run at local-disk speed and need no Google credentials.
+  Every write is also logged, and a SheetsMirror copies the log to the
+  spreadsheet in the background, in batches, so the spreadsheet stays an
+  up-to-date view. Edits made in the spreadsheet are not read back, except
+  for the Maintenance lists, which are curated there by hand (see
+  `SheetsMirror.pull()`).
+
+Both hold the tables the way the worksheets do - rows of strings, row 1
+the header - so row numbers mean the same thing in either, and
+InventoryStore runs on both unchanged:
+
+    storage.inventory, .sales, .maintenance, .restocks    table handles
+    storage.load()              {table name: rows} for inventory, sales, maintenance
+    storage.batch()             a WriteBatch: update_row(table, row, {col: value}),
+                                append_rows(table, rows), expect(table, row, col, value),
+                                on_commit(callback); `appended_rows` after the commit
+    storage.submit(batch)       apply a batch (all or nothing for SQLite); StaleRows
+                                if an expected cell differs
+
+STORAGE_BACKEND=sqlite (see `storage_from_env()`) switches the app over;
+the default is Sheets.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import registry, timed
+from sheet_writer import SheetWriter, StaleRows, WriteBatch
+
+log = logging.getLogger("elliotonline.storage")
+
+DEFAULT_PATH = Path(__file__).parent / "inventory.db"
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sheets")
+# Mirror the SQLite tables to the spreadsheet (and seed them from it while the file is empty)
+SHEETS_MIRROR = os.getenv("SHEETS_MIRROR", "1") == "1"
+SHEETS_SYNC_INTERVAL = float(os.getenv("SHEETS_SYNC_INTERVAL", "5"))    # seconds between mirror runs
+SHEETS_SYNC_ROWS = int(os.getenv("SHEETS_SYNC_ROWS", "500"))            # changes per Sheets batch
+
+# Columns of each table, in worksheet order (column 1 first)
+TABLES = {
+    "inventory": ("item_id", "item", "catalogue_number", "storage_location", "box_label", "price",
+                  "total_qty", "remaining_qty", "date_bought", "place_bought", "restock_history"),
+    "sales": ("sale_id", "item", "quantity", "sold_price", "date_sold", "buyer", "remaining"),
+    "maintenance": ("storage_location", "box_label", "notes", "place_bought"),
+    "restocks": ("item_id", "item", "date", "quantity"),
+}
+# Header row of each table, for a spreadsheet or database that starts empty
+HEADERS = {
+    "inventory": ["ID", "Item", "Catalogue Number", "Storage Location", "Box Label", "Price",
+                  "Total Qty", "Remaining Qty", "Date Bought", "Place Bought", "Restock History"],
+    "sales": ["Sale ID", "Item", "Quantity", "Sold Price", "Date Sold", "Buyer", "Remaining"],
+    "maintenance": ["Storage Location", "Box Label", "Notes", "Place Bought"],
+    "restocks": ["Item ID", "Item", "Date", "Quantity"],
+}
+SHEET_TITLES = {"inventory": "Inventory", "sales": "Sales", "maintenance": "Maintenance", "restocks": "Restocks"}
+
+# Tables InventoryStore loads; Restocks is only ever appended to
+LOADED_TABLES = ("inventory", "sales", "maintenance")
+
+INDEXES = (
+    ("inventory", "item_id"), ("inventory", "item"),
+    ("sales", "sale_id"), ("sales", "item"),
+    ("restocks", "item_id"),
+)
+
+
+def _cell(value):
+    return "" if value is None else str(value)
+
+
+def _row_values(table, values):
+    """A row as the table stores it: strings, cut to the table's width."""
+    return [_cell(value) for value in values][:len(TABLES[table])]
+
+
+class SheetsStorage:
+    """The spreadsheet's worksheets; batches are sent by a SheetWriter."""
+
+    name = "sheets"
+
+    def __init__(self, inventory, sales, maintenance, restocks=None, writer=None):
+        self.inventory = inventory
+        self.sales = sales
+        self.maintenance = maintenance
+        self.restocks = restocks    # optional; gets one row per restock
+        self.writer = writer or SheetWriter()
+
+    def table(self, name):
+        return getattr(self, name)
+
+    def load(self, tables=LOADED_TABLES):
+        return {name: self.table(name).get_all_values() for name in tables if self.table(name) is not None}
+
+    def batch(self):
+        return self.writer.batch()
+
+    def submit(self, batch):
+        self.writer.submit(batch)
+
+    def status(self):
+        return {"backend": self.name}
+
+
+class SQLiteBatch(WriteBatch):
+    """A WriteBatch that SQLiteStorage applies in one transaction."""
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+
+    def commit(self):
+        self.appended_rows = self.storage.apply(self._cells, self._appends, self._expected)
+        for callback in self._callbacks:
+            callback()
+
+
+class SQLiteStorage:
+    """
+    The tables in a SQLite file (WAL mode, so readers never wait on the
+    writer, and worker processes can share it).
+
+    Each table has a `row` primary key matching the worksheet row number
+    and one TEXT column per worksheet column; lookups by item ID, item name
+    and sale ID are indexed. Writes are logged in `changes` until a
+    SheetsMirror has copied them to the spreadsheet; only one mirror claim
+    is outstanding at a time, so mirrors in different workers never
+    interleave their writes.
+
+    With a `seed` storage (the Sheets one), tables that are still empty are
+    filled from it on first load; otherwise they start with just a header.
+    With mirrored=False nothing is logged.
+    """
+
+    name = "sqlite"
+    inventory, sales, maintenance, restocks = "inventory", "sales", "maintenance", "restocks"
+
+    def __init__(self, path=None, seed=None, mirrored=True, claim_timeout=None):
+        if path is None:
+            path = os.getenv("STORAGE_PATH", str(DEFAULT_PATH))
+        if claim_timeout is None:
+            claim_timeout = float(os.getenv("STORAGE_CLAIM_TIMEOUT", "120"))
+        self.path = path
+        self.seed = seed
+        self.mirrored = mirrored
+        self.claim_timeout = claim_timeout
+        self._initialised = False
+
+        self._lock = threading.Lock()
+        # Autocommit mode; every write opens its own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        statements = []
+        for table, columns in TABLES.items():
+            cells = ", ".join(f"{column} TEXT NOT NULL DEFAULT ''" for column in columns)
+            statements.append(f"CREATE TABLE IF NOT EXISTS {table} (row INTEGER PRIMARY KEY, {cells});")
+        statements.extend(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table}({column});"
+                          for table, column in INDEXES)
+        statements.append(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, row INTEGER NOT NULL,"
+            " op TEXT NOT NULL, cells TEXT NOT NULL, claimed_at REAL, synced_at REAL);"
+            "CREATE INDEX IF NOT EXISTS idx_changes_pending ON changes(seq) WHERE synced_at IS NULL;"
+        )
+        self._conn.executescript("".join(statements))
+
+    def table(self, name):
+        return name
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- Reads ---
+
+    def load(self, tables=LOADED_TABLES):
+        if not self._initialised:
+            self._fill_empty_tables()
+        with timed("sqlite", "load"), self._lock:
+            return {table: self._rows(table) for table in tables}
+
+    def _rows(self, table):
+        """All rows of a table as lists of strings; gaps in the row numbers become blank rows."""
+        width = len(TABLES[table])
+        rows = []
+        for row_number, *cells in self._conn.execute(f"SELECT * FROM {table} ORDER BY row"):
+            while len(rows) < row_number - 1:
+                rows.append([""] * width)
+            rows.append(cells)
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    # --- Writes ---
+
+    def batch(self):
+        return SQLiteBatch(self)
+
+    def submit(self, batch):
+        if batch:
+            batch.commit()
+
+    def apply(self, cells, appends, expected=None):
+        """
+        Write {table: {(row, col): value}} cell edits and {table: [row, ...]}
+        appended rows in one transaction, logging them for the mirror, and
+        return {table: [row number of each appended row]}. Nothing is written
+        (StaleRows) if a cell in {table: {(row, col): value}} `expected` differs.
+        """
+        if not self._initialised:
+            self._fill_empty_tables()
+        appended = {}
+        with timed("sqlite", "write"), self._transaction() as conn:
+            for table, table_expected in (expected or {}).items():
+                self._check(conn, table, table_expected)
+            for table, table_cells in cells.items():
+                by_row = {}
+                for (row_number, col), value in table_cells.items():
+                    by_row.setdefault(row_number, {})[col] = _cell(value)
+                for row_number, changes in sorted(by_row.items()):
+                    self._update(conn, table, row_number, changes)
+                    if self.mirrored:
+                        self._log(conn, table, row_number, "update", {str(col): v for col, v in changes.items()})
+            for table, rows in appends.items():
+                if not rows:
+                    continue
+                row_number = conn.execute(f"SELECT COALESCE(MAX(row), 0) FROM {table}").fetchone()[0]
+                appended[table] = []
+                for values in rows:
+                    row_number += 1
+                    values = _row_values(table, values)
+                    self._insert(conn, table, row_number, values)
+                    appended[table].append(row_number)
+                    if self.mirrored:
+                        self._log(conn, table, row_number, "append", values)
+        return appended
+
+    @staticmethod
+    def _check(conn, table, expected):
+        stale = set()
+        for (row_number, col), value in expected.items():
+            found = conn.execute(f"SELECT {TABLES[table][col - 1]} FROM {table} WHERE row = ?",
+                                 (row_number,)).fetchone()
+            if (found[0] if found else "") != value:
+                stale.add(row_number)
+        if stale:
+            raise StaleRows(table, stale)
+
+    @staticmethod
+    def _update(conn, table, row_number, changes):
+        columns = TABLES[table]
+        names = [columns[col - 1] for col in changes]    # IndexError for a column the table lacks
+        updated = conn.execute(
+            f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in names)} WHERE row = ?",
+            (*changes.values(), row_number),
+        ).rowcount
+        if not updated:    # past the last row, as a Sheets cell edit may be
+            conn.execute(f"INSERT INTO {table} (row, {', '.join(names)}) VALUES (?{', ?' * len(names)})",
+                         (row_number, *changes.values()))
+
+    @staticmethod
+    def _insert(conn, table, row_number, values):
+        names = TABLES[table][:len(values)]
+        conn.execute(f"INSERT INTO {table} (row{''.join(', ' + name for name in names)})"
+                     f" VALUES (?{', ?' * len(names)})", (row_number, *values))
+
+    @staticmethod
+    def _log(conn, table, row_number, op, cells):
+        conn.execute("INSERT INTO changes (tbl, row, op, cells) VALUES (?, ?, ?, ?)",
+                     (table, row_number, op, json.dumps(cells)))
+
+    def replace(self, table, rows):
+        """Replace a table's rows (row 1 the header) without logging them for the mirror."""
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {table}")
+            for row_number, values in enumerate(rows, start=1):
+                self._insert(conn, table, row_number, _row_values(table, values))
+
+    def _fill_empty_tables(self):
+        """
+        Fill empty tables from `seed`, or give them their header row; a header
+        the spreadsheet lacks too is logged, so the mirror writes it first.
+        """
+        with self._lock:
+            empty = [table for table in TABLES
+                     if not self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone()]
+        if empty:
+            loaded = self.seed.load(empty) if self.seed is not None else {}
+            with self._transaction() as conn:
+                for table in empty:
+                    if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                        continue    # another worker filled it meanwhile
+                    rows = loaded.get(table)
+                    header_only = not rows
+                    for row_number, values in enumerate(rows or [HEADERS[table]], start=1):
+                        values = _row_values(table, values)
+                        self._insert(conn, table, row_number, values)
+                        if header_only and self.mirrored:
+                            self._log(conn, table, row_number, "append", values)
+            if self.seed is not None:
+                log.info("Seeded %s from %s", ", ".join(empty), self.seed.name)
+        self._initialised = True
+
+    # --- Change log (for the mirror) ---
+
+    def claim_changes(self, limit=500):
+        """
+        Claim up to `limit` unmirrored changes, oldest first, as dicts with
+        `seq`, `table`, `row`, `op` ("update" or "append") and `cells`
+        ({column: value} for updates, the row's values for appends). Returns
+        nothing while another claim is outstanding (and younger than
+        `claim_timeout`).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if conn.execute(
+                "SELECT 1 FROM changes WHERE synced_at IS NULL AND claimed_at > ? LIMIT 1",
+                (now - self.claim_timeout,),
+            ).fetchone():
+                return []
+            changes = [
+                {"seq": seq, "table": table, "row": row_number, "op": op, "cells": json.loads(cells)}
+                for seq, table, row_number, op, cells in conn.execute(
+                    "SELECT seq, tbl, row, op, cells FROM changes WHERE synced_at IS NULL ORDER BY seq LIMIT ?",
+                    (limit,),
+                )
+            ]
+            conn.executemany("UPDATE changes SET claimed_at = ? WHERE seq = ?", [(now, c["seq"]) for c in changes])
+        return changes
+
+    def mark_changes_synced(self, changes):
+        """Mark claimed changes as copied; the log is pruned of mirrored changes once they are a day old."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany("UPDATE changes SET synced_at = ?, claimed_at = NULL WHERE seq = ?",
+                             [(now, c["seq"]) for c in changes])
+            conn.execute("DELETE FROM changes WHERE synced_at < ?", (now - 86400,))
+
+    def release_changes(self, changes):
+        """Give claimed changes back (the copy failed); the next claim retries them."""
+        with self._transaction() as conn:
+            conn.executemany("UPDATE changes SET claimed_at = NULL WHERE seq = ?", [(c["seq"],) for c in changes])
+
+    def pending_changes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM changes WHERE synced_at IS NULL").fetchone()[0]
+
+    def status(self):
+        return {"backend": self.name, "path": self.path, "unmirrored_changes": self.pending_changes()}
+
+
+class SheetsMirror:
+    """
+    Copies SQLiteStorage writes to the spreadsheet (a SheetsStorage) from a
+    background thread, every `interval` seconds, up to `batch_rows` changes
+    per Sheets batch.
+
+    Rows appended and then edited before the copy are sent as one appended
+    row, so appends always reach the sheet in order and land on the row
+    number they have in SQLite. Changes are only marked copied once Sheets
+    has accepted them; a failed copy is retried on the next run.
+    """
+
+    def __init__(self, source, target, interval=None, batch_rows=None):
+        self.source = source
+        self.target = target
+        self.interval = SHEETS_SYNC_INTERVAL if interval is None else interval
+        self.batch_rows = SHEETS_SYNC_ROWS if batch_rows is None else batch_rows
+        self.last_sync = None
+        self.last_error = None
+        self._lock = threading.Lock()    # one copy at a time in this process
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._loop, name="sheets-mirror", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def wake(self):
+        """Copy now rather than at the next interval."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                log.warning("Sheets mirror failed, will retry: %s", e)
+
+    def sync(self):
+        """Copy unmirrored changes to the spreadsheet now; returns how many were copied."""
+        copied = 0
+        with self._lock:
+            while True:
+                changes = self.source.claim_changes(self.batch_rows)
+                if not changes:
+                    return copied
+                try:
+                    self.target.submit(self._sheets_batch(changes))
+                except Exception as e:
+                    self.source.release_changes(changes)
+                    self.last_error = str(e)
+                    registry.inc("app_storage_mirror_errors_total", {})
+                    raise
+                self.source.mark_changes_synced(changes)
+                self.last_sync, self.last_error = time.time(), None
+                registry.inc("app_storage_mirrored_total", {}, len(changes))
+                copied += len(changes)
+
+    def _sheets_batch(self, changes):
+        batch = self.target.batch()
+        appended = {}    # (table, row) -> values of a row appended in this batch
+        for change in changes:
+            table, row_number = change["table"], change["row"]
+            if self.target.table(table) is None:    # e.g. no Restocks worksheet
+                continue
+            if change["op"] == "append":
+                appended[(table, row_number)] = list(change["cells"])
+                continue
+            cells = {int(col): value for col, value in change["cells"].items()}
+            values = appended.get((table, row_number))
+            if values is None:
+                batch.update_row(self.target.table(table), row_number, cells)
+                continue
+            for col, value in cells.items():
+                values.extend([""] * (col - len(values)))
+                values[col - 1] = value
+        for (table, _), values in sorted(appended.items(), key=lambda item: item[0][1]):
+            batch.append_rows(self.target.table(table), [values])
+        return batch
+
+    def pull(self, table="maintenance"):
+        """Replace a SQLite table with the spreadsheet's copy (for tables edited by hand, like Maintenance)."""
+        rows = self.target.load((table,)).get(table)
+        if rows:
+            self.source.replace(table, rows)
+        return len(rows or [])
+
+    def status(self):
+        return {"last_sync": self.last_sync, "last_error": self.last_error, "interval": self.interval}
+
+
+def storage_from_env(sheets_storage):
+    """
+    (storage, mirror) for STORAGE_BACKEND: the Sheets storage itself and no
+    mirror, or a SQLiteStorage (at STORAGE_PATH) that is seeded from and
+    mirrored to the spreadsheet unless SHEETS_MIRROR=0. The mirror is not
+    started.
+    """
+    if STORAGE_BACKEND == "sheets":
+        return sheets_storage, None
+    if STORAGE_BACKEND != "sqlite":
+        raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (use 'sheets' or 'sqlite')")
+    if not SHEETS_MIRROR:
+        return SQLiteStorage(mirrored=False), None
+    storage = SQLiteStorage(seed=sheets_storage)
+    return storage, SheetsMirror(storage, sheets_storage)
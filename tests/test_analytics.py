@@ -0,0 +1,89 @@
+import pytest
+
+import analytics
+from analytics import Analytics
+
+#            ID        Item      Size  Location   Box   Price   Qty  Left  Bought        Supplier
+INVENTORY = [["ITEM-1", "Cap",    "", "Shelf A", "B1", "5.00", "4", "4", "01/01/2025", "eBay"],
+             ["ITEM-2", "Hoodie", "", "Shelf A", "B2", "£20", "2", "1", "01/01/2025", "Vinted"],
+             ["ITEM-3", "Scarf",  "", "",        "B2", "3.50", "2", "2", "01/01/2025", ""]]
+#         Sale ID   Item      Qty  Sold price  Date
+SALES = [["SALE-1", "Cap",    "2", "9.00", "03/02/2025"],
+         ["SALE-2", "Hoodie", "1", "30",   "15/02/2025"],
+         ["SALE-3", "Cap",    "1", "8.00", "01/03/2025"],
+         ["SALE-4", "Gone",   "1", "4.00", "not a date"]]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "pure-python"])
+def rollups(request, monkeypatch):
+    monkeypatch.setattr(analytics, "HAVE_NUMPY", request.param and analytics.HAVE_NUMPY)
+    result = Analytics()
+    result.reset(INVENTORY, SALES)
+    return result
+
+
+def test_stock_is_valued_by_location_box_and_supplier(rollups):
+    assert rollups.stock("storage_location") == {
+        "Shelf A": {"items": 2, "units": 5, "value": 40.0},
+        "(none)": {"items": 1, "units": 2, "value": 7.0},
+    }
+    assert rollups.stock("box_label", "B2") == {"items": 2, "units": 3, "value": 27.0}
+    assert rollups.stock("place_bought", "Nowhere") is None
+    assert rollups.stock_total() == {"items": 3, "units": 7, "value": 47.0}
+
+
+def test_sales_are_rolled_up_with_revenue_cost_and_margin(rollups):
+    assert rollups.sales("item", "Cap") == {
+        "sales": 2, "units": 3, "revenue": 26.0, "cost": 15.0, "margin": 11.0, "margin_pct": 42.3,
+    }
+    assert set(rollups.sales("month")) == {"2025-02", "2025-03", "(none)"}
+    assert rollups.sales("day", "2025-02-15")["revenue"] == 30.0
+    assert rollups.sales("supplier", "(none)")["cost"] == 0.0    # sold item no longer in stock
+    assert rollups.sales_total()["revenue"] == 60.0
+
+
+def test_supplier_sales_can_be_limited_to_a_month(rollups):
+    assert set(rollups.sales("supplier", month="2025-02")) == {"eBay", "Vinted"}
+    assert rollups.sales("supplier", "eBay", month="2025-03")["units"] == 1
+    assert rollups.sales("supplier", month="2024-12") == {}
+
+
+def test_changes_adjust_only_the_groups_they_touch(rollups):
+    moved = list(INVENTORY[0])
+    moved[3], moved[7] = "Shelf B", "3"
+    rollups.row_changed(INVENTORY[0], moved)
+    rollups.row_changed(None, ["ITEM-4", "Bag", "", "Shelf B", "B3", "10", "1", "1", "01/01/2025", "eBay"])
+    rollups.sale_added(["SALE-5", "Cap", "1", "9.00", "20/03/2025"], moved)
+
+    assert rollups.stock("storage_location") == {
+        "Shelf A": {"items": 1, "units": 1, "value": 20.0},
+        "Shelf B": {"items": 2, "units": 4, "value": 25.0},
+        "(none)": {"items": 1, "units": 2, "value": 7.0},
+    }
+    assert rollups.stock_total() == {"items": 4, "units": 7, "value": 52.0}
+    assert rollups.sales("month", "2025-03")["revenue"] == 17.0
+    assert rollups.sales("supplier", "eBay", month="2025-03")["sales"] == 2
+
+
+def test_incremental_updates_match_a_rebuild(rollups):
+    new_sale = ["SALE-5", "Hoodie", "1", "25", "16/02/2025"]
+    sold = list(INVENTORY[1])
+    sold[7] = "0"
+    rollups.row_changed(INVENTORY[1], sold)
+    rollups.sale_added(new_sale, sold)
+
+    rebuilt = Analytics()
+    rebuilt.reset([INVENTORY[0], sold, INVENTORY[2]], SALES + [new_sale])
+
+    for by in analytics.STOCK_DIMENSIONS:
+        assert rollups.stock(by) == rebuilt.stock(by)
+    for by in analytics.SALES_DIMENSIONS:
+        assert rollups.sales(by) == rebuilt.sales(by)
+    assert rollups.sales_total() == rebuilt.sales_total()
+
+
+def test_a_group_with_nothing_left_is_dropped(rollups):
+    rollups.row_changed(INVENTORY[2], None)
+
+    assert "(none)" not in rollups.stock("storage_location")
+    assert rollups.stock("place_bought", "(none)") is None
@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+
+import bulk_import
+from bulk_import import BulkImporter, ImportInProgress
+from extraction import ADD_SCHEMA
+from llm_client import LLMUnavailable
+
+CSV = "item,price,quantity\n" + "".join(f"Cap {i},{i}.50,1\n" for i in range(1, 7))
+
+
+class FakeStore:
+    def __init__(self, fail_after=None):
+        self.rows = []
+        self.fail_after = fail_after
+        self.next_id = 1
+
+    def reserve_item_numbers(self, count):
+        first, self.next_id = self.next_id, self.next_id + count
+        return first
+
+    def append_inventory(self, rows):
+        if self.fail_after is not None and len(self.rows) >= self.fail_after:
+            raise RuntimeError("Sheets went away")
+        self.rows.extend(rows)
+
+
+def _no_llm(text):
+    raise AssertionError(f"Structured rows were sent to the LLM: {text!r}")
+
+
+def _importer(store, parse_text=_no_llm):
+    return BulkImporter(store, parse_text, ADD_SCHEMA.validate, lambda item_id, entry: [item_id, entry.item],
+                        chunk_lines=2, concurrency=1, batch_rows=2)
+
+
+@pytest.fixture(autouse=True)
+def import_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_DIR", tmp_path)
+    return tmp_path
+
+
+def _staged(importer, import_id, text):
+    path = importer.upload_path(import_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_resumed_csv_import_keeps_its_format_and_position():
+    import_id = "a" * 32
+    store = FakeStore(fail_after=2)
+    importer = _importer(store)
+    path = _staged(importer, import_id, CSV)
+
+    with pytest.raises(RuntimeError):
+        importer.run(path, "csv", import_id, on_progress=lambda **_: None)
+    assert importer.status(import_id)["position"] == 2
+
+    store.fail_after = None
+    # The staged .upload file has no CSV suffix; the checkpoint remembers the format
+    summary = importer.run(path, None, import_id, on_progress=lambda **_: None)
+
+    assert summary["status"] == "complete"
+    assert summary["format"] == "csv"
+    assert [row[1] for row in store.rows] == [f"Cap {i}" for i in range(1, 7)]
+
+
+def test_llm_outage_fails_the_import_without_skipping_lines():
+    import_id = "b" * 32
+    store = FakeStore()
+    calls = []
+
+    def parse_text(text):
+        calls.append(text)
+        if len(calls) == 2:
+            raise LLMUnavailable("down")
+        return [ADD_SCHEMA.validate({"item": line, "price": 1}) for line in text.splitlines()]
+
+    importer = _importer(store, parse_text)
+    path = _staged(importer, import_id, "".join(f"Mug {i} for £1\n" for i in range(1, 5)))
+
+    with pytest.raises(LLMUnavailable):
+        importer.run(path, "text", import_id, on_progress=lambda **_: None)
+    state = importer.status(import_id)
+    assert (state["status"], state["position"]) == ("failed", 2)
+
+    summary = importer.run(path, None, import_id, on_progress=lambda **_: None)
+    assert summary["status"] == "complete"
+    assert [row[1] for row in store.rows] == [f"Mug {i} for £1" for i in range(1, 5)]
+
+
+def test_rows_without_an_item_are_reported():
+    import_id = "c" * 32
+    store = FakeStore()
+    importer = _importer(store)
+    path = _staged(importer, import_id, "name,price\nCap,2\n,3\n")
+
+    summary = importer.run(path, "csv", import_id, on_progress=lambda **_: None)
+
+    assert [row[1] for row in store.rows] == ["Cap"]
+    assert summary["error_count"] == 1
+    assert summary["errors"][0]["line"] == 3
+
+
+def test_second_run_of_a_running_import_is_refused():
+    import_id = "d" * 32
+    started, release = threading.Event(), threading.Event()
+
+    class SlowStore(FakeStore):
+        def append_inventory(self, rows):
+            started.set()
+            release.wait(5)
+            super().append_inventory(rows)
+
+    importer = _importer(SlowStore())
+    path = _staged(importer, import_id, CSV)
+    first = threading.Thread(target=importer.run, args=(path, "csv", import_id),
+                             kwargs={"on_progress": lambda **_: None})
+    first.start()
+    try:
+        assert started.wait(5)
+        assert importer.is_running(import_id)
+        with pytest.raises(ImportInProgress):
+            importer.run(path, "csv", import_id)
+        # Another process (here another importer) is refused too
+        with pytest.raises(ImportInProgress):
+            _importer(FakeStore()).run(path, "csv", import_id)
+    finally:
+        release.set()
+        first.join()
+    assert not importer.is_running(import_id)
+    assert importer.status(import_id)["imported"] == 6
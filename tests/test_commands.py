@@ -0,0 +1,122 @@
+import pytest
+
+from commands import CommandError, CommandRunner, parse_command
+from inventory_store import COL_REMAINING_QTY, InventoryStore
+from ledger import StockLedger
+from llm_client import LLMUnavailable
+from storage import HEADERS, SQLiteStorage
+
+ROWS = [["ITEM-1", "Nike Hoodie", "M", "Shelf A", "B1", "20.00", "3", "3", "01/01/2025", "eBay", ""],
+        ["ITEM-2", "Nike Cap", "", "Shelf B", "", "5.00", "2", "2", "01/01/2025", "eBay", ""],
+        ["ITEM-3", "Scarf", "", "", "", "3.50", "1", "1", "01/01/2025", "", ""]]
+
+
+@pytest.fixture
+def store():
+    storage = SQLiteStorage(":memory:", mirrored=False)
+    storage.replace("inventory", [HEADERS["inventory"]] + ROWS)
+    return InventoryStore(storage, ledger=StockLedger(":memory:"), flush_interval=0)
+
+
+def _runner(store, entries=(), operations=None):
+    def add_items(text):
+        if isinstance(entries, Exception):
+            raise entries
+        return list(entries)
+    return CommandRunner(store, add_items, lambda text: operations or {"operations": []})
+
+
+@pytest.mark.parametrize("text, parsed", [
+    ("sold 2 nike hoodies", ("sale", "2 nike hoodies")),
+    ("Move: scarf to box B4", ("update", "scarf to box B4")),
+    ("how many nike caps are left?", ("stock", "nike caps")),
+    ("stock of ITEM-2", ("stock", "ITEM-2")),
+    ("help", ("help", "")),
+])
+def test_messages_are_parsed_into_commands(text, parsed):
+    assert parse_command(text) == parsed
+
+
+@pytest.mark.parametrize("text, error", [
+    ("", "Empty message"),
+    ("dance with the hoodie", "Unknown command 'dance'"),
+    ("sold", "'sold' needs a description"),
+])
+def test_bad_messages_are_rejected(text, error):
+    with pytest.raises(CommandError, match=error):
+        parse_command(text)
+
+
+def test_unknown_command_replies_with_help(store):
+    result = _runner(store).run("dance")
+
+    assert result["ok"] is False and result["command"] is None
+    assert "Commands:" in result["reply"]
+
+
+def test_stock_by_id_and_name(store):
+    runner = _runner(store)
+
+    assert runner.run("stock ITEM-1")["reply"] == "Nike Hoodie (ITEM-1): 3 left - Shelf A, B1"
+    assert runner.run("how many scarf left")["reply"] == "Scarf (ITEM-3): 1 left"
+
+
+def test_stock_lists_candidates_for_an_ambiguous_name(store):
+    result = _runner(store).run("stock nike")
+
+    assert result["ok"] is False
+    assert result["reply"].startswith("Several items match 'nike':")
+
+
+def test_add_reports_added_and_rejected_entries(store):
+    entries = [
+        {"status": "success", "item": "Bag", "id": "ITEM-4", "total_qty": 2, "price": 12.5,
+         "storage_location": "Shelf C"},
+        {"status": "error", "item": "", "errors": ["Price is required"]},
+    ]
+
+    result = _runner(store, entries).run("add bag £12.50 x2 shelf C, and a belt")
+
+    assert result["ok"] is False
+    assert result["reply"] == "Added Bag (ITEM-4): 2 x £12.50 - Shelf C\nNot added (?): Price is required"
+
+
+def test_add_lets_an_llm_outage_through(store):
+    with pytest.raises(LLMUnavailable):
+        _runner(store, LLMUnavailable("down")).run("add bag £12.50")
+
+
+def test_sale_is_applied_to_the_store(store):
+    operations = {"operations": [{"action": "sale", "item_id": "ITEM-1", "quantity": 2, "sold_price": 30}]}
+
+    result = _runner(store, operations=operations).run("sold 2 nike hoodies for £30 each")
+
+    assert result["ok"] is True
+    assert result["reply"] == "Sold 2x 'Nike Hoodie'. Remaining: 1"
+    assert str(store.row(store.find_by_id("ITEM-1"))[COL_REMAINING_QTY - 1]) == "1"
+
+
+def test_unresolved_items_change_nothing(store):
+    operations = {"operations": [
+        {"action": "sale", "item_id": "ITEM-3", "quantity": 1},
+        {"action": "sale", "spoken_item": "nike", "candidates": ["Nike Hoodie", "Nike Cap"]},
+    ]}
+
+    result = _runner(store, operations=operations).run("sold a scarf and a nike")
+
+    assert result["ok"] is False
+    assert result["reply"] == "Which item did you mean by 'nike'? Nike Hoodie / Nike Cap\nNothing was changed."
+    assert str(store.row(store.find_by_id("ITEM-3"))[COL_REMAINING_QTY - 1]) == "1"
+
+
+def test_invalid_operations_change_nothing(store):
+    operations = {"operations": [
+        {"action": "sale", "item_id": "ITEM-3", "quantity": 1},
+        {"action": "sale", "item_id": "ITEM-2", "quantity": 5},
+    ]}
+
+    result = _runner(store, operations=operations).run("sold a scarf and 5 nike caps")
+
+    assert result["ok"] is False
+    assert result["reply"] == "Not enough stock for 5 of 'Nike Cap'\nNothing was changed."
+    assert str(store.row(store.find_by_id("ITEM-3"))[COL_REMAINING_QTY - 1]) == "1"
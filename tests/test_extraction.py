@@ -0,0 +1,86 @@
+import pytest
+
+from extraction import ADD_SCHEMA, SALE_SCHEMA, UPDATE_SCHEMA, to_count, to_int, to_price
+
+
+@pytest.mark.parametrize("value, expected", [
+    (2, 2),
+    (2.0, 2),
+    ("2", 2),
+    ("2x", 2),
+    ("x 2", 2),
+    ("1,200", 1200),
+    ("two", 2),
+    ("a dozen", 12),
+    ("0", 0),
+])
+def test_to_int(value, expected):
+    assert to_int(value) == expected
+
+
+@pytest.mark.parametrize("value", [-3, "-3", "- 3", 2.5, "2.5", True, "", "none"])
+def test_to_int_rejects(value):
+    with pytest.raises(ValueError):
+        to_int(value)
+
+
+def test_to_count_rejects_zero():
+    with pytest.raises(ValueError):
+        to_count("0")
+
+
+@pytest.mark.parametrize("value, expected", [
+    (12, 12.0), ("12.50", 12.5), ("£12", 12.0), ("12 pounds", 12.0), ("1,200", 1200.0), ("12,50", 12.5),
+])
+def test_to_price(value, expected):
+    assert to_price(value) == expected
+
+
+@pytest.mark.parametrize("value", [-5, -0.5, "-5", "£-5", "- 5", "free", True])
+def test_to_price_rejects(value):
+    with pytest.raises(ValueError):
+        to_price(value)
+
+
+@pytest.mark.parametrize("schema, raw, expected, errors", [
+    # Aliases, and coercion of each kind
+    (ADD_SCHEMA, {"name": "Blue Cap", "cost": "£12.50", "qty": "two", "date_bought": "5th March 2024"},
+     {"item": "Blue Cap", "price": 12.5, "total_qty": 2, "remaining_qty": 2, "date": "05/03/2024"}, []),
+    (ADD_SCHEMA, {"item": "Mug", "price": "1,200", "quantity": "3x", "remaining_qty": "1"},
+     {"price": 1200.0, "total_qty": 3, "remaining_qty": 1}, []),
+    (ADD_SCHEMA, {"item": "Mug", "price": "12,50"}, {"price": 12.5, "total_qty": 1}, []),
+    # Required fields: missing or invalid is an error, and the default is kept
+    (ADD_SCHEMA, {"price": 5}, {"item": "Unknown Item"}, ["Missing required field: item"]),
+    (ADD_SCHEMA, {"item": "  ", "price": "free"}, {"item": "Unknown Item", "price": 0.0},
+     ["Missing required field: item", "Invalid price format"]),
+    # Optional fields fall back to their default when invalid
+    (ADD_SCHEMA, {"item": "Mug", "price": 3, "quantity": "-2"}, {"total_qty": 1}, []),
+    (ADD_SCHEMA, {"item": "Mug", "price": 3, "quantity": "2.5"}, {"total_qty": 1}, []),
+    (ADD_SCHEMA, {"item": "Mug", "price": 3, "quantity": 0}, {"total_qty": 1}, []),
+    (ADD_SCHEMA, {"item": "Mug", "price": 3, "remaining_qty": "-3"}, {"remaining_qty": 1}, []),
+    (SALE_SCHEMA, {"item": "Mug", "quantity": "a dozen", "price": "12 pounds", "date": "2024-03-05"},
+     {"sales_item": "Mug", "quantity_sold": 12, "sold_price": 12.0, "date_sold": "05/03/2024"}, []),
+    (SALE_SCHEMA, {"qty": 1}, {"sales_item": ""}, ["Missing required field: sales_item"]),
+    # Dates may be left out (today), but one that was given must parse
+    (SALE_SCHEMA, {"item": "Mug", "date_sold": "the other day"}, {"sales_item": "Mug"},
+     ["Invalid date sold format"]),
+    (ADD_SCHEMA, {"item": "Mug", "price": 3, "date": "31/02/2024"}, {"item": "Mug"}, ["Invalid date format"]),
+    (SALE_SCHEMA, {"item": "Mug", "price": "-5"}, {"sold_price": 0.0}, ["Invalid sold price format"]),
+    (ADD_SCHEMA, {"item": "Mug", "price": "-5"}, {"price": 0.0}, ["Invalid price format"]),
+    (UPDATE_SCHEMA, {"id": "ITEM-7", "restock": "five"},
+     {"update_id": "ITEM-7", "restock_qty": 5, "quantity_sold": None}, []),
+    # The first non-blank value wins when several aliases are given
+    (UPDATE_SCHEMA, {"item": "", "name": "Mug"}, {"update_item_name": "Mug"}, []),
+])
+def test_schema_validate(schema, raw, expected, errors):
+    record = schema.validate(raw)
+
+    assert {name: getattr(record, name) for name in expected} == expected
+    assert record.errors == errors
+    assert record.valid == (not errors)
+
+
+def test_schema_validate_without_defaults():
+    record = SALE_SCHEMA.validate({"item": "Mug", "quantity": "lots"}, defaults=False)
+
+    assert (record.quantity_sold, record.sold_price, record.date_sold) == (None, None, None)
@@ -0,0 +1,21 @@
+from fuzzy_index import FuzzyMatcher, PREFILTER_MIN_CHOICES
+
+
+def test_prefilter_keeps_choices_tied_at_the_cut_off():
+    # Every choice shares the same three words with the query, so the word
+    # index cannot rank them; the best match was added last.
+    choices = [f"Nike Blue Shirt Size {i}" for i in range(PREFILTER_MIN_CHOICES + 500)]
+    choices.append("Nike Blue Shirt")
+    matcher = FuzzyMatcher(choices)
+
+    match, suggestions = matcher.best("nike blue shirt xl")
+
+    assert match == "Nike Blue Shirt"
+    assert suggestions[0] == "Nike Blue Shirt"
+
+
+def test_prefilter_matches_full_scan():
+    choices = [f"Item {i} Red" for i in range(PREFILTER_MIN_CHOICES + 10)] + ["Blue Kettle"]
+    matcher = FuzzyMatcher(choices)
+
+    assert matcher.best("blue kettel")[0] == "Blue Kettle"
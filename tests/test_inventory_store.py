@@ -0,0 +1,160 @@
+import pytest
+
+from bench.fakes import FakeSpreadsheet
+from inventory_store import (
+    COL_BOX_LABEL, COL_ID, COL_ITEM, COL_REMAINING_QTY, COL_RESTOCK_HISTORY, InventoryStore,
+)
+from ledger import StockLedger
+from sheet_writer import SheetWriter, StaleRows
+from storage import SheetsStorage, SQLiteStorage
+
+ROWS = [[f"ITEM-{i}", f"Cap {i}", "", "Shelf A", f"B{i}", "5.00", "3", "3", "01/01/2025", "eBay", ""]
+        for i in range(1, 5)]
+
+
+@pytest.fixture
+def sheet():
+    spreadsheet = FakeSpreadsheet()
+    spreadsheet.load(ROWS)
+    return spreadsheet
+
+
+def _sheets_store(spreadsheet, ttl=300):
+    storage = SheetsStorage(spreadsheet.worksheet("Inventory"), spreadsheet.worksheet("Sales"),
+                            spreadsheet.worksheet("Maintenance"), writer=SheetWriter(window=0))
+    return InventoryStore(storage, ttl=ttl, ledger=StockLedger(":memory:"), flush_interval=0)
+
+
+def _sheet_row(spreadsheet, item_id):
+    return next(row for row in spreadsheet.worksheet("Inventory").rows if row[COL_ID - 1] == item_id)
+
+
+def test_reads_are_served_from_the_cache_until_the_ttl(sheet):
+    store = _sheets_store(sheet)
+    store.refresh()
+    sheet.worksheet("Inventory").rows.append(["ITEM-9", "Cap 9"])
+
+    assert store.find_by_id("ITEM-9") is None
+    assert sheet.worksheet("Inventory").calls["get_all_values"] == 1
+
+    store.invalidate()
+    assert store.find_by_id("ITEM-9") == 6
+
+
+def test_expired_cache_reloads(sheet):
+    store = _sheets_store(sheet, ttl=0)
+    store.refresh()
+    sheet.worksheet("Inventory").rows.append(["ITEM-9", "Cap 9"])
+
+    assert store.find_by_id("ITEM-9") == 6
+
+
+def test_edit_follows_its_item_when_the_sheet_was_reordered(sheet):
+    store = _sheets_store(sheet)
+    store.refresh()
+    row_number = store.find_by_id("ITEM-3")
+    # Someone sorts the sheet by hand, moving ITEM-3 up a row
+    rows = sheet.worksheet("Inventory").rows
+    rows[2], rows[3] = rows[3], rows[2]
+
+    store.update_row(row_number, {COL_BOX_LABEL: "B99"})
+
+    assert _sheet_row(sheet, "ITEM-3")[COL_BOX_LABEL - 1] == "B99"
+    assert _sheet_row(sheet, "ITEM-2")[COL_BOX_LABEL - 1] == "B2"
+    assert store.row(store.find_by_id("ITEM-3"))[COL_BOX_LABEL - 1] == "B99"
+
+
+def test_edit_after_another_worker_appended_and_inserted(sheet):
+    first, second = _sheets_store(sheet), _sheets_store(sheet)
+    first.refresh()
+    second.refresh()
+    first.append_inventory([["ITEM-5", "Cap 5"]])
+    sheet.worksheet("Inventory").rows.insert(1, ["ITEM-6", "Cap 6"])    # a row inserted above the data
+
+    second.update_row(second.find_by_id("ITEM-3"), {COL_BOX_LABEL: "B99"})
+
+    assert _sheet_row(sheet, "ITEM-3")[COL_BOX_LABEL - 1] == "B99"
+    assert _sheet_row(sheet, "ITEM-2")[COL_BOX_LABEL - 1] == "B2"
+
+
+def test_appended_rows_are_indexed_where_the_sheet_put_them(sheet):
+    first, second = _sheets_store(sheet), _sheets_store(sheet)
+    first.refresh()
+    second.refresh()
+    first.append_inventory([["ITEM-5", "Cap 5"]])
+
+    second.append_inventory([["ITEM-6", "Cap 6"]])
+    row_number = second.find_by_id("ITEM-6")
+
+    assert row_number == 7
+    assert sheet.worksheet("Inventory").rows[row_number - 1][COL_ITEM - 1] == "Cap 6"
+    # The row another worker added is picked up too
+    assert second.row(second.find_by_id("ITEM-5"))[COL_ITEM - 1] == "Cap 5"
+
+
+def test_sqlite_edits_check_the_row_too(tmp_path):
+    path = str(tmp_path / "inventory.db")
+    header = ["ID", "Item"]
+    first = InventoryStore(SQLiteStorage(path, mirrored=False), ledger=StockLedger(":memory:"), flush_interval=0)
+    first.storage.replace("inventory", [header] + ROWS)
+    second = InventoryStore(SQLiteStorage(path, mirrored=False), ledger=StockLedger(":memory:"), flush_interval=0)
+    first.refresh()
+    second.refresh()
+    # Another worker rewrites the table with ITEM-3 one row further down
+    first.storage.replace("inventory", [header] + ROWS[:2] + [["ITEM-7", "Cap 7"]] + ROWS[2:])
+
+    second.update_row(second.find_by_id("ITEM-3"), {COL_BOX_LABEL: "B99"})
+
+    rows = first.storage.load(("inventory",))["inventory"]
+    assert rows[4][:2] == ["ITEM-3", "Cap 3"] and rows[4][COL_BOX_LABEL - 1] == "B99"
+    assert rows[3][COL_BOX_LABEL - 1] == ""
+
+
+def test_stock_flush_writes_to_the_row_its_item_is_on_now(sheet):
+    store = _sheets_store(sheet)
+    store.refresh()
+    row_number = store.find_by_id("ITEM-3")
+    rows = sheet.worksheet("Inventory").rows
+    rows[2], rows[3] = rows[3], rows[2]
+
+    store.record_movements([{"row": row_number, "kind": "sale", "remaining": -1,
+                             "sale": ["S1", "Cap 3", 1, 5.0, "01/02/2025", "", None]}])
+
+    assert _sheet_row(sheet, "ITEM-3")[COL_REMAINING_QTY - 1] == "2"
+    assert _sheet_row(sheet, "ITEM-2")[COL_REMAINING_QTY - 1] == "3"
+    assert store.ledger.pending_count() == 0
+
+
+def test_stock_flush_keeps_movements_pending_while_rows_keep_moving(sheet, monkeypatch):
+    store = _sheets_store(sheet)
+    store.refresh()
+
+    def moved(batch):
+        raise StaleRows(store.storage.inventory, [4])
+
+    monkeypatch.setattr(store.storage, "submit", moved)
+    store.record_movements([{"row": store.find_by_id("ITEM-3"), "kind": "sale", "remaining": -1}])
+
+    assert store.ledger.pending_count() == 1
+    assert _sheet_row(sheet, "ITEM-3")[COL_REMAINING_QTY - 1] == "3"
+
+
+def test_old_restock_history_reaches_the_restocks_table_before_the_summary(sheet):
+    sheet.worksheet("Inventory").rows[3][COL_RESTOCK_HISTORY - 1] = "01/02/2024 (x2), 15/03/2024 (x4)"
+    restocks = sheet.add_worksheet("Restocks")
+    restocks.rows = [["Item ID", "Item", "Date", "Quantity"]]
+    storage = SheetsStorage(sheet.worksheet("Inventory"), sheet.worksheet("Sales"), sheet.worksheet("Maintenance"),
+                            restocks, writer=SheetWriter(window=0))
+    store = InventoryStore(storage, ledger=StockLedger(":memory:"), flush_interval=0)
+    store.refresh()
+
+    store.record_movements([{"row": store.find_by_id("ITEM-3"), "kind": "restock", "remaining": 1, "total": 1,
+                             "date": "01/05/2024"}])
+
+    assert restocks.rows[1:] == [["ITEM-3", "Cap 3", "01/02/2024", "2"], ["ITEM-3", "Cap 3", "15/03/2024", "4"],
+                                 ["ITEM-3", "Cap 3", "01/05/2024", "1"]]
+    assert _sheet_row(sheet, "ITEM-3")[COL_RESTOCK_HISTORY - 1] == "Last restock 01/05/2024 (x1), 7 restocked in total"
+    # A reload does not migrate the entries a second time
+    store.refresh()
+    store.flush()
+    assert len(restocks.rows) == 4
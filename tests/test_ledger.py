@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from ledger import InsufficientStock, StockLedger
+
+
+def _sell_concurrently(ledgers, stock, workers=16, attempts=5):
+    """Sell one unit at a time from `workers` threads; returns (sold, refused)."""
+    ledgers[0].record([{"item_id": "ITEM-1", "kind": "adjust", "remaining": 0, "base": (stock, stock, "")}])
+    sold, refused = [], []
+    start = threading.Barrier(workers)
+
+    def worker(ledger):
+        start.wait()
+        for _ in range(attempts):
+            try:
+                sold.append(ledger.record([{"item_id": "ITEM-1", "kind": "sale", "remaining": -1}]))
+            except InsufficientStock:
+                refused.append(1)
+
+    threads = [threading.Thread(target=worker, args=(ledgers[i % len(ledgers)],)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sold, refused
+
+
+def test_concurrent_sales_never_oversell_in_memory():
+    ledger = StockLedger(":memory:")
+    sold, refused = _sell_concurrently([ledger], stock=20)
+
+    assert len(sold) == 20
+    assert len(refused) == 16 * 5 - 20
+    assert ledger.balance("ITEM-1")[0] == 0
+    assert sorted(result[0][0] for result in sold) == list(range(20))
+
+
+def test_concurrent_sales_never_oversell_across_connections(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    ledgers = [StockLedger(path), StockLedger(path)]
+    sold, _ = _sell_concurrently(ledgers, stock=20)
+
+    assert len(sold) == 20
+    assert ledgers[1].balance("ITEM-1")[0] == 0
+
+
+def test_refused_batch_records_nothing():
+    ledger = StockLedger(":memory:")
+    ledger.record([{"item_id": "ITEM-1", "kind": "adjust", "remaining": 0, "base": (1, 1, "")}])
+
+    with pytest.raises(InsufficientStock) as refused:
+        ledger.record([{"item_id": "ITEM-1", "kind": "sale", "remaining": -1},
+                       {"item_id": "ITEM-1", "kind": "sale", "remaining": -1}])
+
+    assert refused.value.position == 1
+    assert ledger.balance("ITEM-1")[0] == 1
+
+
+def test_reserve_is_monotonic():
+    ledger = StockLedger(":memory:")
+
+    assert ledger.reserve("item", 3) == 1
+    assert ledger.reserve("item", 1) == 4
+    assert ledger.peek("item") == 5
+    # A higher floor (e.g. IDs already on the sheet) moves the counter forward...
+    assert ledger.reserve("item", 2, floor=10) == 10
+    # ...but a lower one never moves it back
+    assert ledger.reserve("item", 1, floor=1) == 12
+    assert ledger.reserve("other", 1) == 1
+
+
+def test_concurrent_reserve_hands_out_each_number_once():
+    ledger = StockLedger(":memory:")
+    firsts = []
+
+    def worker():
+        for _ in range(20):
+            firsts.append(ledger.reserve("item", 2))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(firsts) == list(range(1, 8 * 20 * 2, 2))
+
+
+def test_reseed_migrates_old_restock_history_once():
+    ledger = StockLedger(":memory:")
+    history = "01/02/2024 (x2), 15/03/2024 (x4)"
+    ledger.reseed({"ITEM-1": (5, 6, history)}, as_of=0)
+    ledger.reseed({"ITEM-1": (5, 6, history)}, as_of=0)
+
+    assert [(r["date"], r["quantity"]) for r in ledger.restocks("ITEM-1")] == [("2024-02-01", 2), ("2024-03-15", 4)]
+    movements, _ = ledger.claim()
+    assert [(m["kind"], m["data"]) for m in movements] == [
+        ("migrate", {"restocks": [["01/02/2024", 2], ["15/03/2024", 4]]})]
+
+
+def test_restocks_migrated_without_export_are_queued_on_open(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    ledger = StockLedger(path)
+    # As older versions left them: restock records with no movement to copy them to the storage
+    ledger._conn.execute("INSERT INTO balances (item_id, remaining, total) VALUES ('ITEM-1', 5, 6)")
+    ledger._conn.execute("INSERT INTO restocks (item_id, date, quantity) VALUES ('ITEM-1', '2024-02-01', 2)")
+
+    movements, _ = StockLedger(path).claim()
+
+    assert [(m["kind"], m["data"]) for m in movements] == [("migrate", {"restocks": [["01/02/2024", 2]]})]
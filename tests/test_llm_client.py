@@ -0,0 +1,122 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_client import AttemptTimeout, CircuitBreaker, LLMEndpoint, LLMUnavailable, ResilientLLMClient
+
+
+def _failure():
+    return AttemptTimeout("no answer")
+
+
+class FakeClient:
+    """chat.completions.create answering from a script: a value, an exception, or (seconds, value)."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+            step = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(step, tuple):
+            time.sleep(step[0])
+            step = step[1]
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+def _client(*endpoints, **options):
+    options = {"timeout": 1.0, "deadline": 3.0, "retries": 2, "backoff": 0.0, "hedge_after": 0, **options}
+    return ResilientLLMClient(endpoints, **options)
+
+
+def test_retryable_errors_are_retried():
+    fake = FakeClient(_failure(), "answer")
+    llm = _client(LLMEndpoint("primary", fake))
+
+    assert llm.create(model="m", messages=[]) == "answer"
+    assert len(fake.calls) == 2
+
+
+def test_other_errors_are_raised_at_once():
+    fake = FakeClient(ValueError("bad request"), "answer")
+    llm = _client(LLMEndpoint("primary", fake))
+
+    with pytest.raises(ValueError):
+        llm.create(model="m", messages=[])
+    assert len(fake.calls) == 1
+    assert llm.status() == {"primary": "closed"}
+
+
+def test_fallback_endpoint_answers_when_the_primary_fails():
+    primary, fallback = FakeClient(_failure()), FakeClient("from fallback")
+    llm = _client(LLMEndpoint("primary", primary), LLMEndpoint("fallback", fallback, model="small"))
+
+    assert llm.create(model="big", messages=[]) == "from fallback"
+    assert len(primary.calls) == 3
+    assert fallback.calls[0]["model"] == "small"
+
+
+def test_unavailable_when_every_endpoint_fails():
+    llm = _client(LLMEndpoint("primary", FakeClient(_failure())), retries=0)
+
+    with pytest.raises(LLMUnavailable, match="primary: AttemptTimeout"):
+        llm.create(model="m", messages=[])
+
+
+def test_slow_attempts_time_out_within_the_deadline():
+    llm = _client(LLMEndpoint("primary", FakeClient((0.6, "late"))), timeout=0.1, deadline=0.35)
+
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailable, match="AttemptTimeout"):
+        llm.create(model="m", messages=[])
+    assert time.monotonic() - started < 1.0
+
+
+def test_hedged_request_wins_over_a_slow_attempt():
+    fake = FakeClient((0.6, "slow"), "fast")
+    llm = _client(LLMEndpoint("primary", fake), hedge_after=0.05)
+
+    started = time.monotonic()
+    assert llm.create(model="m", messages=[]) == "fast"
+    assert time.monotonic() - started < 0.5
+    assert len(fake.calls) == 2
+
+
+def test_breaker_opens_after_repeated_failures_and_lets_one_trial_through():
+    breaker = CircuitBreaker("primary", failures=2, reset_after=0.1)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.12)
+    assert breaker.allow()           # the trial call
+    assert not breaker.allow()       # only one at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_skips_the_endpoint_without_calling_it():
+    primary, fallback = FakeClient(_failure()), FakeClient("from fallback")
+    endpoint = LLMEndpoint("primary", primary)
+    endpoint.breaker = CircuitBreaker("primary", failures=1, reset_after=60)
+    llm = _client(endpoint, LLMEndpoint("fallback", fallback))
+
+    assert llm.create(model="m", messages=[]) == "from fallback"
+    assert llm.create(model="m", messages=[]) == "from fallback"
+    assert len(primary.calls) == 1
+    assert llm.status()["primary"] == "open"
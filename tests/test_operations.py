@@ -0,0 +1,34 @@
+import pytest
+
+from inventory_store import COL_ITEM, COL_REMAINING_QTY, COL_TOTAL_QTY
+from operations import _apply_one
+
+
+def _row(stock=10):
+    row = [""] * COL_REMAINING_QTY
+    row[COL_ITEM - 1] = "Mug"
+    row[COL_TOTAL_QTY - 1] = str(stock)
+    row[COL_REMAINING_QTY - 1] = str(stock)
+    return row
+
+
+def test_sale_fields_go_through_the_extraction_coercions():
+    movements = []
+    _apply_one({"action": "sale", "quantity": "two", "sold_price": "£1,200",
+                "date_sold": "5th March 2024"}, _row(), movements)
+
+    sale = movements[0]["sale"]
+    assert sale[2:5] == [2, 1200.0, "05/03/2024"]
+    assert movements[0]["remaining"] == -2
+
+
+@pytest.mark.parametrize("op, error", [
+    ({"action": "sale", "quantity": "-2"}, "Sale quantity must be a positive number"),
+    ({"action": "sale", "sold_price": "lots"}, "Invalid sold price format"),
+    ({"action": "sale", "date_sold": "someday"}, "Invalid date sold format"),
+    ({"action": "restock"}, "Restock quantity must be a positive number"),
+    ({"action": "restock", "quantity": "2.5"}, "Restock quantity must be a positive number"),
+])
+def test_invalid_fields_are_reported(op, error):
+    with pytest.raises(ValueError, match=error):
+        _apply_one(op, _row(), [])
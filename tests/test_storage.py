@@ -0,0 +1,144 @@
+import pytest
+
+from bench.fakes import FakeSpreadsheet
+from sheet_writer import SheetWriter, StaleRows
+from storage import HEADERS, SheetsMirror, SheetsStorage, SQLiteStorage
+
+ROWS = [[f"ITEM-{i}", f"Cap {i}", "", "Shelf A", f"B{i}", "5.00", "3", "3", "01/01/2025", "eBay", ""]
+        for i in range(1, 4)]
+
+
+@pytest.fixture
+def sheet():
+    spreadsheet = FakeSpreadsheet()
+    spreadsheet.load(ROWS, maintenance=[["Shelf A", "B1"]])
+    spreadsheet.add_worksheet("Restocks").rows = [HEADERS["restocks"]]
+    return spreadsheet
+
+
+def _sheets(spreadsheet):
+    return SheetsStorage(spreadsheet.worksheet("Inventory"), spreadsheet.worksheet("Sales"),
+                         spreadsheet.worksheet("Maintenance"), spreadsheet.worksheet("Restocks"),
+                         writer=SheetWriter(window=0))
+
+
+def _write(storage, cells=None, appends=None, expected=None):
+    batch = storage.batch()
+    for (row_number, col), value in (cells or {}).items():
+        batch.update_row("inventory", row_number, {col: value})
+    if appends:
+        batch.append_rows("inventory", appends)
+    for (row_number, col), value in (expected or {}).items():
+        batch.expect("inventory", row_number, col, value)
+    storage.submit(batch)
+    return batch
+
+
+def test_sqlite_is_seeded_from_the_sheets_storage_once(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+
+    tables = storage.load()
+    sheet.worksheet("Inventory").rows.append(["ITEM-9"])
+    storage.load()
+
+    assert tables["inventory"][1:] == ROWS
+    assert tables["maintenance"][0][:2] == ["Shelf A", "B1"]
+    assert sheet.worksheet("Inventory").calls["get_all_values"] == 1
+    assert storage.pending_changes() == 0    # seeded rows are already in the spreadsheet
+
+
+def test_sqlite_writes_are_applied_and_logged(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+
+    batch = _write(storage, cells={(2, 5): "B9"}, appends=[["ITEM-4", "Cap 4"], ["ITEM-5", "Cap 5"]])
+    inventory = storage.load()["inventory"]
+
+    assert batch.appended_rows == {"inventory": [5, 6]}
+    assert inventory[1][4] == "B9"
+    assert inventory[4][:2] == ["ITEM-4", "Cap 4"] and inventory[5][0] == "ITEM-5"
+    assert [(c["row"], c["op"]) for c in storage.claim_changes()] == [(2, "update"), (5, "append"), (6, "append")]
+
+
+def test_sqlite_writes_nothing_when_an_expected_cell_differs(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+
+    with pytest.raises(StaleRows) as raised:
+        _write(storage, cells={(2, 5): "B9"}, appends=[["ITEM-4"]], expected={(2, 1): "ITEM-2"})
+
+    assert raised.value.rows == {2}
+    assert storage.load()["inventory"][1:] == ROWS
+    assert storage.pending_changes() == 0
+
+
+def test_unmirrored_storage_logs_nothing():
+    storage = SQLiteStorage(":memory:", mirrored=False)
+    storage.load()
+
+    _write(storage, appends=[["ITEM-1", "Cap 1"]])
+
+    assert storage.load()["inventory"][1][:2] == ["ITEM-1", "Cap 1"]
+    assert storage.pending_changes() == 0
+
+
+def test_mirror_copies_appends_and_edits_to_the_spreadsheet(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+    mirror = SheetsMirror(storage, _sheets(sheet), interval=0)
+
+    _write(storage, cells={(2, 5): "B9"}, appends=[["ITEM-4", "Cap 4"]])
+    _write(storage, cells={(5, 7): "1"})    # edits the appended row before it is copied
+
+    assert mirror.sync() == 3
+    rows = sheet.worksheet("Inventory").rows
+    assert rows[1][4] == "B9"
+    assert rows[4][:2] == ["ITEM-4", "Cap 4"] and rows[4][6] == "1"
+    assert sheet.worksheet("Inventory").calls["append_rows"] == 1
+    assert storage.pending_changes() == 0
+    assert mirror.sync() == 0
+
+
+def test_failed_copy_is_retried_on_the_next_sync(sheet, monkeypatch):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+    mirror = SheetsMirror(storage, _sheets(sheet), interval=0)
+    _write(storage, appends=[["ITEM-4", "Cap 4"]])
+
+    def quota_exceeded(*args, **kwargs):
+        raise RuntimeError("quota exceeded")
+    monkeypatch.setattr(sheet.worksheet("Inventory"), "append_rows", quota_exceeded)
+    with pytest.raises(RuntimeError):
+        mirror.sync()
+
+    assert mirror.last_error == "quota exceeded"
+    assert storage.pending_changes() == 1
+    assert len(sheet.worksheet("Inventory").rows) == 4
+
+    monkeypatch.undo()
+    assert mirror.sync() == 1
+    assert sheet.worksheet("Inventory").rows[4][0] == "ITEM-4"
+    assert mirror.last_error is None
+
+
+def test_a_claim_is_not_handed_out_twice(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+    _write(storage, appends=[["ITEM-4"]])
+
+    changes = storage.claim_changes()
+
+    assert storage.claim_changes() == []
+    storage.release_changes(changes)
+    assert [c["seq"] for c in storage.claim_changes()] == [c["seq"] for c in changes]
+
+
+def test_pull_replaces_the_table_with_the_spreadsheet_copy(sheet):
+    storage = SQLiteStorage(":memory:", seed=_sheets(sheet))
+    storage.load()
+    mirror = SheetsMirror(storage, _sheets(sheet), interval=0)
+    sheet.worksheet("Maintenance").rows.append(["Shelf B", "B2"])
+
+    assert mirror.pull("maintenance") == 2
+    assert [row[:2] for row in storage.load()["maintenance"]] == [["Shelf A", "B1"], ["Shelf B", "B2"]]
+    assert storage.pending_changes() == 0
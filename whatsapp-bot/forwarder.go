@@ -0,0 +1,228 @@
+package main
+
+import (
+	"bytes"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"log"
+	"net"
+	"net/http"
+	"sync"
+	"time"
+)
+
+// ErrBusy is returned by Submit when the queue is full; the sender should try again later.
+var ErrBusy = errors.New("forwarder queue is full")
+
+// ErrClosed is returned by Submit after Close.
+var ErrClosed = errors.New("forwarder is closed")
+
+// Command is one chat message to run, and where its reply goes.
+type Command struct {
+	Sender string
+	Text   string
+	Reply  func(text string)
+}
+
+// Forwarder sends chat messages to the inventory app's /api/command endpoint
+// and hands back the replies.
+//
+// Messages from one sender are run strictly in order, one at a time, so "sold 2"
+// followed by "stock" always sees the sale. Different senders are served in
+// parallel by a fixed pool of workers that share one keep-alive connection pool.
+// At most maxQueued messages may be waiting or in flight; beyond that Submit
+// fails fast with ErrBusy instead of letting a burst pile up without limit.
+type Forwarder struct {
+	url       string
+	token     string
+	client    *http.Client
+	maxQueued int
+	retries   int
+
+	mu     sync.Mutex
+	idle   *sync.Cond
+	queues map[string][]Command // sender -> pending messages; present while scheduled or running
+	queued int
+	closed bool
+	ready  chan string // senders with pending messages, waiting for a worker
+	wg     sync.WaitGroup
+}
+
+// NewForwarder starts `workers` workers posting to url (with a Bearer token when token is set).
+func NewForwarder(url, token string, workers, maxQueued int, timeout time.Duration) *Forwarder {
+	transport := &http.Transport{
+		Proxy:               http.ProxyFromEnvironment,
+		DialContext:         (&net.Dialer{Timeout: 5 * time.Second, KeepAlive: 30 * time.Second}).DialContext,
+		MaxIdleConns:        workers,
+		MaxIdleConnsPerHost: workers,
+		MaxConnsPerHost:     workers,
+		IdleConnTimeout:     90 * time.Second,
+	}
+	f := &Forwarder{
+		url:       url,
+		token:     token,
+		client:    &http.Client{Transport: transport, Timeout: timeout},
+		maxQueued: maxQueued,
+		retries:   2,
+		queues:    make(map[string][]Command),
+		// Never blocks: each scheduled sender has at least one queued message
+		ready: make(chan string, maxQueued),
+	}
+	f.idle = sync.NewCond(&f.mu)
+	for i := 0; i < workers; i++ {
+		f.wg.Add(1)
+		go f.work()
+	}
+	return f
+}
+
+// Submit queues a message behind any earlier ones from the same sender.
+func (f *Forwarder) Submit(cmd Command) error {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	if f.closed {
+		return ErrClosed
+	}
+	if f.queued >= f.maxQueued {
+		return ErrBusy
+	}
+	pending, scheduled := f.queues[cmd.Sender]
+	f.queues[cmd.Sender] = append(pending, cmd)
+	f.queued++
+	if !scheduled {
+		f.ready <- cmd.Sender
+	}
+	return nil
+}
+
+// Close stops accepting messages and waits (up to timeout) for the queued ones to be answered.
+func (f *Forwarder) Close(timeout time.Duration) {
+	f.mu.Lock()
+	f.closed = true
+	f.mu.Unlock()
+
+	drained := make(chan struct{})
+	go func() {
+		f.mu.Lock()
+		for f.queued > 0 {
+			f.idle.Wait()
+		}
+		f.mu.Unlock()
+		close(f.ready) // nothing is queued, so no worker will reschedule a sender
+		f.wg.Wait()
+		close(drained)
+	}()
+	select {
+	case <-drained:
+	case <-time.After(timeout):
+		log.Printf("Forwarder closed with %d messages unanswered", f.Queued())
+	}
+}
+
+// Queued is the number of messages waiting or in flight.
+func (f *Forwarder) Queued() int {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	return f.queued
+}
+
+func (f *Forwarder) work() {
+	defer f.wg.Done()
+	for sender := range f.ready {
+		f.mu.Lock()
+		cmd := f.queues[sender][0]
+		f.mu.Unlock()
+
+		cmd.Reply(f.forward(cmd))
+
+		f.mu.Lock()
+		rest := f.queues[sender][1:]
+		if len(rest) == 0 {
+			delete(f.queues, sender)
+		} else {
+			f.queues[sender] = rest
+			// Back of the line, so one busy sender can't hold a worker while others wait
+			f.ready <- sender
+		}
+		f.queued--
+		if f.queued == 0 {
+			f.idle.Broadcast()
+		}
+		f.mu.Unlock()
+	}
+}
+
+type commandRequest struct {
+	Text   string `json:"text"`
+	Sender string `json:"sender"`
+}
+
+type commandResponse struct {
+	OK    bool   `json:"ok"`
+	Reply string `json:"reply"`
+	Error string `json:"error"`
+}
+
+// forward posts one command and returns the text to send back. Failed
+// connections and 503s are retried with backoff, as the app never saw or
+// didn't apply those; anything else that fails (a timeout, say) may have been
+// applied, so it is reported rather than sent again.
+func (f *Forwarder) forward(cmd Command) string {
+	body, _ := json.Marshal(commandRequest{Text: cmd.Text, Sender: cmd.Sender})
+	var lastErr error
+	for attempt := 0; attempt <= f.retries; attempt++ {
+		if attempt > 0 {
+			time.Sleep(time.Duration(attempt) * time.Second)
+		}
+		result, status, err := f.post(body)
+		switch {
+		case err != nil && isDialError(err):
+			lastErr = err
+			continue
+		case err != nil:
+			log.Printf("Command from %s failed: %v", cmd.Sender, err)
+			return "Sorry, no answer from the inventory app in time. Check with 'stock' before sending that again."
+		case status == http.StatusServiceUnavailable && attempt < f.retries:
+			lastErr = fmt.Errorf("status %d", status)
+			continue
+		case result.Reply != "":
+			return result.Reply
+		case result.Error != "":
+			return "Sorry, that didn't work: " + result.Error
+		default:
+			return fmt.Sprintf("Sorry, the inventory app answered %d.", status)
+		}
+	}
+	log.Printf("Command from %s failed: %v", cmd.Sender, lastErr)
+	return "Sorry, the inventory app isn't answering. Please send that again later."
+}
+
+func (f *Forwarder) post(body []byte) (commandResponse, int, error) {
+	var result commandResponse
+	req, err := http.NewRequest(http.MethodPost, f.url, bytes.NewReader(body))
+	if err != nil {
+		return result, 0, err
+	}
+	req.Header.Set("Content-Type", "application/json")
+	if f.token != "" {
+		req.Header.Set("Authorization", "Bearer "+f.token)
+	}
+	resp, err := f.client.Do(req)
+	if err != nil {
+		return result, 0, err
+	}
+	defer resp.Body.Close()
+	err = json.NewDecoder(resp.Body).Decode(&result)
+	io.Copy(io.Discard, resp.Body) // read to the end so the connection goes back to the pool
+	if err != nil && resp.StatusCode < 300 {
+		return result, resp.StatusCode, err
+	}
+	return result, resp.StatusCode, nil
+}
+
+func isDialError(err error) bool {
+	var opErr *net.OpError
+	return errors.As(err, &opErr) && opErr.Op == "dial"
+}
@@ -2,8 +2,14 @@ package main
 
 import (
 	"context"
+	"errors"
 	"fmt"
 	"log"
+	"os"
+	"os/signal"
+	"strconv"
+	"strings"
+	"syscall"
 	"time"
 
 	"go.mau.fi/whatsmeow"
@@ -46,14 +52,77 @@ func strPtr(s string) *string {
 	return &s
 }
 
-func eventHandler(evt interface{}) {
-	switch v := evt.(type) {
-	case *events.Message:
-		message := v.Message.GetConversation()
-		senderJID := v.Info.Sender
-		fmt.Printf("Incoming message from %s: %s\n", senderJID.User, message)
-	default:
-		// handle other events as needed
+// Helper: read an environment variable, with a default
+func getenv(key, fallback string) string {
+	if value := os.Getenv(key); value != "" {
+		return value
+	}
+	return fallback
+}
+
+func getenvInt(key string, fallback int) int {
+	value, err := strconv.Atoi(os.Getenv(key))
+	if err != nil || value <= 0 {
+		return fallback
+	}
+	return value
+}
+
+// Helper: the phone numbers allowed to send commands (empty allows everyone)
+func allowedSenders() map[string]bool {
+	allowed := make(map[string]bool)
+	for _, number := range strings.Split(os.Getenv("BOT_ALLOWED_SENDERS"), ",") {
+		if number = strings.TrimPrefix(strings.TrimSpace(number), "+"); number != "" {
+			allowed[number] = true
+		}
+	}
+	return allowed
+}
+
+// newEventHandler forwards text messages from allowed senders to the inventory
+// app and sends each reply back to the chat the message came from.
+func newEventHandler(client *whatsmeow.Client, forwarder *Forwarder, allowed map[string]bool) func(interface{}) {
+	reply := func(chat types.JID, text string) {
+		msg := &waProto.Message{Conversation: strPtr(text)}
+		if _, err := client.SendMessage(context.Background(), chat, msg, whatsmeow.SendRequestExtra{}); err != nil {
+			log.Printf("Send message error: %v", err)
+		}
+	}
+
+	return func(evt interface{}) {
+		switch v := evt.(type) {
+		case *events.Message:
+			if v.Info.IsFromMe {
+				return
+			}
+			sender := v.Info.Sender.User
+			if len(allowed) > 0 && !allowed[sender] {
+				fmt.Printf("Ignoring message from %s\n", sender)
+				return
+			}
+			text := v.Message.GetConversation()
+			if text == "" {
+				text = v.Message.GetExtendedTextMessage().GetText()
+			}
+			if strings.TrimSpace(text) == "" {
+				return
+			}
+			fmt.Printf("Incoming message from %s: %s\n", sender, text)
+
+			chat := v.Info.Chat
+			err := forwarder.Submit(Command{
+				Sender: sender,
+				Text:   text,
+				Reply:  func(answer string) { reply(chat, answer) },
+			})
+			if errors.Is(err, ErrBusy) {
+				go reply(chat, "Busy right now, please send that again in a minute.")
+			} else if err != nil {
+				log.Printf("Dropped message from %s: %v", sender, err)
+			}
+		default:
+			// handle other events as needed
+		}
 	}
 }
 
@@ -71,9 +140,22 @@ func main() {
 		log.Fatalf("Device store error: %v", err)
 	}
 
+	// Forward commands to the inventory app over a pool of keep-alive connections
+	forwarder := NewForwarder(
+		getenv("INVENTORY_API_URL", "http://127.0.0.1:5000/api/command"),
+		os.Getenv("INVENTORY_API_TOKEN"),
+		getenvInt("BOT_WORKERS", 8),
+		getenvInt("BOT_QUEUE", 256),
+		time.Duration(getenvInt("BOT_TIMEOUT", 60))*time.Second,
+	)
+	allowed := allowedSenders()
+	if len(allowed) == 0 {
+		log.Printf("BOT_ALLOWED_SENDERS is not set: commands from any number will be run")
+	}
+
 	// Create a new client
 	client := whatsmeow.NewClient(deviceStore, dbLog)
-	client.AddEventHandler(eventHandler)
+	client.AddEventHandler(newEventHandler(client, forwarder, allowed))
 
 	if client.Store.ID == nil {
 		// Need to scan QR
@@ -99,29 +181,11 @@ func main() {
 		}
 	}
 
-	// Send a test message after 5 seconds
-	go func() {
-		time.Sleep(5 * time.Second)
-
-		testJID, err := types.ParseJID("447808025786@s.whatsapp.net")
-		if err != nil {
-			log.Printf("Invalid JID: %v", err)
-			return
-		}
-
-		msg := &waProto.Message{
-			Conversation: strPtr("Hello from the updated WhatsMeow bot!"),
-		}
-
-		// 4th argument is the optional SendRequestExtra
-		sendResp, err := client.SendMessage(context.Background(), testJID, msg, whatsmeow.SendRequestExtra{})
-		if err != nil {
-			log.Printf("Send message error: %v", err)
-		} else {
-			log.Printf("Message sent; server timestamp: %v", sendResp.Timestamp)
-		}
-	}()
-
-	// Keep running
-	select {}
+	// Run until interrupted, then answer what is already queued before exiting
+	stop := make(chan os.Signal, 1)
+	signal.Notify(stop, os.Interrupt, syscall.SIGTERM)
+	<-stop
+	fmt.Println("Shutting down...")
+	forwarder.Close(30 * time.Second)
+	client.Disconnect()
 }